@@ -1,20 +1,125 @@
 import os
+import sys
+import inspect
+import json
 import numpy as np
 import numpy.ctypeslib as ctl
 import traceback
+import threading
 import ctypes
 from ctypes import *
 
+import simulatedHardware
+import qualityFlags
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+with open("config.json") as f:
+    config_file = json.load(f)
+
+# the voltages each pressure guage gives within its measuring range. Voltages
+# outside of these are set to the limit when converting them to a pressure.
+MC_voltage_limits = (0.774, 10)
+DL_voltage_limits = (1.2, 8.8)
+
+def MC_pressure_from_voltage(V):
+    """
+    Converts the main chamber guage voltage into a pressure in mbar.
+
+    This uses an Infinicon PBR 260 compact full range guage. See page 29
+    (appendix A) of the guage's manual for the details on converting the
+    measured voltage into a pressure. Over or under range voltages are set to
+    the limit.
+    """
+    V = min(max(V, MC_voltage_limits[0]), MC_voltage_limits[1])
+    return 10**((V-7.75)/0.75)
+
+def DL_pressure_from_voltage(V):
+    """
+    Converts the dosing line guage voltage into a pressure in mbar.
+
+    This uses a ThyrCont VSR53/54MV guage. See page 24 of the guage's manual
+    for details on converting the measured voltage into a pressure. Over or
+    under range voltages are set to the limit.
+    """
+    V = min(max(V, DL_voltage_limits[0]), DL_voltage_limits[1])
+    return 10**(V-5.5)
+
+# The values we register with ConSys, in the order ConSys indexes them. Each
+# entry is (ConSys parameter, buffer column name, conversion), where the
+# conversion turns the raw ConSys value into the value we store, or is None if
+# the raw value is stored as-is.
+register_table = [
+    ('PLCAI1uv1.adc', 'MC Pressure (mbar)', MC_pressure_from_voltage),    # 0
+    ('PLCAI2uv1.adc', 'DL Pressure (mbar)', DL_pressure_from_voltage),    # 1
+    ('MONOuv1.cwl', 'Wavelength (nm)', None),        # 2 monochromator
+    ('MONOuv1.whichGr', 'Grating', None),            # 3 the grating being used
+    ('TABLEPOSuv1.rPos', 'Table_Pos', None),         # 4 the table position
+    ('ENSuv1.rPos', 'ENS_rPos', None),               # 5 entrance slit position
+    ('EXSuv1.rPos', 'EXS_rPos', None),               # 6 exit slit position
+    ('CRIO02AI0uv1.average', 'Ch0 (V)', None),       # 7
+    ('CRIO02AI1uv1.average', 'Ch1 (V)', None),       # 8
+    ('CRIO02AI2uv1.average', 'Ch2 (V)', None),       # 9
+    ('CRIO02AI3uv1.average', 'Ch3 (V)', None),       # 10
+    ('CRIO02AI0uv1.NumToAverage', 'n_avg', None),    # 11 data blocks to average
+    ('A2BeamCurrent.normal', 'Beam_current', None),  # 12 ASTRID2 beam current
+    ('PLCDO0uv1.out1', 'PMTVac', None),              # 13 PMTVac on or off
+    ('MO1E_SCANuv1.rPos', 'Z_Motor', None),          # 14 Z_motor position in mm
+    ('CRIO02AVGuv1.blockTime', 't_block', None),     # 15 cRIO block time
+    ('A2SAOrbitControl.UBX_Xavg', 'UBX_x', None),    # 16 beam position in x
+    ('MRS441CAMast2.h', 'MRS_h', None),              # 17 MRS 441 camera height
+]
+
+# The raw values outside of which a register's converted value is clipped, as
+# (lower, upper) keyed by buffer column. See qualityFlags.CLIPPED.
+clipped_registers = {
+    'MC Pressure (mbar)':MC_voltage_limits,
+    'DL Pressure (mbar)':DL_voltage_limits,
+}
+
+# The registers which don't need reading every poll, since they change at most
+# once per scan, as (interval in seconds, on change) keyed by buffer column.
+# They are read every interval, and every poll for a while after they change.
+# See devicePoller.DevicePoller.
+slow_registers = {
+    'Grating':(10, True),
+    'Table_Pos':(10, True),
+    'ENS_rPos':(10, True),
+    'EXS_rPos':(10, True),
+    'n_avg':(10, True),
+    'PMTVac':(10, True),
+    't_block':(10, True),
+}
+
 class ConSysInterface():
     def __init__(self, debug):
         """
         """
         self.debug = debug
+        # the buffer columns read_all() returns values for, in order, and the
+        # registers which need converting after being read
+        self.columns = [column for _, column, _ in register_table]
+        self.n_registers = len(register_table)
+        self._conversions = [(i, conversion) for i, (_, _, conversion)
+                             in enumerate(register_table)
+                             if conversion is not None]
+        # the lower and upper raw limits of every register, which are
+        # infinite for those which are never clipped
+        self._raw_limits = np.array([clipped_registers.get(column,
+                                                           (-np.inf, np.inf))
+                                     for column in self.columns])
+        self.channel_intervals = dict(slow_registers)
+        self._lock = threading.Lock()
         # load the ConSys API
         self.libname = "CSAPI.dll"
         self.libdir = "C:/Program Files/ConSys/"
         try:
-            self.CSAPI = ctl.load_library(self.libdir+self.libname, self.libdir)
+            if config_file.get("simulate_hardware", False):
+                self.CSAPI = simulatedHardware.CSAPI_library(config_file)
+            else:
+                self.CSAPI = ctl.load_library(self.libdir+self.libname,
+                                              self.libdir)
             # set our data types for the functions we will use
             self.CSAPI.RegisterParameterStringEx1.restype = c_long
             self.CSAPI.RegisterParameterStringEx1.argtypes = [c_char_p, c_int,
@@ -25,34 +130,11 @@ class ConSysInterface():
             # ConSys only lets us register a few parameters, however within
             # those parameters we can have as many values as we need.
 
-            # Which values do we want to register?
-            reg_values = [
-                'PLCAI1uv1.adc',    # 0 voltage for the main chamber pressure
-                'PLCAI2uv1.adc',    # 1 voltage for the dosing line pressure
-                'MONOuv1.cwl',      # 2 wavelength measured by the monochromator
-                'MONOuv1.whichGr',  # 3 the grating being used
-                'TABLEPOSuv1.rPos', # 4 the table position
-                'ENSuv1.rPos',      # 5 the entrance slit position
-                'EXSuv1.rPos',      # 6 the exit slit position
-                'CRIO02AI0uv1.average',  # 7 Ch0/V
-                'CRIO02AI1uv1.average',  # 8 Ch1/V
-                'CRIO02AI2uv1.average',  # 9 Ch2/V
-                'CRIO02AI3uv1.average',  # 10 Ch3/V
-                'CRIO02AI0uv1.NumToAverage', # 11 data blocks to average
-                'A2BeamCurrent.normal',   # 12 ASTRID2 beam current
-                'PLCDO0uv1.out1',    # 13 PMTVac on or off
-                'MO1E_SCANuv1.rPos',  # 14 Z_motor position in mm
-                'CRIO02AVGuv1.blockTime', # 15 cRIO block time 
-                'A2SAOrbitControl.UBX_Xavg', # 16 UBX_x the beam position in x
-                'MRS441CAMast2.h', # 17 MRS_h Camera MRS 441 vertical height
-            ]
-
-            #regStr = b'PLCAI1uv1.adc PLCAI2uv1.adc MONOuv1.cwl'
-            
-            # construct our parameter string for registration
+            # construct our parameter string for registration from the
+            # register table
             valStr = ''
-            for value in reg_values:
-                valStr += value + " "
+            for parameter, column, conversion in register_table:
+                valStr += parameter + " "
             # encode the string of values to bytes
             regStr = valStr[:-1].encode()
 
@@ -297,15 +379,7 @@ class ConSysInterface():
         # get the sensor voltage from ConSys
         V = self.CSAPI.GetValue(self.LShandle1, 0)
 
-        # check if we are over or under range, just set the value to the limit
-        if V < 0.774:
-            V = 0.774
-        elif V > 10:
-            V = 10
-        
-        P = 10**((V-7.75)/0.75)
-
-        return P
+        return MC_pressure_from_voltage(V)
 
     def get_wavelength(self):
         """
@@ -336,15 +410,7 @@ class ConSysInterface():
         # Get the sensor voltage from ConSys
         V = self.CSAPI.GetValue(self.LShandle1, 1)
 
-        # check if we are over or under range, just set the value to the limit
-        if V < 1.2:
-            V = 1.2
-        elif V > 8.8:
-            V = 8.8
-
-        P = 10**(V-5.5)
-
-        return P
+        return DL_pressure_from_voltage(V)
 
     def get_DL_pressure_IMR265(self):
         """
@@ -382,6 +448,57 @@ class ConSysInterface():
 
         return P
 
+    def read_channels(self, indices):
+        """
+        Returns the values of the given registers (indices into the register
+        table, and so into self.columns) as one numpy array in the same order
+        as the indices, with the conversions already applied, along with an
+        array of their quality flags. If ConSys is not connected, every value
+        is NaN and flagged NO_SIGNAL. Pressures whose guage voltage was out of
+        range are flagged CLIPPED.
+
+        GetValue reads a single register, so this still makes one call into
+        the ConSys API per register, all under one hold of the lock. What it
+        saves over calling each of the get_ functions in turn is the python
+        around those calls: the connection is checked once, and the flags and
+        conversions are worked out for all of the values together.
+        """
+        values = np.full(len(indices), np.nan)
+        if self.CSAPI == None:
+            if self.debug:
+                print("ConSys connection not open")
+            return values, np.full(len(indices), qualityFlags.NO_SIGNAL,
+                                   dtype=np.uint8)
+
+        # look these up once, rather than once per register
+        GetValue = self.CSAPI.GetValue
+        handle = self.LShandle1
+        # the registers may be read from more than one thread, see
+        # hardwareManager's burst sampling
+        with self._lock:
+            for j, i in enumerate(indices):
+                values[j] = GetValue(handle, i)
+        # the limits are checked before converting, as the conversion clips
+        limits = self._raw_limits[list(indices)]
+        flags = np.where((values < limits[:, 0]) | (values > limits[:, 1]),
+                         qualityFlags.CLIPPED, 0)
+        flags[np.isnan(values)] = qualityFlags.NO_SIGNAL
+        positions = {i:j for j, i in enumerate(indices)}
+        for i, conversion in self._conversions:
+            if i in positions:
+                values[positions[i]] = conversion(values[positions[i]])
+
+        return values, flags.astype(np.uint8)
+
+    def read_all(self):
+        """
+        Returns every value in the register table as one numpy array, in the
+        same order as self.columns, with the conversions already applied. If
+        ConSys is not connected, every value is NaN. Like read_channels, this
+        makes one GetValue call per register.
+        """
+        return self.read_channels(range(self.n_registers))[0]
+
     def close(self):
         """
         It is important to run this when the program ends, to ensure stability!
@@ -0,0 +1,57 @@
+import types
+
+import numpy as np
+
+class BufferSnapshot():
+    """
+    An immutable picture of the hardware manager's buffer, which the
+    collector publishes once per tick for the GUI to read. Getting the
+    current snapshot is just reading an attribute, and everything in it is
+    worked out once when it is published, rather than by every display which
+    wants the latest values.
+
+    Each snapshot has a version number, which goes up by one with every
+    snapshot published, so a display can skip redrawing when the version
+    hasn't changed since it last looked:
+
+        snapshot = hardwareManager.snapshot
+        if snapshot.version == self._snapshot_version:
+            return None
+        self._snapshot_version = snapshot.version
+
+    The columns are read-only views of the buffer rather than copies. The
+    buffer never changes a view once it has been taken, so they stay valid
+    however long the snapshot is kept.
+    """
+    def __init__(self, version, columns, flags):
+        """
+        version : (int) The number of this snapshot.
+        columns : (dict) Read-only views of every stored column of the buffer,
+            keyed by column name, see RingBuffer.views.
+        flags : (dict) Read-only views of the quality flags of the columns,
+            lined up with them.
+        """
+        self.version = version
+        self.columns = types.MappingProxyType(columns)
+        self.flags = types.MappingProxyType(flags)
+        self.length = len(next(iter(columns.values()), ()))
+        # the newest row, and its flags, which are NaN and 0 if the buffer is
+        # empty
+        if self.length > 0:
+            latest = {col:float(values[-1]) for col, values in columns.items()}
+            latest_flags = {col:int(values[-1]) for col, values
+                            in flags.items()}
+        else:
+            latest = {col:np.nan for col in columns}
+            latest_flags = {col:0 for col in flags}
+        self.latest = types.MappingProxyType(latest)
+        self.latest_flags = types.MappingProxyType(latest_flags)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, column):
+        """
+        Returns the view of a whole column, oldest first
+        """
+        return self.columns[column]
@@ -0,0 +1,294 @@
+import os
+import re
+import threading
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from ringBuffer import local_datetimes
+
+# the first line of every partition, which is rewritten in place as rows are
+# added, so it is always the same length
+INDEX_FORMAT = "# first {:17.6f} last {:17.6f} rows {:10d}\n"
+INDEX_PATTERN = re.compile(r"# first\s+(\S+) last\s+(\S+) rows\s+(\d+)")
+
+def partition_name(date, part):
+    """
+    Returns the file name of a partition: "<date>.csv" for the first of its
+    day, then "<date>_1.csv", "<date>_2.csv", ...
+    """
+    if part == 0:
+        return f"{date}.csv"
+    return f"{date}_{part}.csv"
+
+def read_index(path):
+    """
+    Returns the first and last timestamps and the number of rows of a
+    partition, from its index line, or None if it doesn't have one (such as
+    a dump from before the archive was partitioned).
+    """
+    with open(path) as f:
+        match = INDEX_PATTERN.match(f.readline())
+    if match is None:
+        return None
+    return float(match[1]), float(match[2]), int(match[3])
+
+def partitions_between(directory, t0, t1):
+    """
+    Returns the paths of the partitions in a directory which hold rows with
+    t0 < Timestamp < t1, oldest first. Only their index lines are read.
+
+    directory : (str) The archive directory.
+    t0, t1 : (float) The time range, as unix timestamps.
+    """
+    found = []
+    for name in os.listdir(directory):
+        if not name.endswith(".csv"):
+            continue
+        path = os.path.join(directory, name)
+        index = read_index(path)
+        if index is not None and index[1] > t0 and index[0] < t1:
+            found.append((index[0], path))
+    return [path for _, path in sorted(found)]
+
+def read_between(directory, t0, t1, columns=None):
+    """
+    Returns a pandas DataFrame of the archived rows with t0 < Timestamp < t1,
+    reading only the partitions which overlap the time range.
+
+    directory : (str) The archive directory.
+    t0, t1 : (float) The time range, as unix timestamps.
+    columns : (list) The columns wanted. Defaults to all of them.
+    """
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(['Timestamp'] + list(columns)))
+    frames = []
+    for path in partitions_between(directory, t0, t1):
+        df = pd.read_csv(path, skiprows=1, usecols=usecols)
+        frames.append(df[(df['Timestamp'] > t0) & (df['Timestamp'] < t1)])
+    if len(frames) == 0:
+        return pd.DataFrame(columns=usecols)
+    df = pd.concat(frames, ignore_index=True)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+class BufferWriter():
+    """
+    Saves the hardware manager's buffer to an archive of CSV files as it fills
+    up. It keeps a cursor into the buffer, so each save only appends the rows
+    which arrived since the last one, and never rewrites or re-filters old
+    data. Saving happens on a background thread every `interval` seconds, so
+    the polling timer never waits on the disk, and a crash loses at most one
+    interval of data.
+
+    The archive is partitioned by day: rows go into "<date>.csv" for their
+    local date, so a new file starts at midnight, and a day with more than
+    max_rows rows carries on in "<date>_1.csv", "<date>_2.csv" and so on. The
+    first line of each partition is an index of its first and last
+    timestamps and its number of rows, kept up to date as rows are added, so
+    the partitions overlapping a time range can be found without parsing
+    them (see partitions_between and read_between).
+
+    If the buffer is journaled (see sampleJournal.SampleJournal), the
+    journal's checkpoint is moved on after each save. Anything else which
+    needs to know when the archive changes, such as a reader keeping its own
+    copy of the indices, can add itself to write_functions.
+    """
+    def __init__(self, buffer, directory, interval, debug, max_rows=100000,
+                 journal=None):
+        """
+        buffer : (RingBuffer) The buffer to save.
+        directory : (str) The directory of the archive. It is created if it
+            doesn't exist.
+        interval : (float) The time in seconds between automatic saves.
+        debug : (bool) Whether to print debug information.
+        max_rows : (int) The most rows in one partition. Defaults to 100000,
+            more than a day at the default polling rate.
+        journal : (sampleJournal.SampleJournal) The buffer's journal. Defaults
+            to None, for none.
+        """
+        self.buffer = buffer
+        self.directory = directory
+        self.interval = interval
+        self.debug = debug
+        self.max_rows = max_rows
+        self.journal = journal
+
+        # the number of buffer rows ever appended which are already saved
+        self.cursor = buffer.total
+        # the partition being appended to: its date, part number, path and
+        # index, or None before the first save
+        self._partition = None
+        # called with the path and new index of a partition, and a DataFrame
+        # of the rows written, after every write to it, on the thread which
+        # wrote it
+        self.write_functions = []
+
+        # only one save at a time, whichever thread asks for it
+        self._write_lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start saving in the background
+        """
+        if self._thread is not None:
+            return None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="Buffer writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Stop saving in the background, then save whatever is left. This blocks
+        until everything is on disk.
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._wake_event.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush_soon(self):
+        """
+        Ask the background thread to save now rather than at the next
+        interval, without waiting for it.
+        """
+        self._wake_event.set()
+
+    def _run(self):
+        """
+        Save every interval, or whenever flush_soon() is called, until told to
+        stop
+        """
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                # never let a failed save kill the thread, we try again later
+                if self.debug:
+                    traceback.print_exc()
+
+    def _open_partition(self, date):
+        """
+        Find the partition to carry on appending the rows of a date to: the
+        newest one for the date, unless it has no index or is full, in which
+        case the next one
+        """
+        part = 0
+        while os.path.isfile(os.path.join(self.directory,
+                                          partition_name(date, part + 1))):
+            part += 1
+        path = os.path.join(self.directory, partition_name(date, part))
+        index = read_index(path) if os.path.isfile(path) else None
+        if os.path.isfile(path) and (index is None
+                                     or index[2] >= self.max_rows):
+            part += 1
+            path = os.path.join(self.directory, partition_name(date, part))
+            index = None
+        self._partition = {"date":date, "part":part, "path":path,
+                           "index":index}
+
+    def _write_partition(self, rows):
+        """
+        Append a DataFrame of rows, which all fit in the current partition, to
+        it, and update its index
+        """
+        path = self._partition["path"]
+        timestamps = rows['Timestamp'].to_numpy()
+        index = self._partition["index"]
+        if index is None:
+            index = (timestamps[0], timestamps[-1], len(rows))
+            # every line ends in "\n", as the index line does, rather than
+            # pandas' default of the platform's line ending
+            with open(path, "w", newline="") as f:
+                f.write(INDEX_FORMAT.format(*index))
+                rows.to_csv(f, index=False, lineterminator="\n")
+        else:
+            index = (index[0], timestamps[-1], index[2] + len(rows))
+            with open(path, "a", newline="") as f:
+                rows.to_csv(f, index=False, header=False,
+                            lineterminator="\n")
+            # the rows are written first, so the index never claims rows
+            # which aren't there
+            with open(path, "r+", newline="") as f:
+                f.write(INDEX_FORMAT.format(*index))
+        self._partition["index"] = index
+        for function in self.write_functions:
+            function(path, index, rows)
+
+    def flush(self):
+        """
+        Append the rows which arrived since the last save to the archive, and
+        return how many there were. This blocks until they are on disk.
+        """
+        with self._write_lock:
+            rows, cursor = self.buffer.since(self.cursor)
+            to_dump = self.buffer.to_dataframe(rows)
+            self._write_dataframe(to_dump)
+            if self.debug:
+                skipped = cursor - self.cursor - len(to_dump)
+                print(f"Saved {len(to_dump)} rows to {self.directory}" +
+                      (f", {skipped} were lost" if skipped else ""))
+            self.cursor = cursor
+            if self.journal is not None:
+                self.journal.checkpoint(cursor)
+            return len(to_dump)
+
+    def write_dataframe(self, to_dump):
+        """
+        Append a DataFrame of rows which aren't in the buffer, such as those
+        recovered from a journal, to the archive. Its columns are put in the
+        same order as the buffer's. This blocks until they are on disk.
+        """
+        with self._write_lock:
+            self._write_dataframe(to_dump.reindex(columns=self.buffer.keys()))
+
+    def _write_dataframe(self, to_dump):
+        """
+        Append a DataFrame of rows to the archive, splitting them by date
+        """
+        if len(to_dump) == 0:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        # the local date of every row, split where it changes
+        dates = local_datetimes(to_dump['Timestamp'].to_numpy())
+        dates = dates.astype('datetime64[D]').astype(str)
+        splits = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+        for start, end in zip(np.concatenate([[0], splits]),
+                              np.concatenate([splits, [len(dates)]])):
+            self._flush_day(dates[start], to_dump.iloc[start:end])
+
+    def _flush_day(self, date, rows):
+        """
+        Append the rows of one date to its partitions, starting new ones as
+        they fill up
+        """
+        if self._partition is None or self._partition["date"] != date:
+            self._open_partition(date)
+        while len(rows) > 0:
+            index = self._partition["index"]
+            room = self.max_rows - (0 if index is None else index[2])
+            if room <= 0:
+                self._partition = {"date":date,
+                                   "part":self._partition["part"] + 1,
+                                   "index":None}
+                self._partition["path"] = os.path.join(
+                    self.directory,
+                    partition_name(date, self._partition["part"])
+                )
+                continue
+            self._write_partition(rows.iloc[:room])
+            rows = rows.iloc[room:]
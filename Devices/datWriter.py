@@ -0,0 +1,252 @@
+import threading
+import traceback
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ascii codes used when building lines byte by byte
+SPACE = ord(' ')
+NEWLINE = ord('\n')
+# powers of ten, for counting decimal digits
+POW10 = 10**np.arange(19, dtype=np.int64)
+# "0000" to "9999" as 4 byte integers, for writing digits 4 at a time
+FOUR_DIGITS = np.array([b"%04d" % i for i in range(10000)]).view(np.uint32)
+# the number of digits written for each float, enough for anything below 1e15
+N_DIGITS = 16
+
+def _python_lines(columns, rows, col_width, float_decimals):
+    """
+    Formats the given rows of the columns the slow way, one python string
+    formatting operation per line. This is the reference the vectorized
+    formatting has to match, and handles the rows it can't.
+    """
+    fields = []
+    values = []
+    for column in columns:
+        if np.issubdtype(column.dtype, np.floating):
+            fields.append(f"%-{col_width}.{float_decimals}f")
+            values.append(column[rows].tolist())
+        else:
+            fields.append(f"%-{col_width}s")
+            values.append([str(value) for value in column[rows].tolist()])
+    row_format = "".join(fields)
+
+    return [(row_format % row).rstrip() for row in zip(*values)]
+
+def _put_floats(lines, start, column, col_width, float_decimals):
+    """
+    Writes a float column into the field starting at `start` of every line,
+    exactly as "%.{float_decimals}f" would format it. The characters come
+    from integer arithmetic on the whole column at once, four digits at a time.
+
+    Returns the length of each value written, and a boolean array which is
+    True for the rows that could not be written this way and must be formatted
+    by python instead. These are values which are too long for the field (so
+    the rest of their line would shift), too large to round exactly, or so
+    close to halfway between two roundings that float64 arithmetic can't be
+    trusted to pick the same one as python.
+    """
+    x = column.astype(float)
+    n_rows = len(x)
+    finite = np.isfinite(x)
+    negative = np.signbit(x)
+
+    # round |x| to an integer number of units of the last decimal place. The
+    # product is accurate to a few ulp, so only values within that of a tie
+    # can round differently to python's exact decimal rounding.
+    scaled = np.abs(np.where(finite, x, 0.0)) * 10.0**float_decimals
+    distance_to_tie = np.abs(scaled - np.floor(scaled) - 0.5)
+    ok = finite & (scaled < 1e15) & (distance_to_tie > scaled*1e-15 + 1e-12)
+    ok &= float_decimals < N_DIGITS
+    units = np.where(ok, np.rint(scaled), 0).astype(np.int64)
+
+    # the length of each number, sign and decimal point included
+    n_whole = np.maximum(np.searchsorted(POW10, units // POW10[float_decimals],
+                                         side='right'), 1)
+    length = n_whole + (negative & ok)
+    if float_decimals:
+        length += float_decimals + 1
+    ok &= length <= col_width
+
+    # the digits of every number, most significant first, zero padded
+    digits = np.empty((n_rows, N_DIGITS//4), dtype=np.uint32)
+    remainder = units
+    for k in reversed(range(N_DIGITS//4)):
+        digits[:, k] = FOUR_DIGITS[remainder % 10000]
+        remainder = remainder // 10000
+    digits = digits.view(np.uint8)
+
+    # write every number right aligned in the first half of a double width
+    # field, with spaces in the second half
+    right_aligned = np.full((n_rows, 2*col_width), SPACE, dtype=np.uint8)
+    end = col_width
+    if float_decimals:
+        right_aligned[:, end-float_decimals:end] = \
+            digits[:, N_DIGITS-float_decimals:]
+        end -= float_decimals + 1
+        right_aligned[:, end] = ord('.')
+    n_shown = min(end, N_DIGITS - float_decimals)
+    right_aligned[:, end-n_shown:end] = \
+        digits[:, N_DIGITS-float_decimals-n_shown:N_DIGITS-float_decimals]
+
+    # then take the field starting where each number starts, which left aligns
+    # it. Any zero padding shown is where the sign goes.
+    offsets = np.arange(n_rows)*2*col_width + np.where(ok, col_width - length,
+                                                       col_width)
+    windows = sliding_window_view(right_aligned.reshape(-1), col_width)
+    field = windows[offsets]
+    field[ok & negative, 0] = ord('-')
+    length = np.where(ok, length, 0)
+
+    # nan and inf are always written the same way
+    for text, mask in [(b"nan", np.isnan(x)),
+                       (b"inf", np.isposinf(x)),
+                       (b"-inf", np.isneginf(x))]:
+        field[mask, :len(text)] = np.frombuffer(text, dtype=np.uint8)
+        length[mask] = len(text)
+
+    lines[:, start:start+col_width] = field
+    return length, finite & ~ok
+
+def _put_strings(lines, start, column, col_width):
+    """
+    Writes a column as str() of each value into the field starting at `start`
+    of every line.
+
+    Returns the length of each value written, not counting trailing spaces,
+    and a boolean array which is True for the rows that could not be written
+    this way and must be formatted by python instead: those too long for the
+    field, or containing control characters.
+    """
+    strings = np.array([str(value) for value in column.tolist()], dtype=str)
+    try:
+        encoded = strings.astype('S')
+    except UnicodeEncodeError:
+        # python counts characters, not bytes, so leave it all to python
+        return np.zeros(len(strings), dtype=int), \
+            np.ones(len(strings), dtype=bool)
+    width = min(encoded.itemsize, col_width)
+    raw = encoded.view(np.uint8).reshape(len(strings), encoded.itemsize)
+    raw = raw[:, :width]
+
+    lengths = np.char.str_len(strings)
+    valid = np.arange(width) < lengths[:, None]
+    field = np.where(valid, raw, SPACE)
+    lines[:, start:start+width] = field
+    lines[:, start+width:start+col_width] = SPACE
+
+    not_space = field != SPACE
+    stripped = np.where(not_space.any(axis=1),
+                        width - np.argmax(not_space[:, ::-1], axis=1), 0)
+    control = ((raw < SPACE) & valid).any(axis=1)
+    return stripped, (lengths > col_width) | control
+
+def format_fixed_width(columns, col_width=15, float_decimals=5):
+    """
+    Formats columns of data as fixed width text, the way the legacy .dXX files
+    are laid out. Float columns are written with float_decimals decimal
+    places, anything else with str(). Every value is left aligned in a field
+    col_width characters wide (longer values are not cut short), trailing
+    whitespace is removed from each line, and each line ends with a newline.
+
+    The result is identical to formatting every value with python, but the
+    lines are built as one array of bytes, a column at a time, rather than a
+    value at a time. The few rows numpy can't format exactly (see _put_floats
+    and _put_strings) are formatted by python instead.
+
+    columns : (list) The columns, each an array-like of the same length.
+    col_width : (int) The width of each field. Defaults to 15.
+    float_decimals : (int) The number of decimal places for floats. Defaults
+        to 5.
+    """
+    columns = [np.asarray(column) for column in columns]
+    n_rows = len(columns[0]) if columns else 0
+    if n_rows == 0:
+        return ""
+
+    width = len(columns)*col_width
+    lines = np.empty((n_rows, width + 1), dtype=np.uint8)
+    # where each line ends once its trailing spaces are stripped
+    ends = np.zeros(n_rows, dtype=int)
+    fallback = np.zeros(n_rows, dtype=bool)
+    for i, column in enumerate(columns):
+        start = i*col_width
+        if np.issubdtype(column.dtype, np.floating):
+            lengths, failed = _put_floats(lines, start, column, col_width,
+                                          float_decimals)
+        else:
+            lengths, failed = _put_strings(lines, start, column, col_width)
+        ends = np.where(lengths > 0, start + lengths, ends)
+        fallback |= failed
+
+    lines[np.arange(n_rows), ends] = NEWLINE
+    text = lines[np.arange(width + 1) <= ends[:, None]].tobytes()
+    text = text.decode('ascii')
+
+    if not fallback.any():
+        return text
+
+    # swap in the lines python had to format
+    line_ends = np.cumsum(ends + 1)
+    line_starts = line_ends - (ends + 1)
+    fallback_rows = np.flatnonzero(fallback)
+    fallback_lines = _python_lines(columns, fallback_rows, col_width,
+                                   float_decimals)
+    pieces = []
+    previous = 0
+    for row, line in zip(fallback_rows, fallback_lines):
+        pieces.append(text[previous:line_starts[row]])
+        pieces.append(line + "\n")
+        previous = line_ends[row]
+    pieces.append(text[previous:])
+    return "".join(pieces)
+
+def write_dat_file(path, header_lines, column_names, columns, col_width=15,
+                   float_decimals=5):
+    """
+    Writes a .dXX file: the header lines, then a ";" prefixed row of column
+    names, then the data formatted by format_fixed_width().
+
+    path : (str) The file to write.
+    header_lines : (list) The header lines, including their ";" prefix.
+    column_names : (list) The names written above each column.
+    columns : (list) The columns of data, in the same order as column_names.
+    col_width : (int) The width of each field. Defaults to 15.
+    float_decimals : (int) The number of decimal places for floats. Defaults
+        to 5.
+    """
+    header_row = ";" + "".join(name.ljust(col_width) for name in column_names)
+
+    with open(path, "w") as f:
+        for line in header_lines:
+            f.write(line + "\n")
+        f.write(header_row.rstrip() + "\n")
+        f.write(format_fixed_width(columns, col_width, float_decimals))
+
+def write_dat_file_async(path, header_lines, column_names, columns,
+                         callback=None, debug=False, **kwargs):
+    """
+    Does write_dat_file() on a background thread, and returns the thread.
+    The columns must not be changed until it is done.
+
+    callback : (function) Called with the path once the file has been written.
+        Note that it is called from the background thread, so it must not
+        touch any Qt widgets directly (emitting a signal is fine).
+    debug : (bool) Whether to print debug information if writing fails.
+
+    Any other keyword arguments are passed on to write_dat_file().
+    """
+    def run():
+        try:
+            write_dat_file(path, header_lines, column_names, columns, **kwargs)
+        except Exception:
+            print(f"Failed to save {path}")
+            if debug:
+                traceback.print_exc()
+            return None
+        if callback is not None:
+            callback(path)
+
+    thread = threading.Thread(target=run, name=f"Saving {path}")
+    thread.start()
+    return thread
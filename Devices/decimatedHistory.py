@@ -0,0 +1,151 @@
+import threading
+
+import numpy as np
+
+from ringBuffer import RingBuffer
+import qualityFlags
+
+class DecimatedHistory():
+    """
+    Keeps decimated copies of some columns of the hardware manager's buffer,
+    so that a long stretch of history can be plotted without drawing every
+    sample. Each tier splits time into buckets of a fixed width (10 s and
+    1 min by default) and keeps the minimum and maximum of every column in
+    each bucket, so spikes survive decimation, along with the OR of their
+    quality flags. Values flagged as outliers are left out of the minimum
+    and maximum, so a single bad read can't stretch a bucket, but the bucket
+    keeps the flag. The tiers are kept in ring buffers of their own, and go
+    back much further than the buffer itself, which serves as the finest
+    level.
+
+    The tiers are updated incrementally: update() folds the rows appended to
+    the buffer since the last call into the open bucket of each tier, and
+    moves buckets into the tier's ring once they are complete. select()
+    picks the finest tier (or the buffer itself) which gives no more points
+    than asked for over a time range, so the cost of plotting depends on the
+    width of the plot rather than the length of the history.
+    """
+    def __init__(self, buffer, columns, raw_interval,
+                 tiers=((10, 60480), (60, 43200))):
+        """
+        buffer : (RingBuffer) The buffer to decimate.
+        columns : (list) The columns of the buffer to keep decimated.
+        raw_interval : (float) The time in seconds between the buffer's rows.
+        tiers : (tuple) The (bucket width in seconds, number of buckets kept)
+            of each tier, finest first. Defaults to 10 s for a week and 1 min
+            for 30 days.
+        """
+        self.buffer = buffer
+        self.columns = list(columns)
+        self.raw_interval = raw_interval
+        self.widths = [width for width, _ in tiers]
+        self._source = [buffer.columns.index(col) for col in self.columns]
+        self._timestamp = buffer.columns.index('Timestamp')
+
+        tier_columns = (['Timestamp'] + [f"{col} min" for col in self.columns]
+                        + [f"{col} max" for col in self.columns])
+        self.tiers = [RingBuffer(tier_columns, size) for _, size in tiers]
+        # the bucket each tier is still filling: its index (start time over
+        # width), minima, maxima and flags, or None before the first row
+        self._open = [None]*len(tiers)
+        self._lock = threading.Lock()
+
+        # the number of buffer rows ever appended which are already decimated
+        self.cursor = buffer.total
+
+    def update(self):
+        """
+        Fold the rows appended to the buffer since the last call into the
+        tiers. Called by the collector after every append.
+        """
+        values, flags, _, cursor = self.buffer.since_arrays(self.cursor)
+        self.cursor = cursor
+        if values.shape[1] == 0:
+            return None
+        timestamps = values[self._timestamp]
+        flags = flags[self._source]
+        values = np.where(flags & qualityFlags.OUTLIER, np.nan,
+                          values[self._source])
+
+        with self._lock:
+            for tier, width in enumerate(self.widths):
+                self._update_tier(tier, width, timestamps, values, flags)
+
+    def _update_tier(self, tier, width, timestamps, values, flags):
+        """
+        Fold rows into one tier. The rows must be in time order.
+        """
+        buckets = np.floor(timestamps/width)
+        # where each run of rows in the same bucket starts
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+        with np.errstate(invalid='ignore'):
+            minima = np.fmin.reduceat(values, starts, axis=1)
+            maxima = np.fmax.reduceat(values, starts, axis=1)
+        ored = np.bitwise_or.reduceat(flags, starts, axis=1)
+
+        ring = self.tiers[tier]
+        for j, bucket in enumerate(buckets[starts]):
+            current = self._open[tier]
+            if current is not None and current[0] == bucket:
+                current[1] = np.fmin(current[1], minima[:, j])
+                current[2] = np.fmax(current[2], maxima[:, j])
+                current[3] = current[3] | ored[:, j]
+                continue
+            if current is not None:
+                # the open bucket is complete
+                ring.append(np.concatenate([[current[0]*width], current[1],
+                                            current[2]]),
+                            np.concatenate([[0], current[3], current[3]]))
+            self._open[tier] = [bucket, minima[:, j].copy(),
+                                maxima[:, j].copy(), ored[:, j].copy()]
+
+    def select(self, t0, t1, max_points, columns=None):
+        """
+        Returns the data of some columns between two times, from the finest
+        tier which gives at most max_points points for each. This is the
+        buffer itself if it is fine enough, otherwise each bucket gives two
+        points at its start time, its minimum then its maximum, so a line
+        through them covers the full range of the data.
+
+        Returns the bucket width used (0 for the buffer itself), and a
+        dictionary of arrays keyed by column, including "Timestamp".
+
+        t0, t1 : (float) The time range, as unix timestamps.
+        max_points : (int) The most points wanted, such as the width of the
+            plot in pixels.
+        columns : (list) The columns wanted, which must be decimated ones.
+            Defaults to all of the decimated columns.
+        """
+        if columns is None:
+            columns = self.columns
+        span = t1 - t0
+        if span/self.raw_interval <= max_points:
+            rows = self.buffer.between(t0, t1, ['Timestamp'] + list(columns))
+            return 0, rows
+
+        # the finest tier which is coarse enough, or else the coarsest
+        tier = next((i for i, width in enumerate(self.widths)
+                     if 2*span/width <= max_points), len(self.widths) - 1)
+        width = self.widths[tier]
+        names = (['Timestamp'] + [f"{col} min" for col in columns]
+                 + [f"{col} max" for col in columns])
+        with self._lock:
+            rows = self.tiers[tier].between(t0 - width, t1, names)
+            rows = {name:np.asarray(values) for name, values in rows.items()}
+            current = self._open[tier]
+            if current is not None and t0 - width < current[0]*width < t1:
+                # include the bucket still being filled
+                indices = [self.columns.index(col) for col in columns]
+                rows['Timestamp'] = np.append(rows['Timestamp'],
+                                              current[0]*width)
+                for col, i in zip(columns, indices):
+                    rows[f"{col} min"] = np.append(rows[f"{col} min"],
+                                                   current[1][i])
+                    rows[f"{col} max"] = np.append(rows[f"{col} max"],
+                                                   current[2][i])
+
+        selected = {'Timestamp':np.repeat(rows['Timestamp'], 2)}
+        for col in columns:
+            selected[col] = np.column_stack([rows[f"{col} min"],
+                                             rows[f"{col} max"]]).ravel()
+        return width, selected
@@ -0,0 +1,245 @@
+import threading
+import traceback
+import time
+
+import numpy as np
+
+from serialConnection import DeviceUnavailable
+import qualityFlags
+
+class DevicePoller():
+    """
+    Samples one device on its own thread, so that a slow device (for example
+    one waiting on a serial timeout) never holds up the others. The device is
+    read through a function which is given the indices of the channels to read
+    and returns numpy arrays of their values and quality flags. The latest
+    value and flags of every channel are kept, along with the time the device
+    was last read, for the hardware manager to collect whenever it likes
+    without blocking. While the device is unavailable its last values are kept
+    and flagged as reconnecting. Every read can also be kept, in a ring
+    buffer, for when the latest value alone isn't enough.
+
+    Each channel can have its own interval. Channels without one are read on
+    every poll, and the others only once their interval has passed, keeping
+    their last value in between (so it is forward filled into the buffer). A
+    slow channel can also be marked "on change": whenever its value changes
+    it is read on every poll until it has stayed the same for its interval.
+    The change itself is only seen at the channel's next read, up to its
+    interval later (so a grating change can take 10 s to show up), but
+    whatever follows it, such as the slits settling, is followed poll by
+    poll, without reading the grating every poll the rest of the time.
+    """
+    def __init__(self, name, read_function, columns, interval, debug,
+                 stats=None, channel_intervals=None, stale_after=None,
+                 ring=None, clock=None):
+        """
+        name : (str) The name of the device, used for the thread name and in
+            debug messages.
+        read_function : (function) Called with a list of channel indices to
+            read the device. Must return an array of values for those
+            channels, in the same order, and an array of their quality flags
+            (see qualityFlags). Raises DeviceUnavailable if the device can't
+            be read at the moment.
+        columns : (list) The buffer column names of the channels.
+        interval : (float) The time in seconds between the start of each poll.
+            If a poll takes longer than this, the next one starts immediately.
+        debug : (bool) Whether to print debug information.
+        stats : (timingStats.TimingStats) Where to record how long each read
+            takes, as "read {name}", and count the reads which overran the
+            interval, as "{name} overruns". Defaults to None, for no timing.
+        channel_intervals : (dict) For the channels which don't need reading
+            every poll, (interval, on_change) keyed by column name, where
+            interval is in seconds and on_change is a bool. Defaults to None,
+            for reading every channel every poll.
+        stale_after : (float) How many seconds, on top of its own interval, a
+            channel can go without being read before its value counts as
+            stale, see get_stale. Defaults to None, for three intervals or
+            1 s, whichever is longer.
+        ring : (ringBuffer.RingBuffer) Where to append the values, and their
+            quality flags, after every read. Its stored columns must be
+            "Timestamp" and "Monotonic", for the unix and monotonic times of
+            the read, followed by columns. Defaults to None, for keeping only
+            the latest values.
+        clock : (function) Called with no arguments for the unix and
+            monotonic times of a read. Defaults to None, for time.time() and
+            time.monotonic().
+        """
+        self.name = name
+        self.read_function = read_function
+        self.columns = list(columns)
+        self.interval = interval
+        self.debug = debug
+        self.stats = stats
+        self.ring = ring
+        if clock is None:
+            clock = lambda: (time.time(), time.monotonic())
+        self.clock = clock
+        # how long past its interval a channel can go unread before its
+        # value counts as stale
+        if stale_after is None:
+            stale_after = max(3*interval, 1.0)
+        self.stale_after = stale_after
+
+        # the interval and on change mode of each channel, and when each is
+        # next due to be read. Everything is due straight away.
+        if channel_intervals is None:
+            channel_intervals = {}
+        rates = [channel_intervals.get(col, (0, False)) for col in self.columns]
+        self._intervals = np.array([rate[0] for rate in rates], dtype=float)
+        self._on_change = np.array([rate[1] for rate in rates], dtype=bool)
+        self._due = np.full(len(self.columns), -np.inf)
+        # until when each on change channel is being read every poll
+        self._promoted_until = np.full(len(self.columns), -np.inf)
+
+        # the latest values and the time they were read, replaced together
+        self._lock = threading.Lock()
+        self._latest = np.full(len(self.columns), np.nan)
+        self._flags = np.full(len(self.columns), qualityFlags.NO_SIGNAL,
+                              dtype=np.uint8)
+        self._latest_time = None
+        self._channel_times = np.full(len(self.columns), np.nan)
+        self.n_reads = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start sampling the device in the background
+        """
+        if self._thread is not None:
+            return None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name=f"{self.name} poller",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """
+        Stop sampling the device, waiting up to timeout seconds for the current
+        read to finish.
+        """
+        if self._thread is None:
+            return None
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _reschedule(self, indices, old_values, new_values, now):
+        """
+        Work out when the channels just read are next due
+        """
+        # a channel being read for the first time hasn't changed
+        changed = ((old_values != new_values) & ~np.isnan(old_values)
+                   & ~np.isnan(new_values))
+        promote = self._on_change[indices] & changed
+        self._promoted_until[indices[promote]] = \
+            now + self._intervals[indices[promote]]
+        # channels which failed to read are tried again on the next poll
+        promoted = (self._promoted_until[indices] > now) | np.isnan(new_values)
+        self._due[indices] = now + np.where(promoted, 0,
+                                            self._intervals[indices])
+
+    def _run(self):
+        """
+        Read the due channels every interval until told to stop
+        """
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            indices = np.flatnonzero(self._due <= start)
+            if len(indices) == 0:
+                self._stop_event.wait(self.interval)
+                continue
+            try:
+                values, flags = self.read_function(indices.tolist())
+                values = np.asarray(values, dtype=float)
+                flags = np.asarray(flags, dtype=np.uint8)
+            except DeviceUnavailable:
+                # the device is reconnecting. Its last values are kept, and
+                # go stale, rather than waiting on it.
+                if self.stats is not None:
+                    self.stats.increment(f"{self.name} unavailable")
+                with self._lock:
+                    self._flags = self._flags | qualityFlags.RECONNECTING
+                self._stop_event.wait(self.interval)
+                continue
+            except Exception:
+                if self.debug:
+                    print(f"Error reading {self.name}")
+                    traceback.print_exc()
+                values = np.full(len(indices), np.nan)
+                flags = np.full(len(indices), qualityFlags.NO_SIGNAL,
+                                dtype=np.uint8)
+
+            # the channels not read keep their last values. The device is
+            # back, so none of them are reconnecting any more.
+            latest = self._latest.copy()
+            old_values = latest[indices]
+            latest[indices] = values
+            latest_flags = self._flags & ~np.uint8(qualityFlags.RECONNECTING)
+            latest_flags[indices] = flags
+            self._reschedule(indices, old_values, values, start)
+            read_time, read_monotonic = self.clock()
+            with self._lock:
+                self._latest = latest
+                self._flags = latest_flags
+                self._latest_time = read_time
+                self._channel_times = self._channel_times.copy()
+                self._channel_times[indices] = self._latest_time
+                self.n_reads += 1
+            if self.ring is not None:
+                self.ring.append(
+                    np.concatenate([[read_time, read_monotonic], latest]),
+                    np.concatenate([[0, 0], latest_flags])
+                )
+
+            elapsed = time.monotonic() - start
+            if self.stats is not None:
+                self.stats.record(f"read {self.name}", elapsed)
+                if elapsed > self.interval:
+                    self.stats.increment(f"{self.name} overruns")
+            self._stop_event.wait(max(0, self.interval - elapsed))
+
+    def get_latest(self):
+        """
+        Returns the latest values read, and the unix time they were read at.
+        The time is None if the device has not been read yet, in which case the
+        values are all NaN. This never blocks on the device.
+        """
+        with self._lock:
+            return self._latest, self._latest_time
+
+    def get_flags(self):
+        """
+        Returns the quality flags (see qualityFlags) of the latest values, as
+        a uint8 array. Channels which have not been read yet are NO_SIGNAL.
+        """
+        with self._lock:
+            return self._flags
+
+    def get_stale(self, deadline=None):
+        """
+        Returns a boolean array which is True for the channels which haven't
+        answered by a deadline: not read in the interval of the channel plus
+        stale_after seconds before it, for example because the device is
+        reconnecting or its read is hanging.
+
+        deadline : (float) The unix time, on the poller's clock, by which the
+            channels should have been read. Defaults to None, for now.
+        """
+        if deadline is None:
+            deadline = self.clock()[0]
+        with self._lock:
+            channel_times = self._channel_times
+        age = deadline - channel_times
+        return ~(age <= self._intervals + self.stale_after)
+
+    def get_channel_times(self):
+        """
+        Returns the unix time each channel was last read, NaN for those which
+        have not been read yet. Slow channels are older than the time given by
+        get_latest().
+        """
+        with self._lock:
+            return self._channel_times
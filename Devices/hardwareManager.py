@@ -5,8 +5,6 @@ import inspect
 import json
 import time
 
-from collections import deque
-
 from datetime import datetime
 import pandas as pd
 import numpy as np
@@ -22,8 +20,19 @@ with open("config.json") as f:
 import tempControllerITC502 as TC
 import ConSysInterface as CSI
 import photosensorAmplifierC932901 as PA
+import devicePoller
+from ringBuffer import RingBuffer, format_times, local_datetimes
+from bufferSnapshot import BufferSnapshot
+from decimatedHistory import DecimatedHistory
+from outlierFilter import HampelFilter
+from bufferWriter import BufferWriter
+from historyTiles import HistoryTiles
+import sampleJournal
+import qualityFlags
+import datWriter
+from timingStats import TimingStats
 
-from PyQt5.QtCore import QTimer, QObject
+from PyQt5.QtCore import QTimer, QObject, Qt
 
 class CollectorWorker(QObject):
     def __init__(self, debug, parent):
@@ -32,9 +41,23 @@ class CollectorWorker(QObject):
         self.hardwareManager = HardwareManager(self.debug, parent)
 
     def run(self):
+        # rather than a repeating timer, which slips along with any tick that
+        # runs long, the timer is started afresh for each tick so that it
+        # fires on the next point of the hardware manager's tick grid
         self.timer = QTimer()
-        self.timer.timeout.connect(self.hardwareManager._refresh)
-        self.timer.start(self.hardwareManager.polling_rate)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+        self.hardwareManager.start_ticks()
+        self._schedule()
+
+    def _tick(self):
+        self.hardwareManager._refresh()
+        self._schedule()
+
+    def _schedule(self):
+        delay = self.hardwareManager.seconds_to_next_tick()
+        self.timer.start(max(0, int(round(1000*delay))))
 
 class HardwareManager():
     """
@@ -47,7 +70,18 @@ class HardwareManager():
     same objects representing hardware.
 
     This class also contains a timer, which periodically asks the hardware for
-    updates.
+    updates. The ticks are kept on a fixed grid, polling_rate apart on the
+    monotonic clock, and each row of the buffer is timestamped with its grid
+    point, so time scans are evenly sampled even when a tick starts late. Each
+    tick has a deadline, tick_budget seconds after its grid point: a device
+    which hasn't answered by then contributes its last value, flagged as
+    stale, and the refresh functions still waiting are skipped until the next
+    tick. A tick which misses its grid point altogether is dropped.
+
+    Every time the hardware manager records (the rows, the device reads, the
+    burst samples and the start and end of a time scan) comes from now(),
+    the monotonic clock anchored to the wall clock once at start up, so they
+    all line up however far the wall clock is adjusted during a long run.
     """
     def __init__(self, debug, parent):
         
@@ -56,51 +90,165 @@ class HardwareManager():
         self.parent = parent
         self.abort_status = False
         self.polling_rate = self.parent.config['polling_rate']
+        # the devices are polled separately from (and usually faster than)
+        # the rate rows are added to the buffer
+        self.device_polling_rate = self.parent.config.get(
+            'device_polling_rate', 250
+        )
+
+        # the clock every recorded time comes from, see now()
+        self._clock_monotonic = time.monotonic()
+        self._clock_unix = time.time()
 
         self.temperatureController = TC.TemperatureController(debug=self.debug)
         self.ConSysInterface = CSI.ConSysInterface(debug=self.debug)
-        self.photosensor = PA.Photosensor(debug=self.debug)
+        self.photosensor = PA.Photosensor(debug=self.debug, clock=self.now)
+
+        # how long each tick, refresh function and device read takes
+        self.timingStats = TimingStats()
+
+        # the tick grid. Tick k is due at monotonic time
+        # _grid_start + k*tick_interval, and is timestamped
+        # _grid_start_unix + k*tick_interval
+        self.tick_interval = self.polling_rate/1000
+        self.tick_budget = 0.8*self.tick_interval
+        self._grid_start = None
+        self._grid_start_unix = None
+        self._next_tick = 0
+        self.tick_timestamp = None
+        self.tick_monotonic = None
+
+        # each device is sampled on its own thread, and collect_data just
+        # gathers up the latest values from each of them. A device's values
+        # go stale if it hasn't been read by a tick's deadline since the
+        # deadline of the tick before, allowing for a read in progress then.
+        self.pollers = []
+        for name, device in [("TemperatureController",
+                              self.temperatureController),
+                             ("Photosensor", self.photosensor),
+                             ("ConSysInterface", self.ConSysInterface)]:
+            self.pollers.append(devicePoller.DevicePoller(
+                name, device.read_channels, device.columns,
+                interval=self.device_polling_rate/1000, debug=self.debug,
+                stats=self.timingStats,
+                channel_intervals=device.channel_intervals,
+                stale_after=self.tick_interval + self.device_polling_rate/1000,
+                clock=self.now
+            ))
+        for poller in self.pollers:
+            poller.start()
+
+        # while a time scan is recording, the cRIO channels are also sampled
+        # much faster than rows are added to the buffer, into a ring of their
+        # own, so the deposition fringes on Ch2 can be fit more tightly. The
+        # other channels stay at the buffer's rate.
+        self.burst_polling_rate = self.parent.config.get('burst_polling_rate',
+                                                         50)
+        self.burst_columns = ['Ch0 (V)', 'Ch1 (V)', 'Ch2 (V)', 'Ch3 (V)']
+        burst_registers = [self.ConSysInterface.columns.index(col)
+                           for col in self.burst_columns]
+        # enough for two hours of bursting
+        self.burstSamples = RingBuffer(
+            ['Time', 'DateTime', 'Timestamp', 'Monotonic'] + self.burst_columns,
+            int(7200*1000/self.burst_polling_rate)
+        )
+        self.burstPoller = devicePoller.DevicePoller(
+            "ConSys burst",
+            lambda indices: self.ConSysInterface.read_channels(
+                [burst_registers[i] for i in indices]
+            ),
+            self.burst_columns, interval=self.burst_polling_rate/1000,
+            debug=self.debug, stats=self.timingStats, ring=self.burstSamples,
+            clock=self.now
+        )
         
         # a place to store the refresh functions that should be called
         self.hardware_refresh_functions = [self.collect_data]
         
-        # data collection
+        # data collection, between these unix timestamps
         self.collectionStartTime = None
         self.collectionEndTime = None
+        self.collectionStartMonotonic = None
         maxlen = 84000    # data points
-        self.today = datetime.now().strftime("%Y-%m-%d")
-        self.last_dump_time = datetime.now()
-        self.buffer = {'Time':deque(maxlen=maxlen),
-                       'DateTime':deque(maxlen=maxlen),
-                       'Timestamp':deque(maxlen=maxlen),
-                       'Sample T (K)':deque(maxlen=maxlen),
-                       'Setpoint T (K)':deque(maxlen=maxlen),
-                       'Heater Power (%)':deque(maxlen=maxlen),
-                       'MC Pressure (mbar)':deque(maxlen=maxlen),
-                       'DL Pressure (mbar)':deque(maxlen=maxlen),
-                       'Wavelength (nm)':deque(maxlen=maxlen),
-                       'ITC502_P (%)':deque(maxlen=maxlen),
-                       'ITC502_I (min)':deque(maxlen=maxlen),
-                       'ITC502_D (min)':deque(maxlen=maxlen),
-                       'Hamamatsu (V)':deque(maxlen=maxlen),
-                       'Ch0 (V)':deque(maxlen=maxlen),
-                       'Ch1 (V)':deque(maxlen=maxlen),
-                       'Ch2 (V)':deque(maxlen=maxlen),
-                       'Ch3 (V)':deque(maxlen=maxlen),
-                       'Z_Motor':deque(maxlen=maxlen),
-                       'Beam_current':deque(maxlen=maxlen),
-                       'UBX_x':deque(maxlen=maxlen),
-                       'MRS_h':deque(maxlen=maxlen),
-                       'GC_Pres':deque(maxlen=maxlen),
-                       't_block':deque(maxlen=maxlen),
-                       'PMTVac':deque(maxlen=maxlen),
-                       'n_avg':deque(maxlen=maxlen),
-                       'EXS_rPos':deque(maxlen=maxlen),
-                       'ENS_rPos':deque(maxlen=maxlen),
-                       'Table_Pos':deque(maxlen=maxlen),
-                       'Grating':deque(maxlen=maxlen),
-                       't_avg':deque(maxlen=maxlen)}
+        # the buffer holds numbers only. Each row's time is stored once, as a
+        # unix timestamp and the matching monotonic clock time, and 'Time' and
+        # 'DateTime' are worked out from 'Timestamp' when they are asked for
+        self.buffer = RingBuffer([
+            'Time', 'DateTime', 'Timestamp', 'Monotonic', 'Sample T (K)',
+            'Setpoint T (K)', 'Heater Power (%)', 'MC Pressure (mbar)',
+            'DL Pressure (mbar)', 'Wavelength (nm)', 'ITC502_P (%)',
+            'ITC502_I (min)', 'ITC502_D (min)', 'Hamamatsu (V)', 'Ch0 (V)',
+            'Ch1 (V)', 'Ch2 (V)', 'Ch3 (V)', 'Z_Motor', 'Beam_current',
+            'UBX_x', 'MRS_h', 'GC_Pres', 't_block', 'PMTVac', 'n_avg',
+            'EXS_rPos', 'ENS_rPos', 'Table_Pos', 'Grating', 't_avg'],
+            maxlen)
         self.data = None
+        # what the GUI reads, published once per tick, see publish_snapshot
+        self.snapshot = BufferSnapshot(0, *self.buffer.views())
+        # min/max decimated copies of the columns which get plotted, going
+        # back further than the buffer, for plotting long stretches of time
+        self.history = DecimatedHistory(
+            self.buffer,
+            ['Sample T (K)', 'Setpoint T (K)', 'Heater Power (%)',
+             'MC Pressure (mbar)', 'DL Pressure (mbar)', 'Hamamatsu (V)',
+             'Ch0 (V)', 'Ch1 (V)', 'Ch2 (V)', 'Ch3 (V)'],
+            raw_interval=self.tick_interval
+        )
+
+        # save the buffer as it fills, in the background, into an archive
+        # with a file per day
+        self.bufferWriter = BufferWriter(
+            self.buffer,
+            self.parent.config["buffer_dump_directory"],
+            interval=self.parent.config.get("autosave_interval", 60),
+            debug=self.debug,
+            max_rows=self.parent.config.get("archive_max_rows", 100000)
+        )
+
+        # every row is journaled as soon as it is collected, so that the rows
+        # not archived yet survive a crash. Anything left from the last run
+        # is archived before starting again.
+        journal_path = os.path.join(
+            self.parent.config["buffer_dump_directory"], "journal.bin"
+        )
+        recovered = sampleJournal.recover(journal_path)
+        if recovered is not None:
+            print(f"Recovered {len(recovered)} rows from the journal")
+            try:
+                self.bufferWriter.write_dataframe(recovered.to_dataframe())
+            except Exception:
+                # keep the old journal rather than overwriting it
+                print("Unable to archive the recovered rows")
+                if self.debug:
+                    traceback.print_exc()
+                os.replace(journal_path,
+                           journal_path + f".{int(time.time())}")
+        self.journal = sampleJournal.SampleJournal(journal_path, self.buffer,
+                                                   debug=self.debug)
+        self.bufferWriter.journal = self.journal
+
+        # the same columns again, from the archive, for browsing weeks of
+        # history. The summaries it needs are made in the background now, so
+        # they are ready by the time anyone looks.
+        self.archiveHistory = HistoryTiles(
+            self.parent.config["buffer_dump_directory"],
+            self.history.columns,
+            raw_interval=self.tick_interval,
+            debug=self.debug
+        )
+        self.bufferWriter.write_functions.append(
+            self.archiveHistory.partition_written)
+        self.archiveHistory.warm()
+        self.bufferWriter.start()
+
+        # the channels checked for outliers. The temperature controller now and
+        # then answers with the setpoint instead of the value we asked for.
+        self.outlier_columns = ['Sample T (K)', 'Heater Power (%)',
+                                'ITC502_P (%)', 'ITC502_I (min)',
+                                'ITC502_D (min)']
+        self.outlierFilter = HampelFilter(len(self.outlier_columns),
+                                          window=7, n_sigmas=5,
+                                          min_deviation=0.2)
 
         # configuration for scanning
         self.scan_config = {
@@ -123,12 +271,81 @@ class HardwareManager():
             "PMTVac":np.nan
         }
 
+    def now(self):
+        """
+        Returns the current unix time and monotonic time. The unix time is
+        worked out from the monotonic clock, anchored to the wall clock when
+        the hardware manager was created, so it never jumps or drifts apart
+        from the tick grid when the system clock is adjusted.
+        """
+        monotonic = time.monotonic()
+        return self._clock_unix + (monotonic - self._clock_monotonic), monotonic
+
+    def start_ticks(self):
+        """
+        Start the tick grid now, so the first tick is due straight away
+        """
+        self._grid_start_unix, self._grid_start = self.now()
+        self._next_tick = 0
+
+    def seconds_to_next_tick(self):
+        """
+        Returns the time in seconds until the next tick is due on the grid, 0
+        if it is already due
+        """
+        if self._grid_start is None:
+            return 0
+        due = self._grid_start + self._next_tick*self.tick_interval
+        return max(0, due - time.monotonic())
+
     def _refresh(self):
         """
-        Calls all the refresh functions in self.hardware_refresh_functions
+        Runs the tick due on the grid: calls all the refresh functions in
+        self.hardware_refresh_functions, until the tick's deadline passes,
+        timing each one, and the tick as a whole, in self.timingStats. Also
+        records how late the tick started (the timer jitter), and counts the
+        ticks which missed their grid point, the ticks which ran past their
+        deadline and the refresh functions skipped because of it.
         """
+        if self._grid_start is None:
+            self.start_ticks()
+        tick_start = time.monotonic()
+        # the latest grid point which has come due. Any before it, but after
+        # the last tick, were missed.
+        k = max(self._next_tick,
+                int((tick_start - self._grid_start)//self.tick_interval))
+        if k > self._next_tick:
+            self.timingStats.increment("missed ticks", k - self._next_tick)
+        self._next_tick = k + 1
+        due = self._grid_start + k*self.tick_interval
+        deadline = due + self.tick_budget
+        self.tick_timestamp = self._grid_start_unix + k*self.tick_interval
+        self.tick_monotonic = due
+        self.timingStats.record("timer jitter", tick_start - due)
+
         for function in self.hardware_refresh_functions:
+            name = getattr(function, "__qualname__", repr(function))
+            # the data is always collected, as it never waits on a device
+            if (function != self.collect_data
+                    and time.monotonic() > deadline):
+                self.timingStats.increment(f"{name} skipped")
+                continue
+            start = time.monotonic()
             function()
+            self.timingStats.record(name, time.monotonic() - start)
+
+        end = time.monotonic()
+        self.timingStats.record("tick", end - tick_start)
+        if end > deadline:
+            self.timingStats.increment("tick overruns")
+
+    def connection_health(self):
+        """
+        Returns the health of the serial connections, see
+        SerialConnection.health, keyed by device name
+        """
+        return {"ITC502":self.temperatureController.connection.health(),
+                "C9329-01":self.photosensor.connection.health()}
 
     def add_refresh_function(self, function):
         """
@@ -138,41 +355,37 @@ class HardwareManager():
 
     def collect_data(self):
         """
+        Add a row of the latest values from each device to the buffer,
+        timestamped with the grid point of the current tick
         """
         #if self.collecting:
-        time = datetime.now()
+        if self.tick_timestamp is None:
+            timestamp, monotonic = self.now()
+        else:
+            timestamp, monotonic = self.tick_timestamp, self.tick_monotonic
+        deadline = timestamp + self.tick_budget
+        # gather the freshest values from each device, and their quality flags,
+        # keyed by buffer column. Values which are out of date (say from a
+        # device which is reconnecting, or whose read is hanging) are carried
+        # forward, and flagged as stale.
+        latest = {}
+        quality = {}
+        for poller in self.pollers:
+            values, _ = poller.get_latest()
+            stale = poller.get_stale(deadline)
+            flags = poller.get_flags() | np.where(stale, qualityFlags.STALE, 0)
+            latest.update(zip(poller.columns, values.tolist()))
+            quality.update(zip(poller.columns, flags.tolist()))
         this_dict = {
-            'Time':time.strftime("%H:%M:%S"),
-             'DateTime':time,
-             'Timestamp':datetime.timestamp(time),
-             'Sample T (K)':self.temperatureController.get_temp(),
-             'Setpoint T (K)':self.temperatureController.get_target_temp(),
-             'Heater Power (%)':self.temperatureController.get_heater_power(),
-             'MC Pressure (mbar)':self.ConSysInterface.get_MC_pressure(),
-             'DL Pressure (mbar)':self.ConSysInterface.get_DL_pressure(),
-             'Wavelength (nm)':self.ConSysInterface.get_wavelength(),
-             'ITC502_P (%)':self.temperatureController.get_P(),
-             'ITC502_I (min)':self.temperatureController.get_I(),
-             'ITC502_D (min)':self.temperatureController.get_D(),
-             'Hamamatsu (V)':self.photosensor.get_output(),
-             'Ch0 (V)':self.ConSysInterface.get_ch0(),
-             'Ch1 (V)':self.ConSysInterface.get_ch1(),
-             'Ch2 (V)':self.ConSysInterface.get_ch2(),
-             'Ch3 (V)':self.ConSysInterface.get_ch3(),
-             'Z_Motor':self.ConSysInterface.get_z_motor(),
-             'Beam_current':self.ConSysInterface.get_beam_current(),
-             'UBX_x':self.ConSysInterface.get_UBX_x(),
-             'MRS_h':self.ConSysInterface.get_MRS_h(),
-             'GC_Pres':np.nan,
-             't_block':self.ConSysInterface.get_block_time(),
-             'PMTVac':self.ConSysInterface.get_PMTVac_status(),
-             'n_avg':self.ConSysInterface.get_n_avg(),
-             'EXS_rPos':self.ConSysInterface.get_exit_slit_position(),
-             'ENS_rPos':self.ConSysInterface.get_entrance_slit_position(),
-             'Table_Pos':self.ConSysInterface.get_table_position(),
-             'Grating':self.ConSysInterface.get_grating(),
-             't_avg':np.nan,
+            'Timestamp':timestamp,
+            'Monotonic':monotonic,
         }
+        # anything no device provides (GC_Pres, t_avg) is NaN
+        for key in self.buffer.columns:
+            if key not in this_dict:
+                this_dict[key] = latest.get(key, np.nan)
+                if key not in latest:
+                    quality[key] = qualityFlags.NO_SIGNAL
         
         # update the scanning configuration with values read from ConSys
         consys_vals = ["n_avg", "Grating", "EXS_rPos", "ENS_rPos", "Table_Pos",
@@ -180,63 +393,125 @@ class HardwareManager():
         for value in consys_vals:
             self.scan_config[value] = this_dict[value]
                 
-        # replace bad values with np.nan, but skip the first 10 so we know how
-        # to even identify them
-        target_temp = this_dict['Setpoint T (K)']
-        
-        for key in this_dict:
-            #if len(self.buffer) >= 10:
-            if len(self.buffer[key]) >= 10:
-                if key == 'Time':
-                    pass
-                elif (key!= 'Setpoint T (K)') and (this_dict[key]==target_temp):
-                    try:
-                        # for some reason we got the setpoint, is it an error?
-                        #arr = np.array([row[key] for row in self.buffer])
-                        arr = np.array(self.buffer[key])
-                        mask = ~np.isnan(arr)
-                        # last non-nan indicies
-                        lnnis = np.flatnonzero(mask)[-5:-1]
-                        # last non-nan values
-                        if len(lnnvs > 1):
-                            lnnvs = arr[lnnis]
-                            sigma = np.std(lnnvs)
-                            mean = np.mean(lnnvs)
-                            diff = np.abs(this_dict[key]-lnnvs[-1])
-                            if (diff > 5*sigma and diff > 0.2) or \
-                               (np.abs(this_dict[key]-mean)>50):
-                                if self.debug:
-                                    print(f"Bad value! diff={diff}, sigma={sigma}")
-                                this_dict[key] = np.nan
-                    except Exception:
-                        if self.debug:
-                            traceback.print_exc()
-                        this_dict[key] = np.nan
-            if this_dict[key] == "No Signal":
+        # flag outliers, such as the temperature controller answering with the
+        # setpoint instead of the value we asked for
+        outliers = self.outlierFilter.update(
+            [this_dict[key] for key in self.outlier_columns]
+        )
+        for key, is_outlier in zip(self.outlier_columns, outliers):
+            if is_outlier:
                 if self.debug:
-                    print("Bad value!")
-                this_dict[key] = np.nan
-            # add the data to the buffer
-            self.buffer[key].append(this_dict[key])
-        #self.buffer.append(this_dict)
+                    print(f"Bad value! {key}={this_dict[key]}")
+                quality[key] = quality.get(key, 0) | qualityFlags.OUTLIER
 
-    def dump_buffer(self):
+        # add the data to the buffer, journal it, and let the GUI know
+        self.buffer.append(this_dict, quality)
+        self.journal.write_new()
+        self.history.update()
+        self.publish_snapshot()
+
+    def query(self, columns, t0=-np.inf, t1=np.inf, step=None,
+              as_dataframe=False):
         """
+        Returns the buffer's rows with t0 < Timestamp < t1. They are found by
+        binary search on the sorted timestamps, so this takes O(log n + k)
+        for k rows, and without resampling the columns are views of the
+        buffer rather than copies. This is the way to read the buffer, for
+        saving, plotting, fitting or anything else.
+
+        columns : (list) The columns wanted. "Timestamp" is always included.
+        t0, t1 : (float) The time range, as unix timestamps. Defaults to
+            everything.
+        step : (float) If given, the rows are resampled onto a fixed grid of
+            this many seconds, starting at t0 (or the first row's time,
+            rounded down to a whole step, if t0 isn't given). Each point is
+            the mean of the values in its step, ignoring NaNs, and NaN if
+            there are none. Defaults to None, for no resampling.
+        as_dataframe : (bool) Whether to return a pandas DataFrame rather than
+            a dictionary of numpy arrays keyed by column. Defaults to False.
         """
-        # what data to dump? Everything, but avoid duplicates
-        self.data = pd.DataFrame.from_dict(self.buffer)
-        to_dump = self.data[(self.data['DateTime']>self.last_dump_time)]
-        self.last_dump_time = datetime.now()
-        
-        fname = self.parent.config["buffer_dump_directory"] + f"{self.today}.csv"
-        if os.path.isfile(fname):
-            to_dump.to_csv(fname, mode="a", index=False, header=False)
+        columns = list(dict.fromkeys(['Timestamp'] + list(columns)))
+        rows = self.buffer.between(t0, t1, columns)
+        if step is not None:
+            rows = self._resample(rows, t0, t1, step)
+        if as_dataframe:
+            return self.buffer.to_dataframe(rows)
+        return rows
+
+    def _resample(self, rows, t0, t1, step):
+        """
+        Resamples a dictionary of columns onto a fixed grid of step seconds,
+        see query
+        """
+        timestamps = rows['Timestamp']
+        if np.isfinite(t0):
+            start = t0
+        elif len(timestamps) > 0:
+            start = np.floor(timestamps[0]/step)*step
         else:
-            to_dump.to_csv(fname, mode="a", index=False)
+            return {col:values[:0] for col, values in rows.items()}
+        bins = ((timestamps - start)//step).astype(int)
+        if np.isfinite(t1):
+            n_bins = int(np.ceil((t1 - start)/step))
+        else:
+            n_bins = bins[-1] + 1 if len(bins) > 0 else 0
+
+        resampled = {'Timestamp':start + step*np.arange(n_bins)}
+        for col, values in rows.items():
+            if col in resampled:
+                continue
+            if col == 'Time':
+                resampled[col] = format_times(resampled['Timestamp'])
+            elif col == 'DateTime':
+                resampled[col] = local_datetimes(resampled['Timestamp'])
+            else:
+                valid = ~np.isnan(values)
+                sums = np.bincount(bins, weights=np.where(valid, values, 0),
+                                   minlength=n_bins)
+                counts = np.bincount(bins, weights=valid, minlength=n_bins)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    resampled[col] = sums/counts
+        return resampled
+
+    def publish_snapshot(self):
+        """
+        Replaces self.snapshot with a new BufferSnapshot of the buffer. The GUI
+        reads the snapshot rather than the buffer. Replacing an attribute is
+        atomic, so whichever thread reads it always gets a whole snapshot,
+        without any locking.
+        """
+        self.snapshot = BufferSnapshot(self.snapshot.version + 1,
+                                       *self.buffer.views())
+
+    def close(self):
+        """
+        Stop polling the devices, close the ConSys API and save the rest of
+        the buffer. It is important to run this when the program ends, to
+        ensure stability!
+        """
+        for poller in self.pollers + [self.burstPoller]:
+            poller.stop()
+        self.photosensor.close()
+        self.temperatureController.close()
+        self.ConSysInterface.close()
+        self.archiveHistory.stop()
+        # save everything not saved yet
+        self.bufferWriter.stop()
+        self.journal.close()
+
+    def dump_buffer(self):
+        """
+        Save any rows of the buffer which have not been saved yet. This only
+        asks the buffer writer to save now, it does not wait for it. The
+        buffer is saved periodically anyway, and everything left is saved by
+        close().
+        """
+        self.bufferWriter.flush_soon()
 
         return None
 
-    def save_data(self, do_legacy=True, dXX=1):
+    def save_data(self, do_legacy=True, dXX=1, asynchronous=False,
+                  callback=None):
         """
         Saves the data from the buffer into a dat file. 
 
@@ -244,6 +519,14 @@ class HardwareManager():
             excel system, in addition to the full file. Defaults to true.
 
         dXX (int) : this file's index within the current scan. Defaults to 1
+
+        asynchronous (bool) : whether to write the file on a background thread
+            rather than waiting for it. The data is taken from the buffer
+            before this returns either way. Defaults to False.
+
+        callback (function) : called with the file name once the file has been
+            written. When saving asynchronously it is called from the
+            background thread. Defaults to None.
         """
         # we save these columns in this order, using these names
         saved_cols = {
@@ -262,18 +545,14 @@ class HardwareManager():
         }
         
         # slice the buffer to the data we recorded
-        self.collectionEndTime = datetime.now()
-        self.data = pd.DataFrame.from_dict(self.buffer)
-        df = self.data[(self.data['DateTime']>self.collectionStartTime) &
-                       (self.data['DateTime']<self.collectionEndTime)]
+        self.collectionEndTime = self.now()[0]
+        rows = self.query(list(saved_cols.keys()), self.collectionStartTime,
+                          self.collectionEndTime)
         
         dXX_str = str(dXX).zfill(2)
         fname = self.parent.config["save_directory"] + \
                 f"Scan{self.parent.config["latest_scan_number"]}.d"+dXX_str
 
-        float_decimals = 5
-        col_spacing = 8
-        output_path = fname
         cfg = self.scan_config
 
         
@@ -294,7 +573,7 @@ class HardwareManager():
         hls.append(f";End wavelength (nm)           {cfg['wl_end']}")
         hls.append(f";Wavelength step (nm)          {cfg['wl_step']}")
         hls.append(f";Num. of scans / points        {cfg['n_scans']} / {cfg['n_points']}")
-        hls.append(f";File date                     {self.today}")
+        hls.append(f";File date                     {datetime.now().strftime('%Y-%m-%d')}")
         hls.append(f";Num. of avg. per point        {cfg['n_avg']}/ cRio {cfg['t_block']} ms")
         hls.append(f";Avg time per point            {cfg['t_avg']}")
         hls.append(f";UnduPos Start/End             {cfg['UnduPos_start']}/{cfg['UnduPos_end']}")
@@ -306,51 +585,83 @@ class HardwareManager():
         hls.append(f";  Comments: {cfg['Comments']}")
         hls.append(f";  Sample: {cfg['Sample']}")
 
-        # Format numeric columns
-        
-        formatted_df = df[list(saved_cols.keys())].copy()
-        for col in formatted_df.columns:
-            if pd.api.types.is_float_dtype(formatted_df[col]):
-                formatted_df[col] = formatted_df[col].map(
-                    lambda x: f"{x:.{float_decimals}f}"
-                )
-            else:
-                formatted_df[col] = formatted_df[col].astype(str)
-    
-        # Determine column widths
-        col_width = 15
-    
-        # Build header row
-        header_row = ";"
-        for col in formatted_df.columns:
-                header_row += saved_cols[col].ljust(col_width)
-    
-        # ---------------------------
-        # 3. BUILD DATA ROWS (FIXED)
-        # ---------------------------
-    
-        data_lines = []
-    
-        for _, row in formatted_df.iterrows():
-            line = ""
-            for col, val in zip(formatted_df.columns, row):
-                if col != "DateTime":
-                    line += val.ljust(col_width)
-            data_lines.append(line)
-
-        with open(output_path, "w") as f:
-            for line in hls:
-                f.write(line + "\n")
-    
-            f.write(header_row.rstrip() + "\n")
-    
-            for line in data_lines:
-                f.write(line.rstrip() + "\n")
+        # the buffer's views never change, so they can be written out while
+        # more data is collected
+        columns = [rows[col] for col in saved_cols]
+        if asynchronous:
+            datWriter.write_dat_file_async(fname, hls,
+                                           list(saved_cols.values()),
+                                           columns, callback=callback,
+                                           debug=self.debug)
+        else:
+            datWriter.write_dat_file(fname, hls, list(saved_cols.values()),
+                                     columns)
+            if callback is not None:
+                callback(fname)
         
         #np.savetxt(fname, df, fmt='%s        ', header=header, comments=";")
         self.parent.config["latest_scan_number"] += 1
         self.collectionStartTime = None
 
+    def save_burst_data(self, dXX=1, asynchronous=False, callback=None):
+        """
+        Saves the burst samples of the cRIO channels taken since the time scan
+        started into a .bXX file, named after the scan, which can be loaded as
+        a depTools.DepositionTimeScan. The times are in seconds since the
+        scan started, and the slower channels are forward filled from the
+        buffer. Nothing is saved if there are no burst samples.
+
+        dXX (int) : this file's index within the current scan. Defaults to 1
+
+        asynchronous (bool) : whether to write the file on a background thread
+            rather than waiting for it. Defaults to False.
+
+        callback (function) : called with the file name once the file has been
+            written. When saving asynchronously it is called from the
+            background thread. Defaults to None.
+        """
+        end = self.now()[0]
+        rows = self.burstSamples.between(
+            self.collectionStartTime, end,
+            ['Timestamp', 'Monotonic'] + self.burst_columns
+        )
+        if len(rows['Timestamp']) == 0:
+            return None
+
+        # the last buffer row before each burst sample, which can be from just
+        # before the scan started
+        slow_cols = ['Z_Motor', 'Beam_current', 'Sample T (K)']
+        slow = self.query(slow_cols, t1=end)
+        previous = np.searchsorted(slow['Timestamp'], rows['Timestamp'],
+                                   side='right') - 1
+        columns = [rows['Monotonic'] - self.collectionStartMonotonic]
+        columns += [rows[col] for col in self.burst_columns]
+        for col in slow_cols:
+            padded = np.concatenate([[np.nan], slow[col]])
+            columns.append(padded[previous + 1])
+        # the absorbance isn't measured during a time scan
+        columns.append(np.full(len(previous), np.nan))
+        column_names = ['Time/s', 'Ch0/V', 'Ch1/V', 'Ch2/V', 'Ch3/V',
+                        'Z_Motor', 'Beam_current', 'Temperature/K',
+                        'Absorbance']
+
+        scan_number = self.parent.config['latest_scan_number']
+        fname = self.parent.config["save_directory"] + \
+                f"Scan{scan_number}.b" + str(dXX).zfill(2)
+        start = datetime.fromtimestamp(self.collectionStartTime)
+        hls = [f";Burst samples of the cRIO channels, every "
+               f"{self.burst_polling_rate} ms, for Scan{scan_number}",
+               f";Started {start.strftime('%Y-%m-%d %H:%M:%S')}"]
+
+        if asynchronous:
+            datWriter.write_dat_file_async(fname, hls, column_names, columns,
+                                           callback=callback,
+                                           debug=self.debug)
+        else:
+            datWriter.write_dat_file(fname, hls, column_names, columns)
+            if callback is not None:
+                callback(fname)
+
     def start_timescan_collection(self):
         """
         """
@@ -358,7 +669,8 @@ class HardwareManager():
             print("Already collecting!")
             return None
         self.collecting = True
-        self.collectionStartTime = datetime.now()
+        self.collectionStartTime, self.collectionStartMonotonic = self.now()
+        self.burstPoller.start()
 
     def stop_timescan_collection(self):
         """
@@ -367,8 +679,16 @@ class HardwareManager():
             print("Already not collecting!")
             return None
         
-        # export the data
-        self.save_data()
+        # export the data, without holding up the GUI while it is written
+        self.burstPoller.stop()
+        self.save_burst_data(asynchronous=True, callback=self._log_saved)
+        self.save_data(asynchronous=True, callback=self._log_saved)
         self.dump_buffer()
 
-   
\ No newline at end of file
+   
+    def _log_saved(self, fname):
+        """
+        Log that a scan file has been written. Called from the thread which
+        wrote it, so this only goes through the event log's signal.
+        """
+        self.parent.log(f"Saved {fname}")
@@ -0,0 +1,567 @@
+import collections
+import json
+import os
+import queue
+import tempfile
+import threading
+import traceback
+
+import numpy as np
+import pandas as pd
+
+import bufferWriter
+
+class LRUCache():
+    """
+    A dictionary which holds at most max_size items, forgetting the least
+    recently used one to make room for a new one. Safe to use from several
+    threads.
+    """
+    def __init__(self, max_size):
+        """
+        max_size : (int) The most items kept.
+        """
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the item with this key, or None if it isn't cached
+        """
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class HistoryTiles():
+    """
+    Reads the buffer writer's archive (see bufferWriter.BufferWriter) for
+    browsing weeks of history, loading only what is needed to draw the part
+    of it in view.
+
+    The history is cut into tiles: a tile is a chunk of time at one level of
+    decimation, either the archived rows themselves or the minimum and
+    maximum of every bucket of a fixed width (10 s, 1 min, 10 min or 1 h by
+    default), tile_buckets buckets to a tile. A view is drawn from the
+    coarsest tiles that still give about as many points as it has pixels,
+    so a month takes no more tiles than an hour. Tiles are kept in an LRU
+    cache, and the tiles either side of the view are loaded on a background
+    thread, ready for panning.
+
+    The decimated tiles are made from a summary of each partition of the
+    archive, its 10 s minima and maxima, which is made the first time the
+    partition is needed and saved in the archive's "tiles" directory. After
+    that the partition's CSV never needs parsing again. warm() makes the
+    missing summaries in the background, so even the first view of a long
+    stretch of history is quick.
+
+    The index of every partition is read once, when the archive is opened,
+    and after that kept up to date by the buffer writer (see
+    partition_written), so finding the partitions in view never touches the
+    disk. The buffer writer also passes on the rows it writes, which are
+    added to the cached rows and summary of their partition, so the
+    partition being written to never needs parsing again either. Dumps from
+    before the archive was partitioned have no index line, so theirs is made
+    in the background by reading their timestamps, once, and saved in the
+    "tiles" directory along with the summaries. They can be browsed as soon
+    as they are indexed.
+    """
+    def __init__(self, directory, columns, raw_interval, debug,
+                 widths=(10, 60, 600, 3600), tile_buckets=1000,
+                 max_tiles=256):
+        """
+        directory : (str) The archive directory.
+        columns : (list) The archived columns which can be browsed.
+        raw_interval : (float) The time in seconds between archived rows.
+        debug : (bool) Whether to print debug information.
+        widths : (tuple) The bucket widths in seconds of the levels of
+            decimation, finest first. The first is the width of the
+            partition summaries. Defaults to 10 s, 1 min, 10 min and 1 h.
+        tile_buckets : (int) The number of buckets, or archived rows, in a
+            tile. Defaults to 1000.
+        max_tiles : (int) The most tiles kept in memory. Defaults to 256.
+        """
+        self.directory = directory
+        self.columns = list(columns)
+        self.raw_interval = raw_interval
+        self.debug = debug
+        self.widths = list(widths)
+        self.tile_buckets = tile_buckets
+        self.summary_directory = os.path.join(directory, "tiles")
+
+        # the index of every partition, keyed by path, and what is known of
+        # the dumps without one, see _scan
+        self._indices = {}
+        self._legacy = {}
+        self._indices_lock = threading.Lock()
+        # held while a partition's cached rows or summary are made or added
+        # to, so that only one thread does it at a time
+        self._path_locks = collections.defaultdict(threading.RLock)
+
+        self.tiles = LRUCache(max_tiles)
+        # the last few partitions parsed, for the undecimated tiles, and the
+        # summaries, keyed by path along with the index they are up to date
+        # with
+        self._partitions = LRUCache(4)
+        self._summaries = LRUCache(64)
+        self._warming = False
+
+        # tiles and summaries to load, and dumps to index, in the background
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._queue_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="History prefetch", daemon=True)
+        self._thread.start()
+        self._scan()
+
+    def stop(self, timeout=2):
+        """
+        Stop loading in the background, waiting up to timeout seconds for
+        whatever is loading to finish. Anything still queued is dropped.
+        """
+        if self._thread is None:
+            return None
+        self._stop_event.set()
+        # wake the thread if it is waiting on an empty queue
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        """
+        Load whatever is queued until told to stop
+        """
+        while not self._stop_event.is_set():
+            key, function = self._queue.get()
+            if self._stop_event.is_set():
+                break
+            try:
+                function()
+            except Exception:
+                if self.debug:
+                    print(f"Failed to prefetch {key}")
+                    traceback.print_exc()
+            with self._queue_lock:
+                self._queued.discard(key)
+
+    def _legacy_path(self):
+        return os.path.join(self.summary_directory, "legacy.json")
+
+    def _scan(self):
+        """
+        Read the index of every partition in the archive. Those without an
+        index line which were indexed last time and haven't changed since
+        use that index, and the rest are indexed in the background.
+        """
+        if not os.path.isdir(self.directory):
+            return None
+        saved = {}
+        if os.path.isfile(self._legacy_path()):
+            try:
+                with open(self._legacy_path()) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+        indices = {}
+        legacy = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".csv"):
+                continue
+            path = os.path.join(self.directory, name)
+            index = bufferWriter.read_index(path)
+            if index is None:
+                stat = os.stat(path)
+                entry = saved.get(name)
+                if entry is None or entry[:2] != [stat.st_size,
+                                                  stat.st_mtime_ns]:
+                    self._enqueue(("index", path),
+                                  lambda name=name, path=path, stat=stat:
+                                  self._index_dump(name, path, stat))
+                    continue
+                legacy[name] = entry
+                index = None if entry[2] is None else tuple(entry[2])
+            if index is not None:
+                indices[path] = index
+        with self._indices_lock:
+            self._indices.update(indices)
+            self._legacy.update(legacy)
+        # forget the dumps which are gone
+        if set(legacy) != set(saved):
+            self._save_legacy()
+
+    def _index_dump(self, name, path, stat):
+        """
+        Index a dump without an index line from its timestamps, and make it
+        available for browsing
+        """
+        index = _index_legacy(path, self.debug)
+        with self._indices_lock:
+            self._legacy[name] = [stat.st_size, stat.st_mtime_ns,
+                                  None if index is None else list(index)]
+            if index is not None:
+                indices = dict(self._indices)
+                indices[path] = index
+                self._indices = indices
+        self._save_legacy()
+        if index is not None:
+            # tiles loaded before now are missing its rows
+            self.tiles.clear()
+            if self._warming:
+                self._enqueue(("summary", path),
+                              lambda: self._summary(path))
+
+    def _save_legacy(self):
+        """
+        Save the indices of the dumps without an index line
+        """
+        with self._indices_lock:
+            legacy = dict(self._legacy)
+        try:
+            os.makedirs(self.summary_directory, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(suffix=".tmp",
+                                             dir=self.summary_directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(legacy, f)
+            os.replace(temporary, self._legacy_path())
+        except OSError:
+            if self.debug:
+                traceback.print_exc()
+
+    def partition_written(self, path, index, rows=None):
+        """
+        Note that rows have been written to a partition, so that its new
+        index is used, and add them to its cached rows and summary. Called
+        by the buffer writer after every write, see
+        bufferWriter.BufferWriter.write_functions.
+
+        path : (str) The path of the partition.
+        index : (tuple) Its first and last timestamps and number of rows.
+        rows : (pandas.DataFrame) The rows written. Defaults to None, in
+            which case the partition's cached rows and summary are made
+            again from its CSV when they are next needed.
+        """
+        index = tuple(index)
+        with self._path_locks[path]:
+            with self._indices_lock:
+                previous = self._indices.get(path)
+                indices = dict(self._indices)
+                indices[path] = index
+                self._indices = indices
+            if rows is None:
+                return None
+            timestamps = rows['Timestamp'].to_numpy(dtype=float)
+            values = rows.reindex(columns=self.columns).to_numpy(
+                dtype=float).T
+
+            # a new partition starts with just these rows, and one which is
+            # cached and up to date up to them has them added
+            cached = self._partitions.get(path)
+            if previous is None:
+                self._partitions.put(path, (index, timestamps, values))
+            elif cached is not None and cached[0] == previous:
+                self._partitions.put(path, (
+                    index, np.concatenate([cached[1], timestamps]),
+                    np.concatenate([cached[2], values], axis=1)))
+
+            added = _bucket(timestamps, values, self.widths[0])
+            cached = self._summaries.get(path)
+            if previous is None:
+                self._summaries.put(path, (index,) + added)
+            elif cached is not None and cached[0] == previous:
+                # the first bucket added can carry on the last one cached
+                summary = _rebucket(
+                    np.concatenate([cached[1], added[0]]),
+                    np.concatenate([cached[2], added[1]], axis=1),
+                    np.concatenate([cached[3], added[2]], axis=1),
+                    self.widths[0])
+                self._summaries.put(path, (index,) + summary)
+
+    def _index(self, path):
+        """
+        Returns the index of a partition
+        """
+        with self._indices_lock:
+            return self._indices[path]
+
+    def _partitions_between(self, t0, t1):
+        """
+        Returns the paths of the partitions which hold rows with
+        t0 < Timestamp < t1, oldest first
+        """
+        with self._indices_lock:
+            indices = self._indices
+        return [path for first, path in sorted(
+            (index[0], path) for path, index in indices.items()
+            if index[1] > t0 and index[0] < t1)]
+
+    def _last_archived(self):
+        """
+        Returns the last timestamp in the archive, or -inf if it is empty
+        """
+        with self._indices_lock:
+            indices = self._indices
+        return max((index[1] for index in indices.values()), default=-np.inf)
+
+    def _enqueue(self, key, function):
+        with self._queue_lock:
+            if key in self._queued:
+                return None
+            self._queued.add(key)
+        self._queue.put((key, function))
+
+    def warm(self):
+        """
+        Make the summaries of every partition of the archive which doesn't
+        have an up to date one, in the background, including those of dumps
+        still being indexed
+        """
+        self._warming = True
+        for path in self._partitions_between(-np.inf, np.inf):
+            self._enqueue(("summary", path),
+                          lambda path=path: self._summary(path))
+
+    def _partition(self, path):
+        """
+        Returns the timestamps and the values of the columns (one row per
+        column) of a partition, parsing it if it isn't cached
+        """
+        with self._path_locks[path]:
+            index = self._index(path)
+            cached = self._partitions.get(path)
+            if cached is not None and cached[0] == index:
+                return cached[1:]
+            legacy = bufferWriter.read_index(path) is None
+            wanted = ['Timestamp'] + self.columns
+            # only the rows the index counts, since more may be being
+            # written, and will be passed to partition_written
+            df = pd.read_csv(path, skiprows=0 if legacy else 1,
+                             nrows=None if legacy else index[2],
+                             usecols=lambda col: col in wanted)
+            df = df.reindex(columns=wanted)
+            if legacy:
+                # old dumps weren't always in order, or complete
+                df = df.dropna(subset=['Timestamp']).sort_values(
+                    'Timestamp', kind='stable')
+            cached = (index, df['Timestamp'].to_numpy(dtype=float),
+                      df[self.columns].to_numpy(dtype=float).T)
+            self._partitions.put(path, cached)
+            return cached[1:]
+
+    def _summary_path(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.summary_directory, f"{name}.npz")
+
+    def _summary(self, path):
+        """
+        Returns the start times, minima and maxima (one row per column) of
+        the finest buckets of a partition. They are loaded from the saved
+        summary if it matches the partition's index, and otherwise made from
+        the partition and saved.
+        """
+        with self._path_locks[path]:
+            index = self._index(path)
+            cached = self._summaries.get(path)
+            if cached is not None and cached[0] == index:
+                return cached[1:]
+
+            cached = None
+            summary_path = self._summary_path(path)
+            if os.path.isfile(summary_path):
+                with np.load(summary_path, allow_pickle=False) as saved:
+                    if (list(saved['columns']) == self.columns
+                            and tuple(saved['index']) == index):
+                        cached = (saved['starts'], saved['minima'],
+                                  saved['maxima'])
+            if cached is None:
+                timestamps, values = self._partition(path)
+                cached = _bucket(timestamps, values, self.widths[0])
+                os.makedirs(self.summary_directory, exist_ok=True)
+                # written under a name of its own first, so a summary is
+                # never half written
+                fd, temporary = tempfile.mkstemp(suffix=".tmp",
+                                                 dir=self.summary_directory)
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, starts=cached[0], minima=cached[1],
+                             maxima=cached[2], columns=np.array(self.columns),
+                             index=np.array(index))
+                os.replace(temporary, summary_path)
+            self._summaries.put(path, (index,) + cached)
+            return cached
+
+    def _tile_span(self, width):
+        if width == 0:
+            return self.tile_buckets*self.raw_interval
+        return self.tile_buckets*width
+
+    def _load_tile(self, width, number, last_archived):
+        """
+        Returns one tile, loading it if it isn't cached. Undecimated tiles
+        (width 0) are the timestamps and values of the rows, decimated ones
+        are the start times, minima and maxima of the buckets.
+
+        last_archived : (float) The last timestamp in the archive. Tiles
+            which end after it are still being written to, so aren't cached.
+        """
+        key = (width, number)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            return tile
+
+        span = self._tile_span(width)
+        t0, t1 = number*span, (number + 1)*span
+        pieces = []
+        for path in self._partitions_between(t0, t1):
+            if width == 0:
+                timestamps, values = self._partition(path)
+                keep = (timestamps >= t0) & (timestamps < t1)
+                pieces.append((timestamps[keep], values[:, keep]))
+            else:
+                starts, minima, maxima = self._summary(path)
+                keep = (starts >= t0) & (starts < t1)
+                pieces.append(_rebucket(starts[keep], minima[:, keep],
+                                        maxima[:, keep], width))
+        n_columns = len(self.columns)
+        if width == 0:
+            tile = (np.concatenate([[]] + [p[0] for p in pieces]),
+                    np.concatenate([np.empty((n_columns, 0))]
+                                   + [p[1] for p in pieces], axis=1))
+        else:
+            # partitions can share a bucket, at midnight or when one fills
+            starts = np.concatenate([[]] + [p[0] for p in pieces])
+            minima = np.concatenate([np.empty((n_columns, 0))]
+                                    + [p[1] for p in pieces], axis=1)
+            maxima = np.concatenate([np.empty((n_columns, 0))]
+                                    + [p[2] for p in pieces], axis=1)
+            tile = _rebucket(starts, minima, maxima, width)
+
+        if t1 < last_archived:
+            self.tiles.put(key, tile)
+        return tile
+
+    def get(self, t0, t1, max_points, columns=None):
+        """
+        Returns the archived data between two times, at the coarsest level
+        which gives about max_points points, and starts loading the tiles
+        either side in the background.
+
+        Returns a dictionary of arrays keyed by column, including
+        "Timestamp". When decimated, each bucket gives two points at its
+        start time, its minimum then its maximum, as with
+        decimatedHistory.DecimatedHistory.select.
+
+        t0, t1 : (float) The time range, as unix timestamps.
+        max_points : (int) The most points wanted, such as the width of the
+            plot in pixels.
+        columns : (list) The columns wanted. Defaults to all of them.
+        """
+        if columns is None:
+            columns = self.columns
+        indices = [self.columns.index(col) for col in columns]
+        span = t1 - t0
+        if span/self.raw_interval <= max_points:
+            width = 0
+        else:
+            width = next((width for width in self.widths
+                          if 2*span/width <= max_points), self.widths[-1])
+
+        tile_span = self._tile_span(width)
+        first = int(np.floor(t0/tile_span))
+        last = int(np.floor(t1/tile_span))
+        last_archived = self._last_archived()
+        tiles = [self._load_tile(width, number, last_archived)
+                 for number in range(first, last + 1)]
+        for number in (first - 1, last + 1):
+            if (width, number) not in self.tiles:
+                self._enqueue(("tile", width, number),
+                              lambda number=number: self._load_tile(
+                                  width, number, last_archived))
+
+        if width == 0:
+            timestamps = np.concatenate([[]] + [tile[0] for tile in tiles])
+            values = np.concatenate([np.empty((len(self.columns), 0))]
+                                    + [tile[1] for tile in tiles], axis=1)
+            keep = (timestamps > t0) & (timestamps < t1)
+            selected = {'Timestamp':timestamps[keep]}
+            for col, i in zip(columns, indices):
+                selected[col] = values[i, keep]
+            return selected
+
+        starts = np.concatenate([[]] + [tile[0] for tile in tiles])
+        minima = np.concatenate([np.empty((len(self.columns), 0))]
+                                + [tile[1] for tile in tiles], axis=1)
+        maxima = np.concatenate([np.empty((len(self.columns), 0))]
+                                + [tile[2] for tile in tiles], axis=1)
+        keep = (starts > t0 - width) & (starts < t1)
+        selected = {'Timestamp':np.repeat(starts[keep], 2)}
+        for col, i in zip(columns, indices):
+            selected[col] = np.column_stack([minima[i, keep],
+                                             maxima[i, keep]]).ravel()
+        return selected
+
+
+def _bucket(timestamps, values, width):
+    """
+    Returns the start times, minima and maxima of the buckets of a width
+    which the rows fall in. The timestamps must be in order.
+    """
+    if len(timestamps) == 0:
+        return (np.empty(0), np.empty((len(values), 0)),
+                np.empty((len(values), 0)))
+    buckets = np.floor(timestamps/width)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    with np.errstate(invalid='ignore'):
+        minima = np.fmin.reduceat(values, starts, axis=1)
+        maxima = np.fmax.reduceat(values, starts, axis=1)
+    return buckets[starts]*width, minima, maxima
+
+def _rebucket(starts, minima, maxima, width):
+    """
+    Combines buckets, in order of their start times, into wider ones
+    """
+    if len(starts) == 0:
+        return starts, minima, maxima
+    buckets = np.floor(starts/width)
+    first = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    with np.errstate(invalid='ignore'):
+        return (buckets[first]*width,
+                np.fmin.reduceat(minima, first, axis=1),
+                np.fmax.reduceat(maxima, first, axis=1))
+
+def _index_legacy(path, debug):
+    """
+    Returns the first and last timestamps and the number of rows of a dump
+    from before the archive was partitioned, which has no index line, by
+    reading its timestamps. Returns None if it has none.
+    """
+    try:
+        timestamps = pd.read_csv(path, usecols=['Timestamp'])['Timestamp']
+        timestamps = timestamps.to_numpy(dtype=float)
+        timestamps = timestamps[~np.isnan(timestamps)]
+    except Exception:
+        if debug:
+            print(f"Unable to index {path}")
+            traceback.print_exc()
+        return None
+    if len(timestamps) == 0:
+        return None
+    return float(timestamps.min()), float(timestamps.max()), len(timestamps)
@@ -0,0 +1,69 @@
+import numpy as np
+
+class HampelFilter():
+    """
+    A streaming Hampel filter, which flags outliers in any number of channels
+    at once. For every channel it keeps a small rolling window of the previous
+    values. A new value is an outlier if it is further from the median of the
+    window than n_sigmas times the window's standard deviation, as estimated
+    from the median absolute deviation (MAD). The cost per sample depends only
+    on the window size, not on how much data has been collected.
+
+    Values are only flagged, never changed, and every value (outlier or not)
+    goes into the window. That way a real step change in a channel is flagged
+    for at most half a window, after which the median catches up with it.
+    """
+    def __init__(self, n_channels, window=7, n_sigmas=3, min_deviation=0.0):
+        """
+        n_channels : (int) The number of channels to filter.
+        window : (int) The number of previous values the median and MAD are
+            calculated from. Defaults to 7.
+        n_sigmas : (float) How many standard deviations from the median a
+            value must be to count as an outlier. Defaults to 3.
+        min_deviation : (float or array-like) The smallest distance from the
+            median that can count as an outlier, per channel if an array. This
+            stops noise-free channels (MAD of 0) flagging every tiny change.
+            Defaults to 0.
+        """
+        self.window = window
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        # don't flag anything until the window is at least half full
+        self.min_samples = window//2 + 1
+        self._values = np.full((n_channels, window), np.nan)
+        self._next = 0
+
+    @staticmethod
+    def _median(values, counts):
+        """
+        Returns the median of each row of values, ignoring NaNs. counts is the
+        number of non-NaN values in each row.
+        """
+        # NaNs sort to the end, so the median is in the first `counts` values
+        ordered = np.sort(values, axis=1)
+        lower = np.maximum((counts-1)//2, 0)[:, None]
+        upper = np.maximum(counts//2, 0)[:, None]
+        return 0.5*(np.take_along_axis(ordered, lower, axis=1) +
+                    np.take_along_axis(ordered, upper, axis=1))[:, 0]
+
+    def update(self, values):
+        """
+        Add one new value to every channel. Returns a boolean array which is
+        True for the channels whose new value is an outlier.
+
+        values : (array-like) The new value for each channel. NaNs are never
+            outliers, and are ignored in the window.
+        """
+        values = np.asarray(values, dtype=float)
+        counts = np.count_nonzero(~np.isnan(self._values), axis=1)
+        median = self._median(self._values, counts)
+        mad = self._median(np.abs(self._values - median[:, None]), counts)
+        # 1.4826 turns the MAD into a standard deviation for normal noise
+        threshold = np.maximum(self.n_sigmas*1.4826*mad, self.min_deviation)
+        outliers = (counts >= self.min_samples) & \
+                   (np.abs(values - median) > threshold)
+
+        self._values[:, self._next] = values
+        self._next = (self._next + 1) % self.window
+
+        return outliers
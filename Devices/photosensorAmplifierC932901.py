@@ -5,9 +5,15 @@ import sys
 import inspect
 import json
 import time
+import threading
 from time import sleep
 import numpy as np
 
+import simulatedHardware
+from ringBuffer import RingBuffer
+from serialConnection import SerialConnection, DeviceUnavailable
+import qualityFlags
+
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
@@ -16,63 +22,220 @@ with open("config.json") as f:
 
 class Photosensor():
     """
-    This class represents the Hamamatsu C9329-01 photosensor amplifier
+    This class represents the Hamamatsu C9329-01 photosensor amplifier.
+
+    The amplifier is kept in continuous measurement mode and read by its own
+    thread, which parses every measurement as it arrives into a small
+    timestamped buffer. Reading the output never waits on the serial port, and
+    the full native sample rate is available for deposition monitoring
+    through get_samples() and get_window_average().
     """
-    def __init__(self, debug):
+    def __init__(self, debug, clock=None):
+        """
+        debug : (bool) Whether to print debug information.
+        clock : (function) Called with no arguments for the unix and
+            monotonic times, which measurements are timestamped with. Defaults
+            to None, for time.time() and time.monotonic().
+        """
         self.debug = debug
+        if clock is None:
+            clock = lambda: (time.time(), time.monotonic())
+        self.clock = clock
         self.read_timeout = 0.06   # seconds
         self.write_timeout = 0.06    # seconds
         self.baudrate = 19200    # see pages 10 and 76 of the manual
         self.default_channel = config_file['photosensor_channel']
+        # the buffer columns read_all() returns values for
+        self.columns = ['Hamamatsu (V)']
+        # how many measurements are kept, and how old the latest can be before
+        # it is no longer given as the output
+        self.n_samples = 4096
+        self.max_age = 1.0   # seconds
+        self.samples = RingBuffer(['Timestamp', 'Hamamatsu (V)'],
+                                  self.n_samples)
+        # it is read every poll, see devicePoller.DevicePoller
+        self.channel_intervals = {}
 
-        try:
-            # establish the connection
-            self.ser = serial.Serial(self.default_channel,
-                                     baudrate=self.baudrate,
-                                     timeout=self.read_timeout,
-                                     write_timeout=self.write_timeout,
-                                     bytesize=serial.EIGHTBITS,
-                                     stopbits=serial.STOPBITS_ONE)
-            # set the sensor to continuous measurement mode
-            written = self.ser.write("*MOD0\n".encode('utf-8'))
-            self.ser.reset_input_buffer()
-        except Exception:
-            if self.debug:
-                traceback.print_exc()
-            self.ser = None
+        # the port is reopened in the background if the amplifier drops off
+        self.connection = SerialConnection("C9329-01", self._open_port,
+                                           self.debug)
 
-    def get_output(self):
-        try:
-            written = self.ser.write("*MOD0\n".encode('utf-8'))
-            self.ser.reset_input_buffer()
-            sleep(0.05)
-            line = self.ser.readline().decode('utf-8').strip()
-            self.ser.reset_output_buffer()
-            values = line.split(',')
-            #print(values)
-            if values[0][0] == '-':
-                # we have a negative sign in front, see the manual page 18
-                v0 = values[0][1:]
-                sign = -1
-            elif len(values[0]) == 5:
-                # we measure a positive value
-                v0 = values[0][1:]
-                sign = 1
-            elif len(values[0]) == 4:
-                # we measure a positive value
-                v0 = values[0]
-                sign = 1
-            else:
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.start()
+
+    def _open_port(self):
+        """
+        Opens the serial port to the amplifier, or a simulated one
+        """
+        if config_file.get("simulate_hardware", False):
+            return simulatedHardware.C9329_port(
+                config_file, self.baudrate, self.read_timeout,
+                self.write_timeout
+            )
+        return serial.Serial(self.default_channel,
+                             baudrate=self.baudrate,
+                             timeout=self.read_timeout,
+                             write_timeout=self.write_timeout,
+                             bytesize=serial.EIGHTBITS,
+                             stopbits=serial.STOPBITS_ONE)
+
+    def start(self):
+        """
+        Start reading the amplifier in the background
+        """
+        if self._thread is not None:
+            return None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="Photosensor reader",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """
+        Stop reading the amplifier, waiting up to timeout seconds
+        """
+        if self._thread is None:
+            return None
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def close(self):
+        """
+        Stop reading the amplifier and close the connection to it
+        """
+        self.stop()
+        self.connection.close()
+
+    def _parse_line(self, line):
+        """
+        Converts one measurement from the amplifier into volts. Measurements
+        are signed 16 bit hex, see the manual page 18. Returns NaN for anything
+        which isn't a measurement.
+        """
+        values = line.split(',')
+        if values[0][:1] == '-':
+            # we have a negative sign in front
+            v0 = values[0][1:]
+            sign = -1
+        elif len(values[0]) == 5:
+            # we measure a positive value
+            v0 = values[0][1:]
+            sign = 1
+        elif len(values[0]) == 4:
+            # we measure a positive value
+            v0 = values[0]
+            sign = 1
+        else:
+            if self.debug:
                 print(f"Unknown photosensor output: {line}")
+            return np.nan
 
-            #print(sign, v0)
+        try:
             measurement_raw = sign*int("0x"+v0, 0)
-            volts = measurement_raw *5/32767
-        except Exception:
+        except ValueError:
             if self.debug:
-                traceback.print_exc()
-            volts = np.nan
+                print(f"Unknown photosensor output: {line}")
+            return np.nan
+        return measurement_raw*5/32767
+
+    def _run(self):
+        """
+        Read every measurement the amplifier sends until told to stop. If the
+        measurements stop coming, ask for continuous mode again, and tell the
+        connection, which reconnects in the background if they don't restart.
+        """
+        last_received = -np.inf
+        while not self._stop_event.is_set():
+            ser = self.connection.port
+            if ser is None:
+                # wait for the connection to come back
+                last_received = -np.inf
+                self._stop_event.wait(0.1)
+                continue
+            try:
+                if time.monotonic() - last_received > self.max_age:
+                    if last_received > -np.inf:
+                        self.connection.report_failure()
+                    # set the sensor to continuous measurement mode
+                    ser.write("*MOD0\n".encode('utf-8'))
+                    last_received = time.monotonic()
+                line = ser.readline().decode('utf-8').strip()
+                if not line:
+                    continue
+                last_received = time.monotonic()
+                self.connection.report_success()
+                volts = self._parse_line(line)
+                if not np.isnan(volts):
+                    self.samples.append([self.clock()[0], volts])
+            except Exception as e:
+                if self.debug:
+                    traceback.print_exc()
+                self.connection.report_failure(e)
+                # don't spin on a broken port
+                self._stop_event.wait(0.1)
 
-        #print(volts)
+    def get_latest(self):
+        """
+        Returns the latest measurement in volts and the unix time, on
+        self.clock, it arrived at. Both are NaN if nothing has arrived yet.
+        """
+        if len(self.samples) == 0:
+            return np.nan, np.nan
+        latest = self.samples.last(1, ['Timestamp', 'Hamamatsu (V)'])
+        return (float(latest['Hamamatsu (V)'][0]),
+                float(latest['Timestamp'][0]))
+
+    def get_samples(self, seconds):
+        """
+        Returns the timestamps and values (in volts) of the measurements from
+        the last few seconds, as numpy arrays
+        """
+        now = self.clock()[0]
+        samples = self.samples.between(now - seconds, np.inf,
+                                       ['Timestamp', 'Hamamatsu (V)'])
+        return samples['Timestamp'], samples['Hamamatsu (V)']
+
+    def get_window_average(self, seconds):
+        """
+        Returns the mean of the measurements from the last few seconds, in
+        volts, or NaN if there were none
+        """
+        _, volts = self.get_samples(seconds)
+        if len(volts) == 0:
+            return np.nan
+        return float(volts.mean())
+
+    def get_output(self):
+        """
+        Returns the latest measurement in volts, or NaN if there hasn't been
+        one within the last max_age seconds. This never waits on the
+        amplifier.
+        """
+        volts, received = self.get_latest()
+        if not self.clock()[0] - received <= self.max_age:
+            return np.nan
         return volts
 
+    def read_channels(self, indices):
+        """
+        Returns the photosensor output as a numpy array, for each of the given
+        indices of self.columns (there is only the one), along with an array
+        of their quality flags. The output is NaN, and flagged NO_SIGNAL, if
+        no measurement has arrived recently. Raises DeviceUnavailable if the
+        amplifier is not connected.
+        """
+        if not self.connection.is_up:
+            raise DeviceUnavailable("the C9329-01 is not connected")
+        values = np.array([self.get_output() for i in indices])
+        return values, np.where(np.isnan(values), qualityFlags.NO_SIGNAL,
+                                0).astype(np.uint8)
+
+    def read_all(self):
+        """
+        Returns the photosensor output as a numpy array, ordered like
+        self.columns
+        """
+        return np.array([self.get_output()])
@@ -0,0 +1,30 @@
+"""
+Bit flags describing the quality of each value in the hardware manager's
+buffer. Every value in the buffer has a matching uint8 made by OR-ing together
+the flags that apply to it, and 0 means nothing is known to be wrong with the
+value. Use numpy to test them, e.g. to keep only the good values of a column:
+
+    good = (buffer.flags('Sample T (K)') & qualityFlags.OUTLIER) == 0
+
+or to keep only values with no flags at all, buffer.flags(column) == 0. The
+devices give the flags they know about along with their values (see
+devicePoller.DevicePoller), and the hardware manager adds the rest.
+"""
+
+# the value is a suspected outlier, see outlierFilter.HampelFilter
+OUTLIER = 1 << 0
+
+# the device hadn't answered by the tick's deadline, so the value is the last
+# one it gave, carried forward
+STALE = 1 << 1
+
+# the device didn't give a value, so it is NaN
+NO_SIGNAL = 1 << 2
+
+# the value is at the edge of what the sensor can measure, and the real value
+# may be beyond it, e.g. a pressure guage voltage which is out of range
+CLIPPED = 1 << 3
+
+# the device's connection is down and being reopened, so the value is the last
+# one it gave, carried forward
+RECONNECTING = 1 << 4
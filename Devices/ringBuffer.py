@@ -0,0 +1,344 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+def local_datetimes(timestamps):
+    """
+    Converts an array of unix timestamps (seconds) into an array of naive
+    numpy datetime64 values in local time, without a python object per value.
+    The UTC offset is looked up once per distinct hour, so daylight saving
+    changes inside the array are handled.
+
+    timestamps : (array-like) The unix timestamps to convert.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    hours, inverse = np.unique(np.floor(timestamps/3600), return_inverse=True)
+    offsets = np.array([time.localtime(hour*3600).tm_gmtoff for hour in hours],
+                       dtype=float)
+    microseconds = np.round((timestamps + offsets[inverse])*1e6)
+    return microseconds.astype('datetime64[us]')
+
+def format_times(timestamps):
+    """
+    Formats an array of unix timestamps as local "%H:%M:%S" strings, the same
+    as datetime.strftime would, but for the whole array at once.
+
+    timestamps : (array-like) The unix timestamps to format.
+    """
+    seconds = local_datetimes(timestamps).astype('datetime64[s]')
+    # "YYYY-MM-DDTHH:MM:SS", of which we keep the last 8 characters
+    iso = np.datetime_as_string(seconds).astype('<U19')
+    chars = iso.view('<U1').reshape(-1, 19)[:, 11:]
+    return chars.copy().view('<U8').ravel()
+
+
+class RingBuffer():
+    """
+    A fixed-size, columnar store for the data collected by the hardware
+    manager. It keeps the most recent `capacity` rows of float64 values, one
+    array per column, and has O(1) appends. The oldest rows are forgotten once
+    it is full.
+
+    Reading a column, the last N rows or a time range gives numpy views rather
+    than copies. New rows are only ever written after the end of the current
+    data, and when the storage runs out the newest rows are moved into fresh
+    storage (rather than being shuffled in place), so a view never changes
+    once it has been taken. Hold a view as long as you like, but take a new one
+    to see new data.
+
+    This costs memory. The storage has room for a quarter more rows than the
+    capacity, and every value takes 9 bytes (a float64 and its flags), so the
+    buffer holds about 11*capacity bytes per column. While the rows are being
+    moved the old and new storage both exist, which briefly doubles that, and
+    the old storage lives on for as long as anything holds a view of it. For
+    the hardware manager's 84000 rows of 29 columns that is about 27 MB, with
+    peaks of about 55 MB.
+
+    Alongside every value is a uint8 of quality flags (see qualityFlags),
+    which is 0 unless something is known to be wrong with the value.
+
+    The "Time" and "DateTime" columns are not stored. They are derived from the
+    "Timestamp" column whenever they are asked for.
+    """
+    derived_columns = ['Time', 'DateTime']
+
+    def __init__(self, columns, capacity):
+        """
+        columns : (list) The names of the columns to store, in order. Must
+            include "Timestamp" if the derived columns are to be used.
+        capacity : (int) The number of rows to keep.
+        """
+        self.columns = [col for col in columns
+                        if col not in self.derived_columns]
+        # every column we can give back, in the order we were given them
+        self._all_columns = list(columns)
+        self._column_index = {col:i for i, col in enumerate(self.columns)}
+        self.capacity = capacity
+
+        # we overallocate by a quarter, so the newest rows only need moving
+        # into fresh storage once every capacity/4 appends. Each move copies
+        # up to capacity rows into a new allocation the size of the old one
+        self._slack = max(1, capacity // 4)
+        self._data = np.full((len(self.columns), capacity + self._slack),
+                             np.nan)
+        self._quality = np.zeros(self._data.shape, dtype=np.uint8)
+        self._start = 0    # first valid row of self._data
+        self._end = 0      # one past the last valid row of self._data
+        # the number of rows appended since the buffer was created
+        self.total = 0
+
+        self._lock = threading.Lock()
+
+    def append(self, row, quality=None):
+        """
+        Add a row to the end of the buffer.
+
+        row : (dict or array-like) Either a dictionary keyed by column name
+            (missing columns are stored as NaN, unknown keys are ignored) or a
+            sequence of values ordered like self.columns.
+        quality : (dict or array-like) The quality flags of the row, either as
+            a dictionary of flags keyed by column name (missing columns get 0)
+            or a sequence of flags ordered like self.columns. Defaults to None,
+            meaning all 0.
+        """
+        if isinstance(row, dict):
+            values = np.full(len(self.columns), np.nan)
+            for col, i in self._column_index.items():
+                value = row.get(col, np.nan)
+                if isinstance(value, (int, float, np.number)):
+                    values[i] = value
+        else:
+            values = row
+        if isinstance(quality, dict):
+            flags = np.zeros(len(self.columns), dtype=np.uint8)
+            for col, flag in quality.items():
+                if col in self._column_index:
+                    flags[self._column_index[col]] = flag
+        elif quality is None:
+            flags = 0
+        else:
+            flags = quality
+
+        with self._lock:
+            if self._end == self._data.shape[1]:
+                # out of room, move the newest rows to the front of new storage
+                keep = min(self._end - self._start, self.capacity - 1)
+                data = np.empty_like(self._data)
+                data[:, :keep] = self._data[:, self._end-keep:self._end]
+                quality = np.empty_like(self._quality)
+                quality[:, :keep] = self._quality[:, self._end-keep:self._end]
+                self._data = data
+                self._quality = quality
+                self._start = 0
+                self._end = keep
+            self._data[:, self._end] = values
+            self._quality[:, self._end] = flags
+            self._end += 1
+            if self._end - self._start > self.capacity:
+                self._start += 1
+            self.total += 1
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        return iter(self._all_columns)
+
+    def __contains__(self, column):
+        return column in self._all_columns
+
+    def keys(self):
+        return list(self._all_columns)
+
+    def _storage(self):
+        """
+        Returns the current storage and its valid region, all taken together
+        """
+        with self._lock:
+            return self._data, self._start, self._end
+
+    def __getitem__(self, column):
+        """
+        Returns a whole column, oldest first. Stored columns are views.
+        """
+        return self._column(column, *self._storage())
+
+    def flags(self, column):
+        """
+        Returns the quality flags of a whole stored column, oldest first, as a
+        view lined up with buffer[column].
+        """
+        with self._lock:
+            quality, start, end = self._quality, self._start, self._end
+        return quality[self._column_index[column], start:end]
+
+    def _column(self, column, data, start, end):
+        """
+        Returns one column of the rows start:end of some storage
+        """
+        if column in self._column_index:
+            return data[self._column_index[column], start:end]
+        timestamps = data[self._column_index['Timestamp'], start:end]
+        if column == 'Time':
+            return format_times(timestamps)
+        elif column == 'DateTime':
+            return local_datetimes(timestamps)
+        raise KeyError(column)
+
+    def _rows(self, first, last, columns=None, storage=None):
+        """
+        Returns a dictionary of columns for rows first:last, counted from the
+        oldest row in the storage.
+        """
+        if columns is None:
+            columns = self._all_columns
+        if storage is None:
+            storage = self._storage()
+        data, start, end = storage
+        first = start + max(0, first)
+        last = start + min(end - start, last)
+        return {col:self._column(col, data, first, max(first, last))
+                for col in columns}
+
+    def last(self, n, columns=None):
+        """
+        Returns a dictionary of views of the last n rows, keyed by column.
+
+        n : (int) The number of rows.
+        columns : (list) The columns wanted. Defaults to all of them.
+        """
+        storage = self._storage()
+        length = storage[2] - storage[1]
+        return self._rows(length - n, length, columns, storage)
+
+    def since(self, cursor, columns=None):
+        """
+        Returns the rows appended after the first `cursor` rows ever appended,
+        as a dictionary of views keyed by column, along with the cursor to
+        pass next time to get only the rows after these. Rows which have
+        already fallen out of the buffer are skipped.
+
+        cursor : (int) The number of rows already seen, i.e. the cursor
+            returned by the previous call, or 0 to start from the beginning.
+        columns : (list) The columns wanted. Defaults to all of them.
+        """
+        with self._lock:
+            storage = (self._data, self._start, self._end)
+            total = self.total
+        length = storage[2] - storage[1]
+        n_new = max(0, min(total - cursor, length))
+        return self._rows(length - n_new, length, columns, storage), total
+
+    def since_arrays(self, cursor):
+        """
+        Like since(), but returns the rows appended after the first `cursor`
+        rows ever appended as two 2D views, of the values and of their quality
+        flags, with a row per stored column and a column per buffer row. Also
+        returns the number of rows ever appended before the first of them,
+        and the cursor to pass next time.
+        """
+        with self._lock:
+            data, quality = self._data, self._quality
+            start, end = self._start, self._end
+            total = self.total
+        n_new = max(0, min(total - cursor, end - start))
+        return (data[:, end-n_new:end], quality[:, end-n_new:end],
+                total - n_new, total)
+
+    def between(self, t0, t1, columns=None):
+        """
+        Returns a dictionary of views of the rows with t0 < Timestamp < t1,
+        keyed by column. Found by binary search, so the timestamps must be in
+        order.
+
+        t0, t1 : (float) The time range, as unix timestamps.
+        columns : (list) The columns wanted. Defaults to all of them.
+        """
+        storage = self._storage()
+        timestamps = self._column('Timestamp', *storage)
+        first = np.searchsorted(timestamps, t0, side='right')
+        last = np.searchsorted(timestamps, t1, side='left')
+        return self._rows(first, last, columns, storage)
+
+    def views(self):
+        """
+        Returns dictionaries of read-only views of every stored column, and of
+        their quality flags, all taken from the same rows together.
+        """
+        with self._lock:
+            data, quality = self._data, self._quality
+            start, end = self._start, self._end
+        columns = {}
+        flags = {}
+        for col, i in self._column_index.items():
+            columns[col] = data[i, start:end]
+            columns[col].flags.writeable = False
+            flags[col] = quality[i, start:end]
+            flags[col].flags.writeable = False
+        return columns, flags
+
+    def flags_between(self, t0, t1, columns=None):
+        """
+        Returns a dictionary of views of the quality flags of the rows with
+        t0 < Timestamp < t1, keyed by column, lined up with between(t0, t1).
+        Use them to pick out the good values of a time range without checking
+        for NaNs, e.g.
+
+            rows = buffer.between(t0, t1, ['Sample T (K)'])
+            flags = buffer.flags_between(t0, t1, ['Sample T (K)'])
+            good = rows['Sample T (K)'][flags['Sample T (K)'] == 0]
+
+        t0, t1 : (float) The time range, as unix timestamps.
+        columns : (list) The stored columns wanted. Defaults to all of them.
+        """
+        if columns is None:
+            columns = self.columns
+        with self._lock:
+            data, quality = self._data, self._quality
+            start, end = self._start, self._end
+        timestamps = data[self._column_index['Timestamp'], start:end]
+        first = start + np.searchsorted(timestamps, t0, side='right')
+        last = start + np.searchsorted(timestamps, t1, side='left')
+        return {col:quality[self._column_index[col], first:max(first, last)]
+                for col in columns}
+
+    def latest(self, columns=None):
+        """
+        Returns the newest row as a dictionary keyed by column. Raises
+        IndexError if the buffer is empty.
+
+        columns : (list) The columns wanted. Defaults to all of them,
+            including the derived columns, which are only formatted if they
+            are asked for.
+        """
+        if len(self) == 0:
+            raise IndexError("the buffer is empty")
+        if columns is None:
+            columns = self._all_columns
+        stored = [col for col in columns if col in self._column_index]
+        if len(stored) < len(columns):
+            stored.append('Timestamp')
+        row = self.last(1, stored)
+        latest = {col:float(values[0]) for col, values in row.items()}
+        if 'Time' in columns:
+            latest['Time'] = str(format_times([latest['Timestamp']])[0])
+        if 'DateTime' in columns:
+            latest['DateTime'] = pd.Timestamp(
+                local_datetimes([latest['Timestamp']])[0]
+            )
+        return {col:latest[col] for col in columns}
+
+    def to_dataframe(self, rows=None):
+        """
+        Returns a pandas DataFrame of the buffer, with all columns in their
+        original order.
+
+        rows : (dict) A dictionary of columns as returned by last() or
+            between(). Defaults to the whole buffer.
+        """
+        if rows is None:
+            rows = self._rows(0, self.capacity)
+        return pd.DataFrame(rows, columns=[col for col in self._all_columns
+                                           if col in rows])
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import traceback
+
+import numpy as np
+
+from ringBuffer import RingBuffer
+
+MAGIC = b"DUVET journal 1\n"
+# the header holds the magic, the columns as json and, in its last 8 bytes,
+# the checkpoint. Records start straight after it.
+HEADER_SIZE = 4096
+
+def _record_dtype(n_columns):
+    """
+    The fixed size record of one buffer row: its number (counted from the
+    first row appended to the buffer), its values and their quality flags
+    """
+    return np.dtype([('seq', '<i8'), ('values', '<f8', (n_columns,)),
+                     ('flags', 'u1', (n_columns,))])
+
+def recover(path):
+    """
+    Returns a RingBuffer of the rows in a journal which were never archived,
+    along with their quality flags, or None if there are none (or there is no
+    journal). A record torn by a crash part way through writing it is
+    ignored.
+
+    path : (str) The journal file.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or not header.startswith(MAGIC):
+        return None
+    columns = json.loads(header[len(MAGIC):].split(b"\n", 1)[0])
+    checkpoint = int(np.frombuffer(header[-8:], dtype='<i8')[0])
+
+    dtype = _record_dtype(len(columns["stored"]))
+    n_records = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    records = np.fromfile(path, dtype=dtype, count=n_records,
+                          offset=HEADER_SIZE)
+    records = records[records['seq'] >= checkpoint]
+    if len(records) == 0:
+        return None
+
+    rows = RingBuffer(columns["all"], len(records))
+    for record in records:
+        rows.append(record['values'], record['flags'])
+    return rows
+
+
+class SampleJournal():
+    """
+    A write-ahead journal of the hardware manager's buffer, so the rows which
+    haven't been archived yet survive DUVET crashing or the power going off.
+
+    Every row is written to a binary file as a fixed size record, which is a
+    single unbuffered write per tick rather than a CSV line to format, and a
+    background thread asks the operating system to put the file on disk
+    every sync_interval seconds. Once the buffer writer has archived some
+    rows it moves the journal's checkpoint past them, and once the file has
+    grown past max_size it is compacted: the records past the checkpoint are
+    copied into a fresh journal, which replaces it, so it stays small even
+    though rows keep being journaled while the writer saves. When
+    DUVET starts it archives whatever is past the checkpoint (see recover)
+    before starting a new journal.
+    """
+    def __init__(self, path, buffer, debug, sync_interval=1,
+                 max_size=16*1024**2):
+        """
+        path : (str) The journal file. Any journal already there is replaced,
+            so recover it first.
+        buffer : (RingBuffer) The buffer to journal.
+        debug : (bool) Whether to print debug information.
+        sync_interval : (float) The time in seconds between putting the
+            journal on disk. Defaults to 1.
+        max_size : (int) The size in bytes the journal can grow to before it
+            is compacted, see checkpoint. Defaults to 16 MB.
+        """
+        self.path = path
+        self.buffer = buffer
+        self.debug = debug
+        self.sync_interval = sync_interval
+        self.max_size = max_size
+        self._dtype = _record_dtype(len(buffer.columns))
+
+        # the number of buffer rows ever appended which are already journaled
+        self.cursor = buffer.total
+
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        columns = json.dumps({"all":buffer.keys(), "stored":buffer.columns})
+        header = MAGIC + columns.encode() + b"\n"
+        if len(header) > HEADER_SIZE - 8:
+            raise ValueError("too many columns for the journal header")
+        self._header = header.ljust(HEADER_SIZE - 8, b" ")
+        self._lock = threading.Lock()
+        # unbuffered, so each write is one system call
+        self._file = open(path, "w+b", buffering=0)
+        self._file.write(self._header)
+        self._write_checkpoint(self.cursor)
+        self._end = HEADER_SIZE
+        self._dirty = True
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="Journal sync", daemon=True)
+        self._thread.start()
+
+    def _write_checkpoint(self, checkpoint):
+        self._file.seek(HEADER_SIZE - 8)
+        self._file.write(np.int64(checkpoint).astype('<i8').tobytes())
+
+    def write_new(self):
+        """
+        Journal the rows appended to the buffer since the last call. Called
+        by the collector after every append.
+        """
+        values, flags, first, cursor = self.buffer.since_arrays(self.cursor)
+        n_rows = values.shape[1]
+        if n_rows > 0:
+            records = np.empty(n_rows, dtype=self._dtype)
+            records['seq'] = np.arange(first, cursor)
+            records['values'] = values.T
+            records['flags'] = flags.T
+        with self._lock:
+            if n_rows > 0:
+                self._file.seek(self._end)
+                self._file.write(records.tobytes())
+                self._end += records.nbytes
+                self._dirty = True
+            self.cursor = cursor
+
+    def checkpoint(self, cursor):
+        """
+        Mark the rows before cursor (counted like RingBuffer.total) as
+        archived, so they aren't recovered. If the journal has grown past
+        max_size, and at most half of it is past the checkpoint, it is
+        compacted.
+        """
+        with self._lock:
+            self._write_checkpoint(cursor)
+            self._dirty = True
+            if self._end > self.max_size:
+                self._compact(cursor)
+
+    def _compact(self, checkpoint):
+        """
+        Replace the journal with one holding only the records past the
+        checkpoint. The new journal is written and put on disk under another
+        name first, so a crash part way through leaves the old one.
+        """
+        self._file.seek(HEADER_SIZE)
+        records = np.frombuffer(self._file.read(self._end - HEADER_SIZE),
+                                dtype=self._dtype)
+        records = records[records['seq'] >= checkpoint]
+        if records.nbytes > (self._end - HEADER_SIZE)/2:
+            # mostly rows which aren't archived yet, so wait for them to be
+            return None
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(self._header)
+            f.write(np.int64(checkpoint).astype('<i8').tobytes())
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # the journal has to be closed before it can be replaced on Windows.
+        # If replacing it fails, the old one carries on.
+        self._file.close()
+        try:
+            os.replace(temporary, self.path)
+        finally:
+            self._file = open(self.path, "r+b", buffering=0)
+            self._end = self._file.seek(0, os.SEEK_END)
+
+    def _run(self):
+        """
+        Put the journal on disk every sync_interval seconds, if anything was
+        written, until told to stop
+        """
+        while not self._stop_event.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """
+        Put everything written to the journal on disk
+        """
+        with self._lock:
+            if not self._dirty or self._file.closed:
+                return None
+            self._dirty = False
+            try:
+                os.fsync(self._file.fileno())
+            except OSError:
+                if self.debug:
+                    traceback.print_exc()
+
+    def close(self):
+        """
+        Stop syncing, and close the journal. What is in it stays there to be
+        recovered, unless it was checkpointed.
+        """
+        self._stop_event.set()
+        self._thread.join(2)
+        self.sync()
+        with self._lock:
+            self._file.close()
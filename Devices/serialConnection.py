@@ -0,0 +1,176 @@
+import threading
+import traceback
+import time
+
+class DeviceUnavailable(Exception):
+    """
+    Raised when reading a device whose connection is down. It is raised
+    straight away, rather than after waiting for the device to time out.
+    """
+
+
+class SerialConnection():
+    """
+    Looks after the serial port of one device, so that a device which drops
+    off (for example when its USB adapter is unplugged) doesn't cost a full
+    timeout on every poll until DUVET is restarted.
+
+    The device reports each exchange with report_success() or
+    report_failure(). After failure_threshold failures in a row the
+    connection is considered down, the port is closed and the circuit is
+    "open": port is None, so the device can give up on a read immediately.
+    Meanwhile a background thread tries to reopen the port, waiting twice as
+    long after each failed attempt, up to max_backoff. Once it reopens, the
+    device is tried again, and the backoff only resets once it answers.
+    """
+    def __init__(self, name, open_function, debug, failure_threshold=3,
+                 min_backoff=0.5, max_backoff=30):
+        """
+        name : (str) The name of the device, for the thread name and messages.
+        open_function : (function) Called with no arguments to open the port.
+            Returns the port, or raises an exception if it can't be opened.
+        debug : (bool) Whether to print debug information.
+        failure_threshold : (int) The number of failures in a row after which
+            the connection is considered down. Defaults to 3.
+        min_backoff : (float) The time in seconds before the first attempt to
+            reconnect. Defaults to 0.5.
+        max_backoff : (float) The longest time in seconds between attempts to
+            reconnect. Defaults to 30.
+        """
+        self.name = name
+        self.open_function = open_function
+        self.debug = debug
+        self.failure_threshold = failure_threshold
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self.port = None
+        self.state = "down"   # "connected", "down" or "reconnecting"
+        self.failures = 0     # in a row
+        self.n_reconnects = 0
+        self.last_error = None
+        self._backoff = min_backoff
+        self._next_attempt = None
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # the first attempt happens straight away, and in the foreground, so
+        # the device is ready to use when it is created if it can be
+        if not self._try_open():
+            self._start_reconnecting()
+
+    @property
+    def is_up(self):
+        return self.port is not None
+
+    def _try_open(self):
+        """
+        Try to open the port once. Returns whether it worked.
+        """
+        try:
+            port = self.open_function()
+        except Exception as e:
+            self.last_error = repr(e)
+            if self.debug:
+                print(f"Could not open the {self.name} port")
+                traceback.print_exc()
+            return False
+        with self._lock:
+            self.port = port
+            self.state = "connected"
+            self.failures = 0
+        return True
+
+    def _start_reconnecting(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return None
+            self.state = "reconnecting"
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._reconnect,
+                                            name=f"{self.name} reconnect",
+                                            daemon=True)
+            self._thread.start()
+
+    def _reconnect(self):
+        """
+        Try to reopen the port, backing off exponentially, until it opens or
+        we are told to stop
+        """
+        while True:
+            self._next_attempt = time.time() + self._backoff
+            if self._stop_event.wait(self._backoff):
+                return None
+            self.n_reconnects += 1
+            if self._try_open():
+                self._next_attempt = None
+                if self.debug:
+                    print(f"Reconnected to the {self.name}")
+                return None
+            self._backoff = min(2*self._backoff, self.max_backoff)
+
+    def report_success(self):
+        """
+        The device answered, so the connection is healthy
+        """
+        with self._lock:
+            self.failures = 0
+            self._backoff = self.min_backoff
+            self.last_error = None
+
+    def report_failure(self, error=None):
+        """
+        The device didn't answer, or the port raised an exception. Once this
+        has happened failure_threshold times in a row, the port is closed and
+        reconnecting starts in the background.
+
+        error : (Exception) What went wrong, if anything was raised.
+        """
+        with self._lock:
+            self.failures += 1
+            if error is not None:
+                self.last_error = repr(error)
+            if self.failures < self.failure_threshold or self.port is None:
+                return None
+            port, self.port = self.port, None
+            self.state = "down"
+        if self.debug:
+            print(f"Lost the {self.name}, reconnecting in the background")
+        try:
+            port.close()
+        except Exception:
+            if self.debug:
+                traceback.print_exc()
+        self._start_reconnecting()
+
+    def health(self):
+        """
+        Returns a dictionary describing the connection: its state, the number
+        of failures in a row, the number of attempts to reconnect made, the
+        last error and the unix time of the next attempt to reconnect (None
+        if there isn't one planned).
+        """
+        with self._lock:
+            return {"state":self.state, "failures":self.failures,
+                    "reconnects":self.n_reconnects,
+                    "last_error":self.last_error,
+                    "next_attempt":self._next_attempt}
+
+    def close(self):
+        """
+        Stop reconnecting and close the port
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        with self._lock:
+            port, self.port = self.port, None
+            self.state = "down"
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                if self.debug:
+                    traceback.print_exc()
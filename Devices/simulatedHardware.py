@@ -0,0 +1,562 @@
+"""
+Simulated stand-ins for the hardware, so that DUVET can be run, and the cost
+of polling measured, on a computer without ConSys or the serial instruments.
+Set "simulate_hardware" to true in config.json to use them.
+
+The simulation happens at the transport level: the ITC502 and C9329-01 talk
+to a SimulatedSerial port instead of a serial.Serial, and ConSysInterface
+loads a SimulatedCSAPI instead of CSAPI.dll. The device classes themselves
+run exactly as they would with the real hardware, including their parsing and
+their waiting on timeouts.
+
+Each device answers after a random delay, and now and then answers too late
+(after the reader has given up) or not at all. How often, and how long, is set
+per device in the "simulation" section of config.json, which overrides
+DEFAULTS. The values read follow synthetic but plausible signals (a cooling
+ramp on the sample temperature, a pumping down chamber, interference fringes
+on Ch2 as an ice film grows) which depend only on the time since the
+simulation started, and the random numbers are seeded, so runs are repeatable.
+
+Running this file benchmarks reading each simulated device:
+
+    python Devices/simulatedHardware.py [n_reads]
+"""
+import math
+import random
+import threading
+import time
+
+# the simulation settings, which can be overridden in the "simulation" section
+# of config.json. Times are in seconds, rates are probabilities per reply.
+DEFAULTS = {
+    "seed": 0,
+    "ITC502": {
+        "latency": 0.01,         # the time to start replying to a command
+        "jitter": 0.005,         # the standard deviation of the latency
+        "timeout_rate": 0.005,   # replies arriving after the reader gave up
+        "drop_rate": 0.005,      # commands which get no reply at all
+        "start_temperature": 295.0,    # K
+        "target_temperature": 20.0,    # K
+        "ramp_rate": 5.0,        # K/min, of the setpoint
+        "time_constant": 30.0,   # how slowly the sample follows the setpoint
+        "noise": 0.02,           # K
+    },
+    "C9329": {
+        "latency": 0.002,
+        "jitter": 0.001,
+        "timeout_rate": 0.0,
+        "drop_rate": 0.005,      # measurements missing from the stream
+        "stream_interval": 0.01,   # between measurements in continuous mode
+        "signal": 1.2,           # V
+        "noise": 0.005,          # V
+    },
+    "ConSys": {
+        "latency": 0.0002,       # per GetValue call
+        "jitter": 0.00005,
+        "timeout_rate": 0.0,     # calls which block for "timeout" seconds
+        "drop_rate": 0.0,        # calls which return NaN
+        "timeout": 0.1,
+        "connect_time": 0.2,     # to connect the registered parameters
+        "growth_rate": 1.0,      # nm/s, of the ice film on the sample
+        "fringe_contrast": 0.3,
+        "noise": 0.002,          # V, on the channels
+    },
+}
+
+# every simulated signal is a function of the time since this
+START_TIME = time.monotonic()
+
+def elapsed():
+    """
+    Returns the time in seconds since the simulation started
+    """
+    return time.monotonic() - START_TIME
+
+def settings(config, device):
+    """
+    Returns the simulation settings of one device, DEFAULTS overridden by
+    anything given in the "simulation" section of the config. The seed is
+    included.
+
+    config : (dict) The contents of config.json.
+    device : (str) "ITC502", "C9329" or "ConSys".
+    """
+    overrides = config.get("simulation", {})
+    device_settings = dict(DEFAULTS[device])
+    device_settings.update(overrides.get(device, {}))
+    device_settings["seed"] = overrides.get("seed", DEFAULTS["seed"])
+    return device_settings
+
+
+class ReplyTiming():
+    """
+    Decides when, if ever, a simulated device's reply arrives. Shared by the
+    simulated serial ports and the simulated ConSys library.
+    """
+    def __init__(self, latency, jitter, timeout_rate, drop_rate, seed):
+        """
+        latency : (float) The mean time in seconds before a reply starts.
+        jitter : (float) The standard deviation of that time.
+        timeout_rate : (float) The probability of a reply being late.
+        drop_rate : (float) The probability of there being no reply at all.
+        seed : (int) The seed for the random numbers.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+    def delay(self, late):
+        """
+        Returns how long the next reply takes, or None if it is dropped. A late
+        reply takes an extra `late` seconds.
+        """
+        chance = self.random.random()
+        if chance < self.drop_rate:
+            return None
+        delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+        if chance < self.drop_rate + self.timeout_rate:
+            delay += late
+        return delay
+
+    def noise(self, size):
+        """
+        Returns some gaussian noise with standard deviation size
+        """
+        return self.random.gauss(0.0, size)
+
+
+class SimulatedSerial():
+    """
+    A stand-in for serial.Serial, connected to a simulated device rather than
+    a port. It supports the parts of pyserial's interface DUVET uses. Bytes
+    written are passed to the device a command at a time, and its replies
+    arrive in the input buffer after a delay which includes the time to send
+    them at the baud rate. Reads wait for them, up to the timeout, just like a
+    real port.
+
+    A device in a continuous measurement mode can also stream lines, which
+    arrive every stream_interval seconds.
+    """
+    def __init__(self, device, baudrate, timeout, write_timeout=None,
+                 **kwargs):
+        """
+        device : (object) The simulated device. It must have a `terminator`
+            (the bytes which end a command), a respond(command) function
+            which returns the reply bytes or None, and a `streaming` flag
+            along with a stream() function giving the next streamed line.
+        baudrate : (int) The baud rate, used to work out transmission times.
+        timeout : (float) The read timeout in seconds.
+        write_timeout : (float) Accepted for compatibility, writes never block.
+
+        The remaining keyword arguments are the device's simulation settings,
+        see DEFAULTS.
+        """
+        self.device = device
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.timing = ReplyTiming(kwargs["latency"], kwargs["jitter"],
+                                  kwargs["timeout_rate"], kwargs["drop_rate"],
+                                  kwargs["seed"])
+        self.stream_interval = kwargs.get("stream_interval", None)
+        self.is_open = True
+
+        self._lock = threading.Lock()
+        self._written = b""
+        self._pending = []   # (arrival time, bytes), in order of arrival
+        self._input = b""    # bytes which have arrived but not been read
+        self._ready = 0.0    # when the device last finished a command
+        self._last_stream = None   # the arrival time of the last streamed line
+
+    def _transmission_time(self, n_bytes):
+        # 10 bits per byte, counting the start and stop bits
+        return n_bytes*10/self.baudrate
+
+    def write(self, data):
+        """
+        Send bytes to the device. Returns the number of bytes written.
+        """
+        now = time.monotonic()
+        with self._lock:
+            # the bytes of earlier writes still waiting for their terminator
+            # have already arrived
+            received = -len(self._written)
+            self._written += data
+            terminator = self.device.terminator
+            while terminator in self._written:
+                command, self._written = self._written.split(terminator, 1)
+                received += len(command) + len(terminator)
+                # the device gets each command once its last byte arrives,
+                # and deals with them one at a time. It can work on the next
+                # one while the reply to the last is still being sent.
+                sent = now + self._transmission_time(max(received, 0))
+                reply = self.device.respond(command.decode('utf-8'))
+                if self.device.streaming and self._last_stream is None:
+                    self._last_stream = sent
+                if reply is None:
+                    continue
+                delay = self.timing.delay(late=self.timeout)
+                if delay is None:
+                    continue
+                self._ready = max(sent, self._ready) + delay
+                arrival = (max(self._ready, self._pending[-1][0]
+                               if self._pending else now)
+                           + self._transmission_time(len(reply)))
+                self._pending.append((arrival, reply))
+        return len(data)
+
+    def _receive(self, now):
+        """
+        Move everything which has arrived by now into the input buffer
+        """
+        if self.device.streaming and self.stream_interval:
+            if self._last_stream is None:
+                self._last_stream = now
+            # add the lines streamed since last time, in order
+            while self._last_stream + self.stream_interval <= now:
+                self._last_stream += self.stream_interval
+                if self.timing.delay(late=0) is not None:
+                    self._pending.append((self._last_stream,
+                                          self.device.stream()))
+            self._pending.sort(key=lambda item: item[0])
+        else:
+            self._last_stream = None
+        while self._pending and self._pending[0][0] <= now:
+            self._input += self._pending.pop(0)[1]
+
+    def _next_arrival(self):
+        """
+        Returns the time the next bytes will arrive, or None if none are due
+        """
+        times = []
+        if self._pending:
+            times.append(self._pending[0][0])
+        if (self.device.streaming and self.stream_interval
+                and self._last_stream is not None):
+            times.append(self._last_stream + self.stream_interval)
+        return min(times) if times else None
+
+    def read_until(self, expected=b"\n", size=None):
+        """
+        Read until the expected bytes, size bytes, or the timeout, whichever
+        comes first. Returns the bytes read, which are empty on a timeout
+        with nothing received. If expected is None, only size and the timeout
+        count.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self._receive(now)
+                end = -1
+                if expected is not None:
+                    end = self._input.find(expected)
+                    if end >= 0:
+                        end += len(expected)
+                if size is not None and len(self._input) >= size:
+                    end = size if end < 0 else min(end, size)
+                if end >= 0 or now >= deadline:
+                    if end < 0:
+                        end = len(self._input)
+                    data, self._input = self._input[:end], self._input[end:]
+                    return data
+                next_arrival = self._next_arrival()
+            wake = deadline if next_arrival is None else min(deadline,
+                                                             next_arrival)
+            time.sleep(max(0.0, wake - now))
+
+    def readline(self, size=None):
+        return self.read_until(b"\n", size)
+
+    def read(self, size=1):
+        return self.read_until(None, size) if size else b""
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._receive(time.monotonic())
+            return len(self._input)
+
+    def reset_input_buffer(self):
+        """
+        Throw away everything received so far. Replies still on their way
+        arrive later as usual.
+        """
+        with self._lock:
+            self._receive(time.monotonic())
+            self._input = b""
+
+    def reset_output_buffer(self):
+        # writes are never buffered here
+        return None
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedITC502():
+    """
+    A simulated Oxford Instruments ITC502 temperature controller. The
+    setpoint ramps from the start to the target temperature, and the sample
+    follows it with a lag, so the heater works hardest at the end of the ramp.
+    Replies are terminated by a carriage return only, like the real thing.
+    """
+    terminator = b"\r"
+    streaming = False
+
+    def __init__(self, **kwargs):
+        """
+        The keyword arguments are the simulation settings, see DEFAULTS
+        """
+        self.settings = kwargs
+        self.timing = ReplyTiming(0, 0, 0, 0, kwargs["seed"] + 1)
+        self.P = 5.0
+        self.I = 1.0
+        self.D = 0.0
+
+    def setpoint(self, t):
+        s = self.settings
+        ramped = s["start_temperature"] - s["ramp_rate"]*t/60
+        return max(ramped, s["target_temperature"])
+
+    def temperature(self, t):
+        """
+        The sample temperature, which lags the setpoint by the time constant
+        """
+        s = self.settings
+        tau = s["time_constant"]
+        ramp_time = (s["start_temperature"] - s["target_temperature"]) \
+                    / (s["ramp_rate"]/60)
+        lag = s["ramp_rate"]/60*tau
+        if t < ramp_time:
+            # a first order lag behind a linear ramp
+            return self.setpoint(t) + lag*(1 - math.exp(-t/tau))
+        # then settling onto the target
+        at_end = lag*(1 - math.exp(-ramp_time/tau))
+        return s["target_temperature"] + at_end*math.exp(-(t - ramp_time)/tau)
+
+    def heater_power(self, t):
+        error = self.temperature(t) - self.setpoint(t)
+        return min(max(40 - 20*error, 0), 99.9)
+
+    def respond(self, command):
+        """
+        Returns the reply to a command, see page 44 onwards of the manual
+        """
+        t = elapsed()
+        readings = {
+            "R0": lambda: self.setpoint(t),
+            "R1": lambda: self.temperature(t)
+                          + self.timing.noise(self.settings["noise"]),
+            "R5": lambda: self.heater_power(t),
+            "R8": lambda: self.P,
+            "R9": lambda: self.I,
+            "R10": lambda: self.D,
+        }
+        if command in readings:
+            return b"R%+05d\r" % round(readings[command]()*10)
+        elif command == "X":
+            return b"X0A1C3S00H1L0\r"
+        elif command[:1] in ("T", "P", "I", "D", "C", "A"):
+            # settings are acknowledged with the command letter
+            return command[:1].encode('utf-8') + b"\r"
+        return b"?" + command.encode('utf-8') + b"\r"
+
+
+class SimulatedC9329():
+    """
+    A simulated Hamamatsu C9329-01 photosensor amplifier. Once put into
+    continuous measurement mode with *MOD0 it streams a measurement every
+    stream_interval seconds, as signed 16 bit hex, see page 18 of the manual.
+    """
+    terminator = b"\n"
+
+    def __init__(self, **kwargs):
+        """
+        The keyword arguments are the simulation settings, see DEFAULTS
+        """
+        self.settings = kwargs
+        self.timing = ReplyTiming(0, 0, 0, 0, kwargs["seed"] + 2)
+        self.streaming = False
+
+    def voltage(self, t):
+        # a slow drift, like a lamp warming up
+        return self.settings["signal"]*(1 + 0.05*math.sin(t/300)) \
+            + self.timing.noise(self.settings["noise"])
+
+    def stream(self):
+        raw = round(self.voltage(elapsed())*32767/5)
+        raw = min(max(raw, -32767), 32767)
+        sign = "-" if raw < 0 else "+"
+        return f"{sign}{abs(raw):04X}\r\n".encode('utf-8')
+
+    def respond(self, command):
+        if command.strip() == "*MOD0":
+            self.streaming = True
+        return None
+
+
+class SimulatedFunction():
+    """
+    A function of the simulated ConSys library. Like a ctypes function it
+    accepts restype and argtypes being set, which are ignored.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.restype = None
+        self.argtypes = None
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+
+class SimulatedCSAPI():
+    """
+    A stand-in for the ConSys API library, CSAPI.dll, with the functions
+    ConSysInterface uses. The values of the registered parameters follow
+    synthetic signals, see SIGNALS.
+    """
+    def __init__(self, **kwargs):
+        """
+        The keyword arguments are the simulation settings, see DEFAULTS
+        """
+        self.settings = kwargs
+        self.timing = ReplyTiming(kwargs["latency"], kwargs["jitter"],
+                                  kwargs["timeout_rate"], kwargs["drop_rate"],
+                                  kwargs["seed"] + 3)
+        self._lock = threading.Lock()
+        self._registered = {}
+
+        self.RegisterParameterStringEx1 = SimulatedFunction(self._register)
+        self.WaitForAllParametersConnected = SimulatedFunction(self._wait)
+        self.GetValue = SimulatedFunction(self._get_value)
+        self.DeRegister = SimulatedFunction(self._deregister)
+        self.CloseCsAPI = SimulatedFunction(lambda: None)
+
+    def _register(self, parameter_string, length, flags):
+        names = parameter_string[:length].decode().split(" ")
+        with self._lock:
+            handle = len(self._registered) + 1
+            self._registered[handle] = [self.signals.get(name, lambda t: 0.0)
+                                        for name in names]
+        return handle
+
+    def _wait(self, handle, timeout):
+        time.sleep(min(self.settings["connect_time"], timeout/1000))
+        return 1
+
+    def _deregister(self, handle):
+        with self._lock:
+            self._registered.pop(handle, None)
+        return 1
+
+    def _get_value(self, handle, index):
+        with self._lock:
+            delay = self.timing.delay(late=self.settings["timeout"])
+            noise = self.timing.noise(1.0)
+        if delay is None:
+            return math.nan
+        time.sleep(delay)
+        return self._registered[handle][index](elapsed(), noise)
+
+    @property
+    def signals(self):
+        """
+        The signal of each ConSys parameter, as functions of the time and a
+        standard normal random number
+        """
+        s = self.settings
+        n = s["noise"]
+
+        def fringes(t, z):
+            # light reflected from both sides of a growing ice film. A fringe
+            # passes every half wavelength of optical thickness.
+            thickness = s["growth_rate"]*t    # nm
+            phase = 4*math.pi*1.31*thickness/632.8
+            return 1.0*(1 + s["fringe_contrast"]*math.cos(phase)) + n*z
+
+        return {
+            # pumping down to 2e-9 mbar
+            'PLCAI1uv1.adc': lambda t, z: 7.75 + 0.75*math.log10(
+                2e-9 + 1e-6*math.exp(-t/600)),
+            # the dosing line emptying to 1e-3 mbar
+            'PLCAI2uv1.adc': lambda t, z: 5.5 + math.log10(
+                1e-3 + 10*math.exp(-t/120)),
+            # scanning 110 to 220 nm and back
+            'MONOuv1.cwl': lambda t, z: 110 + abs((t % 220) - 110),
+            'MONOuv1.whichGr': lambda t, z: 1.0,
+            'TABLEPOSuv1.rPos': lambda t, z: 12.5,
+            'ENSuv1.rPos': lambda t, z: 0.5,
+            'EXSuv1.rPos': lambda t, z: 0.5,
+            'CRIO02AI0uv1.average': lambda t, z: 0.05 + n*z,
+            'CRIO02AI1uv1.average': lambda t, z: 0.8 + n*z,
+            'CRIO02AI2uv1.average': fringes,
+            'CRIO02AI3uv1.average': lambda t, z: 0.01 + n*z,
+            'CRIO02AI0uv1.NumToAverage': lambda t, z: 15.0,
+            # decaying between top ups every 10 minutes
+            'A2BeamCurrent.normal': lambda t, z: 180 + 20*math.exp(
+                -(t % 600)/1800),
+            'PLCDO0uv1.out1': lambda t, z: 1.0,
+            'MO1E_SCANuv1.rPos': lambda t, z: 10.0,
+            'CRIO02AVGuv1.blockTime': lambda t, z: 100.0,
+            'A2SAOrbitControl.UBX_Xavg': lambda t, z: 0.01*z,
+            'MRS441CAMast2.h': lambda t, z: 3.0,
+        }
+
+
+def ITC502_port(config, baudrate, timeout, write_timeout=None):
+    """
+    Returns a SimulatedSerial port connected to a simulated ITC502
+    """
+    device_settings = settings(config, "ITC502")
+    return SimulatedSerial(SimulatedITC502(**device_settings), baudrate,
+                           timeout, write_timeout, **device_settings)
+
+def C9329_port(config, baudrate, timeout, write_timeout=None):
+    """
+    Returns a SimulatedSerial port connected to a simulated C9329-01
+    """
+    device_settings = settings(config, "C9329")
+    return SimulatedSerial(SimulatedC9329(**device_settings), baudrate,
+                           timeout, write_timeout, **device_settings)
+
+def CSAPI_library(config):
+    """
+    Returns a simulated ConSys API library
+    """
+    return SimulatedCSAPI(**settings(config, "ConSys"))
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    import numpy as np
+
+    # the device modules read config.json from the working directory
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import tempControllerITC502 as TC
+    import ConSysInterface as CSI
+    import photosensorAmplifierC932901 as PA
+
+    n_reads = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for module in [TC, CSI, PA]:
+        module.config_file["simulate_hardware"] = True
+
+    for name, device in [("ITC502", TC.TemperatureController(debug=False)),
+                         ("C9329-01", PA.Photosensor(debug=False)),
+                         ("ConSys", CSI.ConSysInterface(debug=False))]:
+        times = []
+        n_missing = 0
+        for i in range(n_reads):
+            start = time.perf_counter()
+            values = device.read_all()
+            times.append(time.perf_counter() - start)
+            n_missing += np.isnan(values).sum()
+        times = np.array(times)*1000
+        print(f"{name:10s} read_all: mean {times.mean():7.2f} ms, "
+              f"95th percentile {np.percentile(times, 95):7.2f} ms, "
+              f"max {times.max():7.2f} ms, {n_missing} values missing")
@@ -5,6 +5,13 @@ import sys
 import inspect
 import json
 import time
+import threading
+
+import numpy as np
+
+import simulatedHardware
+from serialConnection import SerialConnection, DeviceUnavailable
+import qualityFlags
 
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
@@ -24,18 +31,51 @@ class TemperatureController():
         self.write_timeout = 0.03    # seconds
         self.baudrate = 9600    # see pages 10 and 76 of the manual
         self.default_channel = config_file['temperature_controller_channel']
+        # the controller is polled from its own thread, but commands can also
+        # come from the GUI
+        self.lock = threading.Lock()
+        # the buffer columns read_all() returns values for, in order
+        self.columns = ['Sample T (K)', 'Setpoint T (K)', 'Heater Power (%)',
+                        'ITC502_P (%)', 'ITC502_I (min)', 'ITC502_D (min)']
+        # the commands reading each of those columns, see page 44 of the manual
+        self._commands = ["R1\r", "R0\r", "R5\r", "R8\r", "R9\r", "R10\r"]
+        # the values each reading can take, see pages 44 and 47 of the
+        # manual. A reply outside its command's range can't be the answer to
+        # it.
+        self._reply_ranges = {"R0\r":(0, 500), "R1\r":(0, 500),
+                              "R5\r":(0, 99.9), "R8\r":(0, 999.9),
+                              "R9\r":(0, 140), "R10\r":(0, 273)}
+        # bytes received after the last complete reply
+        self._partial = b""
+        # whether replies to an earlier batch might still be on their way
+        self._unsettled = False
+        # the PID terms only change when someone changes them, so they are
+        # read every 10 s, and every poll for a while after they change. See
+        # devicePoller.DevicePoller.
+        self.channel_intervals = {'ITC502_P (%)':(10, True),
+                                  'ITC502_I (min)':(10, True),
+                                  'ITC502_D (min)':(10, True)}
 
-        try:
-            self.ser = serial.Serial(self.default_channel,
-                                     baudrate=self.baudrate,
-                                     timeout=self.read_timeout,
-                                     write_timeout=self.write_timeout,
-                                     bytesize=serial.EIGHTBITS,
-                                     stopbits=serial.STOPBITS_ONE,
-                                     parity=serial.PARITY_NONE)
-        except Exception:
-            if self.debug:
-                traceback.print_exc()
+        # the port is reopened in the background if the controller drops off
+        self.connection = SerialConnection("ITC502", self._open_port,
+                                           self.debug)
+
+    def _open_port(self):
+        """
+        Opens the serial port to the controller, or a simulated one
+        """
+        if config_file.get("simulate_hardware", False):
+            return simulatedHardware.ITC502_port(
+                config_file, self.baudrate, self.read_timeout,
+                self.write_timeout
+            )
+        return serial.Serial(self.default_channel,
+                             baudrate=self.baudrate,
+                             timeout=self.read_timeout,
+                             write_timeout=self.write_timeout,
+                             bytesize=serial.EIGHTBITS,
+                             stopbits=serial.STOPBITS_ONE,
+                             parity=serial.PARITY_NONE)
 
     def _parse_output(self, line):
         """
@@ -50,39 +90,164 @@ class TemperatureController():
         number = sign*float(line[2:])/10
         return prefix, number
 
-    def _send_command(self, command, debug=False):
-        written = 0
-        output = None
+    def _parse_reply(self, reply):
+        """
+        Interprets one reply from the controller, without its terminating
+        carriage return. Readings look like "R+2950", meaning 295.0. Returns
+        "No Signal" for anything else, such as "?R1" when the controller did
+        not understand the command.
+        """
+        if len(reply) < 3 or reply[0] != "R" or reply[1] not in "+-":
+            return "No Signal"
         try:
-            # write the command
-            written = self.ser.write(command.encode('utf-8'))
-            time.sleep(0.005)
-            # read the output
-            read = self.ser.readline()
-            output = read.decode('utf-8')
-            #time.sleep(0.002)
-            #output = self._parse_output(read.decode('utf-8'))
-            prefix = output[0]
-            if prefix == "?":
-                value = "No Signal"
+            number = float(reply[2:])/10
+        except ValueError:
+            return "No Signal"
+        return -number if reply[1] == "-" else number
+
+    def _check_reply(self, command, reply, raw):
+        """
+        Returns the value of a reply to a command, or "No Signal" if it can't
+        be the answer to it: a reading command must get a reading in its
+        range, any other command a reply starting with its own letter.
+
+        raw : (bool) Whether to return the reply itself rather than the
+            number it holds.
+        """
+        if raw:
+            return reply if reply[:1] == command[:1] else "No Signal"
+        value = self._parse_reply(reply)
+        low, high = self._reply_ranges.get(command, (-np.inf, np.inf))
+        if value == "No Signal" or not low <= value <= high:
+            return "No Signal"
+        return value
+
+    def _drain(self, ser):
+        """
+        Reads and throws away whatever arrives on the port ser until it has
+        been quiet for the read timeout, so that late replies to earlier
+        commands can't be taken as replies to the next ones
+        """
+        if ser.in_waiting:
+            ser.read(ser.in_waiting)
+        for _ in range(100):
+            if not ser.read_until(b"\r"):
+                break
+        self._partial = b""
+        self._unsettled = False
+
+    def _read_replies(self, ser, n, deadline):
+        """
+        Reads n replies from the port ser, each terminated by a carriage
+        return, as they arrive. Stops early if nothing arrives within the read
+        timeout once the deadline (a time.monotonic() time) has passed.
+        Returns the replies read as strings.
+        """
+        replies = []
+        while len(replies) < n:
+            received = ser.read_until(b"\r")
+            if not received:
+                if time.monotonic() >= deadline:
+                    break
+                continue
+            self._partial += received
+            while b"\r" in self._partial and len(replies) < n:
+                reply, self._partial = self._partial.split(b"\r", 1)
+                replies.append(reply.decode('utf-8', errors='replace'))
+        return replies
+
+    def _exchange(self, ser, commands):
+        """
+        Writes commands to the port ser back to back and reads up to one
+        reply per command. Returns the replies read, in order.
+        """
+        message = "".join(commands).encode('utf-8')
+        written = ser.write(message)
+        # the replies can't all arrive before they have all been sent, at 10
+        # bits per byte. Readings are 7 bytes long.
+        wire_time = (len(message) + 7*len(commands))*10/self.baudrate
+        deadline = time.monotonic() + wire_time + self.read_timeout
+        replies = self._read_replies(ser, len(commands), deadline)
+        if self.debug:
+            print(f"wrote {written} bytes, got {replies}")
+        return replies
+
+    def query_many(self, commands, raw=False):
+        """
+        Sends several commands back to back, without waiting for each reply
+        before sending the next, then reads the replies as they arrive. The
+        controller answers commands in order, so the time taken is close to
+        the time needed to send everything at 9600 baud.
+
+        Returns the value of each reply, in the order of the commands, with
+        "No Signal" for a reply which isn't a valid answer to its command
+        (see _check_reply). Replies carry no record of which command they
+        answer, so if one goes missing the rest can't be matched up. In that
+        case whatever is still on its way is drained, and the commands are
+        sent again one at a time, which is slower but can't mix up replies.
+        Raises DeviceUnavailable straight away if the connection to the
+        controller is down.
+
+        commands : (list) The commands, each ending in a carriage return.
+        raw : (bool) Whether to return the replies as strings, without their
+            carriage returns, rather than the readings they hold. Defaults
+            to False.
+        """
+        # only one batch of commands may be on the wire at a time
+        with self.lock:
+            ser = self.connection.port
+            if ser is None:
+                raise DeviceUnavailable("the ITC502 is not connected")
+            values = ["No Signal"]*len(commands)
+            replies = []
+            try:
+                # throw away anything left over from a previous batch. If a
+                # reply went missing last time it may still be coming, so
+                # wait for the port to go quiet.
+                if self._unsettled:
+                    self._drain(ser)
+                elif ser.in_waiting:
+                    ser.read(ser.in_waiting)
+                self._partial = b""
+
+                replies = self._exchange(ser, commands)
+                if len(replies) < len(commands):
+                    self._drain(ser)
+                    replies = []
+                    for i, command in enumerate(commands):
+                        reply = self._exchange(ser, [command])
+                        if reply:
+                            replies.append(reply[0])
+                            values[i] = self._check_reply(command, reply[0],
+                                                          raw)
+                        else:
+                            self._drain(ser)
+                else:
+                    values = [self._check_reply(command, reply, raw)
+                              for command, reply in zip(commands, replies)]
+                    # a reply which doesn't fit may be a stray from an
+                    # earlier batch, so make sure nothing else is coming
+                    if "No Signal" in values:
+                        self._unsettled = True
+            except Exception as e:
+                if self.debug:
+                    print(f"sent {commands}, got {replies}")
+                    traceback.print_exc()
+                self._unsettled = True
+                self.connection.report_failure(e)
             else:
-                sign_symbol = output[1]
-                if sign_symbol == '+':
-                    sign = 1
+                # any reply at all means the controller is still there
+                if replies:
+                    self.connection.report_success()
                 else:
-                    sign = -1
-                value = sign*float(output[2:])/10
-            if self.debug:
-                print(f"wrote {written} bytes, got {read} with value {value}")
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
-        except Exception:
-            if self.debug:
-                print(f"wrote {written} bytes, got {read}")
-                traceback.print_exc()
-            value = "No Signal"
+                    self.connection.report_failure()
+            return values
 
-        return value
+    def _send_command(self, command, debug=False, raw=False):
+        try:
+            return self.query_many([command], raw=raw)[0]
+        except DeviceUnavailable:
+            return "No Signal"
 
     def get_temp(self, channel=None):
         """
@@ -139,8 +304,41 @@ class TemperatureController():
         value = self._send_command(command, debug=False)
         return value
 
+    def read_channels(self, indices):
+        """
+        Reads the values of the columns at the given indices of self.columns
+        from the controller, and returns them as a numpy array in the same
+        order as the indices, along with an array of their quality flags.
+        Values the controller did not give us are NaN, and flagged NO_SIGNAL.
+        Raises DeviceUnavailable straight away if the controller is not
+        connected.
+        """
+        values = self.query_many([self._commands[i] for i in indices])
+        no_signal = np.array([value == "No Signal" for value in values],
+                             dtype=bool)
+        values = np.array([np.nan if value == "No Signal" else value
+                           for value in values], dtype=float)
+        return values, np.where(no_signal, qualityFlags.NO_SIGNAL,
+                                0).astype(np.uint8)
+
+    def read_all(self):
+        """
+        Reads every value we record from the controller, and returns them as a
+        numpy array in the same order as self.columns. Values the controller
+        did not give us are NaN, as are all of them if it is not connected.
+        """
+        try:
+            return self.read_channels(range(len(self.columns)))[0]
+        except DeviceUnavailable:
+            return np.full(len(self.columns), np.nan)
+
     def get_heater_status_no(self, channel=None):
         command = "X\r"
-        value = self._send_command(command, debug=False)
+        value = self._send_command(command, debug=False, raw=True)
         return value
-        
\ No newline at end of file
+
+    def close(self):
+        """
+        Close the connection to the controller
+        """
+        self.connection.close()
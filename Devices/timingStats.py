@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+
+class RollingTimes():
+    """
+    Keeps the most recent durations of something, in seconds, so their
+    distribution can be looked at. Recording one is just a write into a
+    preallocated array, so it can be done on every call of a hot loop. The
+    statistics are only worked out when they are asked for.
+    """
+    # the edges of the histogram bins, in seconds: two per decade from 10 us
+    # up to 10 s, plus everything above that
+    bin_edges = np.concatenate([10.0**np.arange(-5, 1.01, 0.5), [np.inf]])
+
+    def __init__(self, size=1000):
+        """
+        size : (int) The number of recent durations kept. Defaults to 1000.
+        """
+        self.size = size
+        self._times = np.zeros(size)
+        self.count = 0     # the number recorded since creation
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """
+        Record one duration
+        """
+        with self._lock:
+            self._times[self.count % self.size] = seconds
+            self.count += 1
+
+    def recent(self):
+        """
+        Returns a copy of the durations kept, in no particular order
+        """
+        with self._lock:
+            return self._times[:min(self.count, self.size)].copy()
+
+    def summary(self):
+        """
+        Returns a dictionary with the number recorded ever ("count"), and the
+        median ("p50"), 95th percentile ("p95") and maximum ("max") of the
+        recent durations, which are NaN if there are none.
+        """
+        times = self.recent()
+        if len(times) == 0:
+            p50 = p95 = maximum = np.nan
+        else:
+            p50, p95 = np.percentile(times, [50, 95])
+            maximum = times.max()
+        return {"count":self.count, "p50":p50, "p95":p95, "max":maximum}
+
+    def histogram(self):
+        """
+        Returns the counts of the recent durations in each of the bins between
+        bin_edges
+        """
+        counts, _ = np.histogram(self.recent(), self.bin_edges)
+        return counts
+
+
+class TimingStats():
+    """
+    A collection of named RollingTimes, and counters, for seeing where the
+    time goes in the poll loop. The hardware manager times each tick, each of
+    its refresh functions and each device read, and counts ticks and reads
+    which took longer than they had.
+    """
+    def __init__(self, size=1000):
+        """
+        size : (int) The number of recent durations kept for each name.
+            Defaults to 1000.
+        """
+        self.size = size
+        self.times = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        times = self.times.get(name)
+        if times is None:
+            with self._lock:
+                times = self.times.setdefault(name, RollingTimes(self.size))
+        return times
+
+    def record(self, name, seconds):
+        """
+        Record a duration under a name, which is created if it is new
+        """
+        self._get(name).record(seconds)
+
+    def increment(self, name, n=1):
+        """
+        Add n to a counter, which starts at 0
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def counters_snapshot(self):
+        """
+        Returns a copy of the counters, safe to go through while they are
+        being incremented from other threads
+        """
+        with self._lock:
+            return dict(self.counters)
+
+    def _times_snapshot(self):
+        with self._lock:
+            return list(self.times.items())
+
+    def summaries(self):
+        """
+        Returns a dictionary of the summary of every name, see
+        RollingTimes.summary, in the order they were first recorded
+        """
+        return {name:times.summary() for name, times
+                in self._times_snapshot()}
+
+    def histograms(self):
+        """
+        Returns a dictionary of the histogram of every name, see
+        RollingTimes.histogram
+        """
+        return {name:times.histogram() for name, times
+                in self._times_snapshot()}
@@ -40,6 +40,11 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QListWidget,
     QListWidgetItem,
+    QListView,
+    QStyledItemDelegate,
+    QStyleOptionViewItem,
+    QStyleOptionButton,
+    QStyle,
     QLabel,
     QWidget,
     QFileDialog,
@@ -78,6 +83,183 @@ class ScanMplCanvas(FigureCanvasQTAgg):
             return_fig_and_ax=True)
         super(ScanMplCanvas, self).__init__(self.fig)
 
+
+class SpectrumListModel(QAbstractListModel):
+    """
+    The spectra of the spectrum list, for showing in a QListView. Each row is
+    one guiSpectrum: its name, with a check box for its visibility and a
+    swatch of its color. Spectra are added and removed a row at a time, and a
+    spectrum that changes only redraws its own row, so the list stays quick
+    with hundreds of spectra in it. Spectra can also be looked up by their
+    uniqueID.
+    """
+    def __init__(self, spectra):
+        """
+        spectra : (list) The guiSpectrum objects to start with. The model
+            keeps this list, and adds to and removes from it.
+        """
+        super().__init__()
+        self.spectra = spectra
+        self._by_id = {guiSpec.uniqueID:guiSpec for guiSpec in spectra}
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.spectra)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        guiSpec = self.spectra[index.row()]
+        if role == Qt.DisplayRole:
+            return guiSpec.spec.name
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if guiSpec.spec.visible else Qt.Unchecked
+        if role == Qt.DecorationRole:
+            return QColor(guiSpec.spec.color)
+        if role == Qt.ToolTipRole:
+            return guiSpec.uniqueID
+        if role == Qt.UserRole:
+            return guiSpec
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """
+        Ticking or unticking a spectrum's check box changes its visibility
+        """
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        guiSpec = self.spectra[index.row()]
+        if (value == Qt.Checked) != bool(guiSpec.spec.visible):
+            guiSpec.flip_visibility()
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def find(self, uniqueID):
+        """
+        Returns the guiSpectrum with a uniqueID, or None if it isn't listed
+        """
+        return self._by_id.get(uniqueID)
+
+    def row(self, guiSpec):
+        """
+        Returns the row of a guiSpectrum, or None if it isn't listed
+        """
+        if self._by_id.get(guiSpec.uniqueID) is not guiSpec:
+            return None
+        return self.spectra.index(guiSpec)
+
+    def append(self, guiSpec):
+        """
+        Add a guiSpectrum to the end of the list
+        """
+        row = len(self.spectra)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.spectra.append(guiSpec)
+        self._by_id[guiSpec.uniqueID] = guiSpec
+        self.endInsertRows()
+
+    def remove(self, guiSpec):
+        """
+        Take a guiSpectrum out of the list
+        """
+        row = self.row(guiSpec)
+        if row is None:
+            return None
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.spectra[row]
+        del self._by_id[guiSpec.uniqueID]
+        self.endRemoveRows()
+
+    def spectrum_changed(self, guiSpec):
+        """
+        Redraw the row of a guiSpectrum, after its name, color or visibility
+        has changed
+        """
+        row = self.row(guiSpec)
+        if row is None:
+            return None
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class SpectrumItemDelegate(QStyledItemDelegate):
+    """
+    Draws a row of the spectrum list: the check box, color swatch and name as
+    usual, then "cycle color" and "edit" buttons on the right. The buttons are
+    only painted, rather than being widgets of their own, so that a row costs
+    nothing until it is drawn.
+    """
+    buttons = ["cycle color", "edit"]
+
+    def _button_rects(self, option):
+        """
+        Returns the rectangles of the buttons in a row, left to right
+        """
+        height = option.fontMetrics.height() + 8
+        top = option.rect.top() + (option.rect.height() - height)//2
+        right = option.rect.right() - 2
+        rects = []
+        for text in reversed(self.buttons):
+            width = option.fontMetrics.horizontalAdvance(text) + 16
+            rects.insert(0, QRect(right - width, top, width, height))
+            right -= width + 4
+        return rects
+
+    def _item_option(self, option):
+        """
+        Returns a copy of the style options with the buttons' space taken off
+        the right, for the check box, swatch and name
+        """
+        rects = self._button_rects(option)
+        item_option = QStyleOptionViewItem(option)
+        item_option.rect = option.rect.adjusted(
+            0, 0, rects[0].left() - option.rect.right() - 4, 0)
+        return item_option
+
+    def paint(self, painter, option, index):
+        super().paint(painter, self._item_option(option), index)
+        style = (option.widget.style() if option.widget is not None
+                 else QApplication.style())
+        for text, rect in zip(self.buttons, self._button_rects(option)):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.State_Enabled | QStyle.State_Raised
+            style.drawControl(QStyle.CE_PushButton, button, painter,
+                              option.widget)
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        buttons_width = sum(option.fontMetrics.horizontalAdvance(text) + 20
+                            for text in self.buttons)
+        return QSize(size.width() + buttons_width,
+                     max(size.height(), option.fontMetrics.height() + 12))
+
+    def editorEvent(self, event, model, option, index):
+        """
+        Clicking a button cycles the spectrum's color or opens its edit
+        window. Anything else, such as ticking the check box, is handled as
+        usual.
+        """
+        if event.type() == QEvent.MouseButtonRelease \
+                and event.button() == Qt.LeftButton:
+            for text, rect in zip(self.buttons, self._button_rects(option)):
+                if rect.contains(event.pos()):
+                    guiSpec = index.data(Qt.UserRole)
+                    if text == "cycle color":
+                        guiSpec.cycle_color()
+                    else:
+                        guiSpec.editwindow.show()
+                    return True
+        return super().editorEvent(event, model, self._item_option(option),
+                                   index)
+
+
 class spectrumDisplayTab():
     def __init__(self, parent, debug):
         self.parent = parent
@@ -114,11 +296,16 @@ class spectrumDisplayTab():
         # ---------------------------
         # Spectrum Menu
         # ---------------------------
-        # a place to store our spectra
-        self.all_spectra = []
+        # a place to store our spectra, which the list model looks after
+        self.speclistModel = SpectrumListModel([])
+        self.all_spectra = self.speclistModel.spectra
 
         # display list of spectra
-        self.speclist = QListWidget()
+        self.speclist = QListView()
+        self.speclist.setModel(self.speclistModel)
+        self.speclistDelegate = SpectrumItemDelegate(self.speclist)
+        self.speclist.setItemDelegate(self.speclistDelegate)
+        self.speclist.setUniformItemSizes(True)
         self.speclist.setMinimumWidth(400)
 
         self.speclist.setSelectionMode(QAbstractItemView.ExtendedSelection)
@@ -133,12 +320,12 @@ class spectrumDisplayTab():
         self.stitchSpectraButton = QPushButton("Stitch Highlighted Spectra")
         self.listButtonsLayout.addWidget(self.stitchSpectraButton)
         self.stitchSpectraButton.pressed.connect(
-            lambda: self.stitch_spectra(self.speclist.selectedItems()))
+            lambda: self.stitch_spectra(self.selected_spectra()))
 
         # button for removing spectra
         self.remove_spec_btn = QPushButton("Remove Highlighted Spectra")
         self.remove_spec_btn.pressed.connect(
-            lambda: self.remove_spectra(self.speclist.selectedItems()))
+            lambda: self.remove_spectra(self.selected_spectra()))
         self.listButtonsLayout.addWidget(self.remove_spec_btn)
 
         self.listLayout.addLayout(self.listButtonsLayout)
@@ -153,7 +340,7 @@ class spectrumDisplayTab():
         
         self.eb_sdata = QPushButton("Export Highlighted Data")
         self.eb_sdata.pressed.connect(
-            lambda:self.export_sdata(self.speclist.selectedItems()))
+            lambda:self.export_sdata(self.selected_spectra()))
         self.bottomLayout.addWidget(self.eb_sdata)
 
         self.eb_adata = QPushButton("Export All Data")
@@ -177,8 +364,7 @@ class spectrumDisplayTab():
         # make the guiSpectrum object
         item_index = len(self.all_spectra)
         guiSpec = guiSpectrum(item_index, self, self.debug)
-        self.all_spectra.append(guiSpec)
-        self.refresh_spectrum_list()
+        self.speclistModel.append(guiSpec)
         self.mainWindow.log("Made new blank spectrum")
 
     def clear_plot(self):
@@ -196,55 +382,37 @@ class spectrumDisplayTab():
             self.mainWindow.log("Exported data for spectrum" +
                             f"{guiSpec.spec.name}")
 
-    def export_sdata(self, items):
+    def export_sdata(self, guiSpecs):
         """
         Export selected spectra
         """
-        for item in items:
-            for guiSpec in self.all_spectra:
-                if guiSpec.uniqueID == item.toolTip():
-                    guiSpec.export()
-                    self.mainWindow.log("Exported data for spectrum" +
-                                    f"{guiSpec.spec.name}")
+        for guiSpec in guiSpecs:
+            guiSpec.export()
+            self.mainWindow.log("Exported data for spectrum" +
+                            f"{guiSpec.spec.name}")
 
-    def refresh_spectrum_list(self):
+    def selected_spectra(self):
         """
-        Update the list of spectra
+        Returns the guiSpectrum objects highlighted in the spectrum list, in
+        the order they are listed
         """
-        self.speclist.clear()
-        for guiSpec in self.all_spectra:
-            guiSpec.make_list_item()
-            self.speclist.addItem(guiSpec.slItem)
-            self.speclist.setItemWidget(guiSpec.slItem, guiSpec.slItemWidget)
+        rows = sorted(index.row()
+                      for index in self.speclist.selectionModel().selectedRows())
+        return [self.all_spectra[row] for row in rows]
 
-    def remove_spectra(self, items):
+    def remove_spectra(self, guiSpecs):
         """
         Remove selected spectra from the spectrum list
         """
-        for item in items:
-            for guiSpec in self.all_spectra:
-                if guiSpec.uniqueID == item.toolTip():
-                    self.all_spectra.remove(guiSpec)
-                    self.mainWindow.log(f"Removed spectrum {guiSpec.spec.name}")
-        self.refresh_spectrum_list()
+        for guiSpec in guiSpecs:
+            self.speclistModel.remove(guiSpec)
+            self.mainWindow.log(f"Removed spectrum {guiSpec.spec.name}")
         self.update_plot()
 
-    def stitch_spectra(self, items):
+    def stitch_spectra(self, guiSpecs):
         """
         Take two spectra and make a new stitched spectrum
         """
-        # identify which spectra are selected
-        toolTips = []
-        for item in items:
-            toolTips.append(item.toolTip())
-        print(toolTips)
-        guiSpecs = []
-        for guiSpec in self.all_spectra:
-            print(guiSpec.uniqueID)
-            if guiSpec.uniqueID in toolTips:
-                guiSpecs.append(guiSpec)
-
-        #print(guiSpecs)
         spec_names = []
         for guiSpec in guiSpecs:
             spec_names.append(guiSpec.spec.name)
@@ -254,8 +422,7 @@ class spectrumDisplayTab():
         guiStitchedSpec = guiStitchedSpectrum(item_index, self, self.debug,
                                               guiSpecs)
         self.mainWindow.log(f"Stitched spectra: {spec_names}")
-        self.all_spectra.append(guiStitchedSpec)
-        self.refresh_spectrum_list()
+        self.speclistModel.append(guiStitchedSpec)
         self.update_plot()
     
 
@@ -334,8 +501,8 @@ class guiSpectrum():
                 self.parentWindow.update_plot()
             self.parentWindow.added_spectrum = True
 
-        # update list check box
-        self.slCheckBox.setText(self.spec.name)
+        # update the spectrum's row in the list
+        self.parentWindow.speclistModel.spectrum_changed(self)
         # update edit window name
         #self.editwindow.setWindowTitle(f'Edit Spectrum: {self.spec.name}')
         self.editwindow.refresh_name()
@@ -470,8 +637,8 @@ class guiSpectrum():
             return None
         # update Spectrum
         self.spec.change_name(name)
-        # update list check box
-        self.slCheckBox.setText(self.spec.name)
+        # update the spectrum's row in the list
+        self.parentWindow.speclistModel.spectrum_changed(self)
         # update edit window name
         #self.editwindow.setWindowTitle(f'Edit Spectrum: {self.spec.name}')
         self.editwindow.refresh_name()
@@ -486,31 +653,6 @@ class guiSpectrum():
         # update plot
         self.isOK(hide=False) #self.parentWindow.update_plot()   
 
-    def make_list_item(self):
-        """
-        """
-        # the name and visibility check box
-        self.slCheckBox = QCheckBox(self.spec.name)
-        self.slCheckBox.setChecked(self.spec.visible)
-        self.slCheckBox.stateChanged.connect(self.flip_visibility)
-        # the color cycler
-        self.slColorCycleButton = QPushButton("cycle color")
-        self.slColorCycleButton.clicked.connect(self.cycle_color)
-        # The edit window and button
-        self.slEditButton = QPushButton("edit")
-        self.slEditButton.clicked.connect(self.editwindow.show) 
-        self.item_layout = QHBoxLayout()
-        self.item_layout.addWidget(self.slCheckBox)
-        self.item_layout.addWidget(self.slColorCycleButton)
-        self.item_layout.addWidget(self.slEditButton)
-        self.slItem = QListWidgetItem()
-        self.slItemWidget = QWidget()
-        #self.sclItem = QListWidgetItem()
-        #self.sclItemWidget = QWidget()
-        self.slItem.setToolTip(self.uniqueID)
-        self.slItemWidget.setLayout(self.item_layout)
-        self.slItem.setSizeHint(self.slItemWidget.sizeHint())
-
     def export(self):
         """
         Export the spectrum
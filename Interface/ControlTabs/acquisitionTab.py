@@ -465,10 +465,9 @@ class AcquisitionTab():
         self.parameterGridLayout.setRowStretch(self.parameterGridLayout.rowCount(), 1)
         self.controlLayout.setRowStretch(self.controlLayout.rowCount(), 1)
 
-        # configure update timer to refresh the data
-        self.parent.hardwareManager.add_refresh_function(
-            self.refresh_controller
-        )
+        # refresh the data whenever the tab is showing
+        self.mainWindow.refreshScheduler.add(self.mwlLabel,
+                                             self.refresh_controller)
 
     def update_statusLabel(self, event):
         self.statusLabel.setText(event[10:])
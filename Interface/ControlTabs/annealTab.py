@@ -418,10 +418,9 @@ class AnnealTab():
         # this helps formatting the rows so they stay at the top of the tab
         self.activeLayout.setRowStretch(self.activeLayout.rowCount(), 1)
 
-        # configure update timer to refresh the data
-        self.parent.hardwareManager.add_refresh_function(
-            self.refresh_controller
-        )
+        # refresh the data whenever the tab is showing
+        self.parent.parentWindow.refreshScheduler.add(self.mtLabel,
+                                                      self.refresh_controller)
 
     def refresh_controller(self):
         """
@@ -429,9 +428,7 @@ class AnnealTab():
         """
         #measured_values = self.parent.hardwareManager.data.iloc[-1]
         #measured_values = self.parent.hardwareManager.buffer[-1]
-        measured_values = {}
-        for key in self.parent.hardwareManager.buffer:
-            measured_values[key] = self.parent.hardwareManager.buffer[key][-1]
+        measured_values = self.parent.hardwareManager.snapshot.latest
         # measured temperature
         self.mtLabel.setText(str(measured_values['Sample T (K)']))
         # current target temperature
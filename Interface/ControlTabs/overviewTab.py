@@ -144,23 +144,17 @@ class OverviewTab():
         # this helps formatting the rows so they stay at the top of the tab
         self.outerLayout.setRowStretch(self.outerLayout.rowCount(), 1)
 
-        # configure update timer to refresh the data
-        #self.parent.hardwareManager.add_refresh_function(
-        #    self.refresh_controller
-        #)
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.refresh)
-        self.timer.start(self.parent.hardwareManager.polling_rate)
+        # refresh the data whenever the tab is showing
+        self.parent.parentWindow.refreshScheduler.add(self.mtLabel,
+                                                      self.refresh)
 
     def refresh(self):
         """
         Update all values
         """
         #measured_values = self.parent.hardwareManager.buffer[-1]
-        measured_values = {}
         try:
-            for key in self.parent.hardwareManager.buffer:
-                measured_values[key]=self.parent.hardwareManager.buffer[key][-1]
+            measured_values = self.parent.hardwareManager.snapshot.latest
             # measured temperature
             self.mtLabel.setText(str(measured_values['Sample T (K)']))
             # current target temperature
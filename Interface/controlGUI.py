@@ -1,6 +1,8 @@
 import sys
 import os
 import inspect
+import time
+import traceback
 import pandas as pd
 
 from datetime import datetime
@@ -95,6 +97,7 @@ class TimescanPlot():
         self.hardwareManager = self.parent.hardwareManager
         self.debug = debug
         self.yDataName = yData
+        self.refreshScheduler = self.parent.parentWindow.refreshScheduler
 
         # what can we plot, and in what style?
         self.yItems = {
@@ -121,6 +124,11 @@ class TimescanPlot():
         self.yMenu.setCurrentText(self.yDataName)
         self.yMenu.currentTextChanged.connect(self._update_yAxis)
 
+        # browse the archive instead of following the latest data
+        self.historyBox = QCheckBox("History")
+        self.historyBox.setToolTip("Pan and zoom through the archived data")
+        self.historyBox.stateChanged.connect(self._history_mode_changed)
+
         self.figureWidget = pg.PlotWidget(
                 self.parent.parentWindow,
                 axisItems={'bottom':pg.DateAxisItem(orientation='bottom')}
@@ -135,11 +143,18 @@ class TimescanPlot():
 
         self.data_line1 = self.figureWidget.plot([], [])
         self.data_line2 = self.figureWidget.plot([], []) # None
+        # the lines being drawn, and the column each one shows
+        self.series = []
 
         self._update_yAxis()
+        # when zoomed or panned by hand, redraw for what is now in view
+        self.figureWidget.sigXRangeChanged.connect(self._view_changed)
 
         # add items to the layout
-        self.layout.addWidget(self.yMenu)
+        self.menuLayout = QHBoxLayout()
+        self.menuLayout.addWidget(self.yMenu, 1)
+        self.menuLayout.addWidget(self.historyBox)
+        self.layout.addLayout(self.menuLayout)
         self.layout.addWidget(self.figureWidget)
 
 
@@ -173,32 +188,100 @@ class TimescanPlot():
         self.data_line1.clear()
         self.data_line2.clear()
 
-    def refresh_plot(self):
-        # get the latest data from the hardware manager
-        data = self.hardwareManager.buffer
+        # the legend and pens only change along with what is shown
         self.figureLegend.clear()
-
-        #xData = [datetime.timestamp(row['Time']) for row in data]
-        xData = list(data['Timestamp'])
         if self.yDataName == 'Temperatures (K)':
-            y1 = 'Sample T (K)'
-            #y1Data = [row[y1] for row in data]
-            y1Data = list(data[y1])
-            self.data_line1.setData(xData, y1Data,
-                                    pen=self.yItems[y1]['pen'], name=y1)
-            self.figureLegend.addItem(self.data_line1, y1)
-            y2 = 'Setpoint T (K)'
-            #y2Data = [row[y2] for row in data]
-            y2Data = list(data[y2])
-            self.data_line2.setData(xData, y2Data,
-                                    pen=self.yItems[y2]['pen'], name=y2)
-            self.figureLegend.addItem(self.data_line2, y2)
+            self.series = [(self.data_line1, 'Sample T (K)'),
+                           (self.data_line2, 'Setpoint T (K)')]
+            for line, column in self.series:
+                line.setPen(self.yItems[column]['pen'])
+                self.figureLegend.addItem(line, column)
         else:
-            #yData = [row[self.yDataName] for row in data]
-            yData = list(data[self.yDataName])
-            self.data_line1.setData(xData, yData,
-                                    pen=self.yItems[self.yDataName]['pen'],
-                                    name=self.yDataName)
+            self.series = [(self.data_line1, self.yDataName)]
+            self.data_line1.setPen(self.yItems[self.yDataName]['pen'])
+
+        # replot straight away, even if there's no new data
+        self.refreshScheduler.invalidate(self.refresh_plot)
+        if self.historyBox.isChecked():
+            self._draw_history()
+
+    def _history_mode_changed(self):
+        """
+        Switch between following the latest data and browsing the archive.
+        Browsing starts with the last week in view.
+        """
+        viewBox = self.figureWidget.getViewBox()
+        if self.historyBox.isChecked():
+            viewBox.disableAutoRange(axis=pg.ViewBox.XAxis)
+            now = time.time()
+            # this redraws, through _view_changed
+            self.figureWidget.setXRange(now - 7*24*3600, now, padding=0)
+        else:
+            viewBox.enableAutoRange(axis=pg.ViewBox.XAxis)
+            self.refreshScheduler.invalidate(self.refresh_plot)
+
+    def _view_changed(self):
+        """
+        Redraw at the next refresh when the x range has been changed by hand,
+        since a different part of the history is now in view. When the plot
+        is following the data, it changes range on its own with every redraw.
+        When browsing the archive, redraw straight away.
+        """
+        if self.historyBox.isChecked():
+            self._draw_history()
+        elif not self.figureWidget.getViewBox().autoRangeEnabled()[0]:
+            self.refreshScheduler.invalidate(self.refresh_plot)
+
+    def _draw_history(self):
+        """
+        Draw what is in view from the archive, and a view's width either side
+        of it, loading only the tiles of the archive this needs
+        """
+        x0, x1 = self.figureWidget.getViewBox().viewRange()[0]
+        try:
+            data = self.hardwareManager.archiveHistory.get(
+                2*x0 - x1, 2*x1 - x0, 3*max(self.figureWidget.width(), 100),
+                [column for _, column in self.series]
+            )
+        except Exception:
+            if self.debug:
+                print("Unable to read the archive")
+                traceback.print_exc()
+            return None
+        for line, column in self.series:
+            line.setData(data['Timestamp'], data[column])
+
+    def refresh_plot(self):
+        # the archive is drawn when the view changes, not on every refresh
+        if self.historyBox.isChecked():
+            return None
+        # get the latest data from the hardware manager, if there is any
+        data = self.hardwareManager.snapshot
+        if len(data) == 0:
+            return None
+
+        # when following the data, the whole buffer is in view. Otherwise
+        # we take what is in view and a view's width either side of it, so
+        # there's something to see straight away when panning.
+        viewBox = self.figureWidget.getViewBox()
+        if viewBox.autoRangeEnabled()[0]:
+            t0 = data['Timestamp'][0]
+            t1 = data['Timestamp'][-1] + 1
+            n_views = 1
+        else:
+            x0, x1 = viewBox.viewRange()[0]
+            t0, t1 = 2*x0 - x1, 2*x1 - x0
+            n_views = 3
+
+        # about a point per pixel, if there is more data than that. These are
+        # views of the buffer when it isn't decimated, so nothing is copied
+        # or converted before pyqtgraph gets it.
+        _, data = self.hardwareManager.history.select(
+            t0, t1, n_views*max(self.figureWidget.width(), 100),
+            [column for _, column in self.series]
+        )
+        for line, column in self.series:
+            line.setData(data['Timestamp'], data[column])
         
 
 class ControlTab():
@@ -341,9 +424,10 @@ class ControlTab():
 
         self.outerLayout.addWidget(self.splitter)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.refresh_figures)
-        self.timer.start(self.hardwareManager.polling_rate)
+        # each plot is only redrawn while it can be seen
+        for plot in (self.plot1, self.plot2, self.plot3):
+            self.parentWindow.refreshScheduler.add(plot.figureWidget,
+                                                   plot.refresh_plot)
 
     def refresh_history(self, event):
         scrollbar = self.historyList.verticalScrollBar()
@@ -352,11 +436,6 @@ class ControlTab():
         if at_bottom:
             self.historyList.scrollToBottom()
 
-    def refresh_figures(self):
-        self.plot1.refresh_plot()
-        self.plot2.refresh_plot()
-        self.plot3.refresh_plot()
-
     def start_timescan(self):
         self.hardwareManager.start_timescan_collection()
         self.collectionStatusLabel.setText("Recording Timescan!")
@@ -10,6 +10,8 @@ sys.path.insert(0, maindir)
 
 from datetime import datetime
 
+import numpy as np
+
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
@@ -170,19 +172,15 @@ class bigNumbersViewWindow(QWidget):
 
         self.setLayout(self.outerLayout)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.refresh)
-        self.timer.start(self.parent.hardwareManager.polling_rate)
+        self.parent.refreshScheduler.add(self, self.refresh)
 
     def refresh(self):
         """
         Update all values
         """
         #measured_values = self.parent.hardwareManager.buffer[-1]
-        measured_values = {}
         try:
-            for key in self.parent.hardwareManager.buffer:
-                measured_values[key]=self.parent.hardwareManager.buffer[key][-1]
+            measured_values = self.parent.hardwareManager.snapshot.latest
             # measured temperature
             self.mtLabel.setText(str(measured_values['Sample T (K)']))
             # current target temperature
@@ -239,6 +237,38 @@ class configViewWindow(QWidget):
         self.outerLayout.addWidget(self.PRLabel)
         self.outerLayout.addItem(self.verticalSpacer)
 
+        self.DPRLabel = QLabel(
+            'Device Polling Rate =  '
+            f'{self.parent.config.get("device_polling_rate", 250)} ms'
+        )
+        self.DPRLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.DPRLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
+        self.BPRLabel = QLabel(
+            'Burst Polling Rate =  '
+            f'{self.parent.config.get("burst_polling_rate", 50)} ms'
+        )
+        self.BPRLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.BPRLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
+        self.GRRLabel = QLabel(
+            'GUI Refresh Rate =  '
+            f'{self.parent.config.get("gui_refresh_rate", 250)} ms'
+        )
+        self.GRRLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.GRRLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
+        self.ASLabel = QLabel(
+            'Autosave Interval =  '
+            f'{self.parent.config.get("autosave_interval", 60)} s'
+        )
+        self.ASLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.ASLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
         self.setLayout(self.outerLayout)
 
     def refresh(self):
@@ -248,8 +278,120 @@ class configViewWindow(QWidget):
         self.PRLabel.setText(
             f'Polling Rate =  {self.parent.config["polling_rate"]} ms'
         )
+        self.DPRLabel.setText(
+            'Device Polling Rate =  '
+            f'{self.parent.config.get("device_polling_rate", 250)} ms'
+        )
+        self.BPRLabel.setText(
+            'Burst Polling Rate =  '
+            f'{self.parent.config.get("burst_polling_rate", 50)} ms'
+        )
+        self.GRRLabel.setText(
+            'GUI Refresh Rate =  '
+            f'{self.parent.config.get("gui_refresh_rate", 250)} ms'
+        )
+        self.ASLabel.setText(
+            'Autosave Interval =  '
+            f'{self.parent.config.get("autosave_interval", 60)} s'
+        )
+
+    def show_window(self):
+        self.show()
+
+
+class diagnosticsViewWindow(QWidget):
+    """
+    A window for seeing where the time goes in the hardware poll loop: how
+    long each tick, refresh function and device read takes, how late the timer
+    fires, and how often ticks and reads overrun. It also shows the health of
+    the serial connections. It updates itself once a second while it is open.
+    """
+    # characters for drawing histograms, from empty to full
+    bars = " ▁▂▃▄▅▆▇█"
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+
+        self.setWindowTitle('DUVET Diagnostics')
+
+        # define fonts
+        self.titleFontA = QFont("Arial", 15)
+        self.valueFontA = QFont("Consolas", 12)
+
+        self.outerLayout = QVBoxLayout()
+
+        # this is good for making things a little easier to read
+        self.verticalSpacer = QSpacerItem(10, 10)   # x, y
+
+        self.timesTitle = QLabel("Poll loop timing (recent calls)")
+        self.timesTitle.setFont(self.titleFontA)
+        self.outerLayout.addWidget(self.timesTitle)
+
+        self.timesLabel = QLabel()
+        self.timesLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.timesLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
+        self.countersTitle = QLabel("Overruns")
+        self.countersTitle.setFont(self.titleFontA)
+        self.outerLayout.addWidget(self.countersTitle)
+
+        self.countersLabel = QLabel()
+        self.countersLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.countersLabel)
+        self.outerLayout.addItem(self.verticalSpacer)
+
+        self.connectionsTitle = QLabel("Connections")
+        self.connectionsTitle.setFont(self.titleFontA)
+        self.outerLayout.addWidget(self.connectionsTitle)
+
+        self.connectionsLabel = QLabel()
+        self.connectionsLabel.setFont(self.valueFontA)
+        self.outerLayout.addWidget(self.connectionsLabel)
+
+        self.setLayout(self.outerLayout)
+
+        # the statistics change all the time, not just with the snapshot
+        self.parent.refreshScheduler.add(self, self.refresh, versioned=False,
+                                         interval=1)
+
+    def refresh(self):
+        """
+        Update the tables from the hardware manager's timing statistics
+        """
+        stats = self.parent.hardwareManager.timingStats
+        histograms = stats.histograms()
+        lines = [f"{'':32s}{'calls':>8s}{'p50 (ms)':>11s}{'p95 (ms)':>11s}"
+                 f"{'max (ms)':>11s}  10us .. 10s"]
+        for name, summary in stats.summaries().items():
+            counts = histograms[name]
+            heights = np.ceil(counts/max(counts.max(), 1)*(len(self.bars)-1))
+            histogram = "".join(self.bars[int(h)] for h in heights)
+            lines.append(f"{name[:31]:32s}{summary['count']:8d}"
+                         f"{summary['p50']*1000:11.2f}"
+                         f"{summary['p95']*1000:11.2f}"
+                         f"{summary['max']*1000:11.2f}  {histogram}")
+        self.timesLabel.setText("\n".join(lines))
+
+        counters = [f"{name:32s}{count:8d}"
+                    for name, count
+                    in sorted(stats.counters_snapshot().items())]
+        self.countersLabel.setText("\n".join(counters) or "None")
+
+        connections = []
+        health = self.parent.hardwareManager.connection_health()
+        for name, device in health.items():
+            line = (f"{name:12s}{device['state']:14s}"
+                    f"{device['failures']:3d} failures in a row, "
+                    f"{device['reconnects']} reconnect attempts")
+            if device['last_error'] is not None:
+                line += f", last error {device['last_error']}"
+            connections.append(line)
+        self.connectionsLabel.setText("\n".join(connections))
 
     def show_window(self):
+        self.refresh()
         self.show()
 
 
@@ -0,0 +1,100 @@
+import time
+import traceback
+
+from PyQt5.QtCore import QTimer, Qt
+
+class RefreshScheduler():
+    """
+    Refreshes every part of the GUI which shows live data from one timer, so
+    that the GUI redraws at its own frame rate rather than each window and tab
+    running a timer of its own at the polling rate.
+
+    Each refresh function is registered along with the widget it draws into.
+    On every frame it is skipped if that widget can't be seen (it is on
+    another tab, scrolled or split out of view, or its window is closed or
+    minimised), and, for those which only show the hardware manager's data,
+    if the snapshot hasn't changed since it last ran. A function skipped
+    while hidden runs on the first frame after it can be seen again. This
+    keeps the Qt event loop, which the hardware manager's collector shares
+    the process with, mostly idle.
+    """
+    def __init__(self, hardwareManager, interval, debug):
+        """
+        hardwareManager : (HardwareManager) Where the snapshot is published.
+        interval : (int) The time in milliseconds between frames.
+        debug : (bool) Whether to print debug information.
+        """
+        self.hardwareManager = hardwareManager
+        self.interval = interval
+        self.debug = debug
+
+        # the registered refresh functions, in the order they were added
+        self.entries = []
+
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.CoarseTimer)
+        self.timer.timeout.connect(self.refresh)
+
+    def add(self, widget, function, versioned=True, interval=None):
+        """
+        Register a function to be called on every frame.
+
+        widget : (QWidget) The widget the function draws into. The function
+            isn't called while it can't be seen.
+        function : (function) Called with no arguments to refresh the widget.
+        versioned : (bool) Whether the function only shows the hardware
+            manager's snapshot, so needn't be called again until a new one is
+            published. Defaults to True.
+        interval : (float) The shortest time in seconds between calls, for
+            functions which don't need calling every frame. Defaults to None,
+            for every frame.
+        """
+        self.entries.append({"widget":widget, "function":function,
+                             "versioned":versioned, "interval":interval,
+                             "version":None, "last":-float("inf")})
+
+    def invalidate(self, function):
+        """
+        Call a registered function on the next frame it can be seen, even if
+        the snapshot hasn't changed, for example because what it shows has
+        been changed by hand
+        """
+        for entry in self.entries:
+            if entry["function"] == function:
+                entry["version"] = None
+                entry["last"] = -float("inf")
+
+    def start(self):
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.timer.stop()
+
+    def refresh(self):
+        """
+        Call the registered functions which are due and can be seen
+        """
+        start = time.monotonic()
+        version = self.hardwareManager.snapshot.version
+        for entry in self.entries:
+            widget = entry["widget"]
+            # isVisible() is still true for a widget scrolled out of its
+            # scroll area or squashed to nothing by a splitter, but then none
+            # of it is left unclipped
+            if (not widget.isVisible() or widget.window().isMinimized()
+                    or widget.visibleRegion().isEmpty()):
+                continue
+            if entry["versioned"] and entry["version"] == version:
+                continue
+            if (entry["interval"] is not None
+                    and start - entry["last"] < entry["interval"]):
+                continue
+            entry["version"] = version
+            entry["last"] = start
+            try:
+                entry["function"]()
+            except Exception:
+                if self.debug:
+                    traceback.print_exc()
+        self.hardwareManager.timingStats.record("gui frame",
+                                                time.monotonic() - start)
@@ -22,7 +22,9 @@ import json
 sys.path.insert(0, 'Interface')
 import analysisGUI
 import controlGUI
-from generalElements import configViewWindow, bigNumbersViewWindow
+from generalElements import (configViewWindow, bigNumbersViewWindow,
+                             diagnosticsViewWindow)
+from refreshScheduler import RefreshScheduler
 
 sys.path.insert(0, 'Devices')
 import hardwareManager
@@ -120,6 +122,13 @@ class MainWindow(QMainWindow):
         self.hardwareThread.start()
         self.hardwareManager = self.collectorWorker.hardwareManager
 
+        # everything showing live data is redrawn from one timer, at its own
+        # rate, see refreshScheduler.RefreshScheduler
+        self.refreshScheduler = RefreshScheduler(
+            self.hardwareManager, self.config.get("gui_refresh_rate", 250),
+            self.debug
+        )
+
         # create the queue which schedules and runs user defined operations
         
 
@@ -127,6 +136,7 @@ class MainWindow(QMainWindow):
         # Setup accessory windows
         # ---------------------------------------------------------------------
         self.configWindow = configViewWindow(self)
+        self.diagnosticsWindow = diagnosticsViewWindow(self)
         self.bigNumbersWindow = bigNumbersViewWindow(self, self.debug)
         
         # ---------------------------------------------------------------------
@@ -173,6 +183,11 @@ class MainWindow(QMainWindow):
         self.CCAction.triggered.connect(self.configWindow.show_window)
         self.fileMenu.addAction(self.CCAction)
 
+        self.DiagAction = QAction(QtGui.QIcon("./Icons/magnifyingGlass.png"),
+                                  "DUVET Diagnostics", self)
+        self.DiagAction.triggered.connect(self.diagnosticsWindow.show_window)
+        self.fileMenu.addAction(self.DiagAction)
+
         self.helpAction = QAction(QtGui.QIcon("./Icons/sad.png"),
                                         "Help", self)
         self.helpAction.setStatusTip("Ahhhhhhhhh")
@@ -201,6 +216,8 @@ class MainWindow(QMainWindow):
         self.centralWidget.setLayout(self.layout)
         self.setCentralWidget(self.centralWidget)
 
+        self.refreshScheduler.start()
+
         self.log("Started DUVET!")
         if self.debug:
             self.log("Debug mode is ON. Exciting!")
@@ -272,10 +289,11 @@ class MainWindow(QMainWindow):
             if reply2 == QMessageBox.Yes:
                 self.log("Quitting DUVET")
                 self._save_log()
+                self.refreshScheduler.stop()
                 self.hardwareManager.dump_buffer()
                 save_config(self.config)
                 self.log("Closing ConSys API")
-                self.hardwareManager.ConSysInterface.close()
+                self.hardwareManager.close()
                 self.log("ConSys API closed")
                 event.accept()
             else:
@@ -0,0 +1,954 @@
+# -----------------------------------------------------------------------------
+# DUVET Device Test Suite
+#
+# Tests of the hardware side of DUVET (the Devices folder), which run without
+# the GUI or any hardware, using the simulated devices where they need one.
+# Run them from this folder, since the device modules read config.json:
+#
+#     python -m unittest test_devices
+# -----------------------------------------------------------------------------
+
+import copy
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, 'Devices')
+import ConSysInterface as CSI
+import bufferSnapshot
+import bufferWriter
+import datWriter
+import decimatedHistory
+import devicePoller
+import historyTiles
+import outlierFilter
+import photosensorAmplifierC932901 as PS
+import qualityFlags
+import ringBuffer
+import sampleJournal
+import serialConnection
+import tempControllerITC502 as TC
+
+
+def simulate(module, overrides=None):
+    """
+    Make a device module use the simulated hardware, with some simulation
+    settings overridden. Returns a function which puts its config back.
+    """
+    original = module.config_file
+    config = copy.deepcopy(original)
+    config["simulate_hardware"] = True
+    for device, device_settings in (overrides or {}).items():
+        config.setdefault("simulation", {}).setdefault(device, {}).update(
+            device_settings)
+    module.config_file = config
+    def restore():
+        module.config_file = original
+    return restore
+
+
+class TemperatureControllerTestCase(unittest.TestCase):
+    """
+    A collection of tests of the ITC502's pipelined queries, against a
+    simulated controller which loses and delays replies.
+    """
+    def setUp(self):
+        self.addCleanup(simulate(TC, {"ITC502":{"drop_rate":0.05,
+                                                "timeout_rate":0.05}}))
+        self.controller = TC.TemperatureController(debug=False)
+        self.addCleanup(self.controller.close)
+
+    def test_lost_replies_are_not_shifted(self):
+        """
+        Test that a lost or late reply never puts another command's reading
+        into a column
+        """
+        n_missing = 0
+        for i in range(40):
+            values = self.controller.read_all()
+            n_missing += np.isnan(values).sum()
+            T, setpoint, power, P, I, D = values
+            # the simulated PID terms are fixed, so any other value there
+            # answered another command
+            self.assertTrue(np.isnan(P) or P == 5.0, values)
+            self.assertTrue(np.isnan(I) or I == 1.0, values)
+            self.assertTrue(np.isnan(D) or D == 0.0, values)
+            self.assertTrue(np.isnan(T) or T > 100, values)
+            self.assertTrue(np.isnan(setpoint) or setpoint > 100, values)
+            self.assertTrue(np.isnan(power) or 0 <= power <= 99.9, values)
+        # lost replies are asked for again rather than given up on
+        self.assertLess(n_missing, 0.1*40*6)
+
+    def test_heater_status(self):
+        """
+        Test that replies which aren't readings can still be read
+        """
+        self.controller.connection.port.timing.drop_rate = 0
+        self.controller.connection.port.timing.timeout_rate = 0
+        self.assertEqual(self.controller.get_heater_status_no(),
+                         "X0A1C3S00H1L0")
+        self.assertEqual(self.controller.get_P(), 5.0)
+
+
+class RingBufferTestCase(unittest.TestCase):
+    """
+    A collection of tests of the buffer, mostly around where it runs out of
+    room and moves its rows into fresh storage
+    """
+    def setUp(self):
+        self.buffer = ringBuffer.RingBuffer(['Time', 'Timestamp', 'x'], 8)
+
+    def append(self, first, last):
+        for i in range(first, last):
+            self.buffer.append({'Timestamp':1000.0 + i, 'x':i}, {'x':i % 4})
+
+    def test_keeps_newest_rows(self):
+        """
+        Test that the newest rows are kept, in order with their flags, after
+        the storage has been moved several times
+        """
+        self.append(0, 23)
+        self.assertEqual(len(self.buffer), 8)
+        self.assertEqual(self.buffer.total, 23)
+        np.testing.assert_array_equal(self.buffer['x'], np.arange(15, 23))
+        np.testing.assert_array_equal(self.buffer.flags('x'),
+                                      np.arange(15, 23) % 4)
+        self.assertEqual(self.buffer.latest(['x', 'Timestamp']),
+                         {'x':22.0, 'Timestamp':1022.0})
+        self.assertEqual(len(self.buffer['Time']), 8)
+
+    def test_views_survive_relocation(self):
+        """
+        Test that views taken before the storage moves keep their values
+        """
+        self.append(0, 8)
+        before = self.buffer.last(3, ['x'])['x']
+        self.append(8, 20)
+        np.testing.assert_array_equal(before, [5, 6, 7])
+
+    def test_since_past_a_wrap(self):
+        """
+        Test that since() gives each row once, and skips rows which fell out
+        of the buffer before they were asked for
+        """
+        self.append(0, 5)
+        rows, cursor = self.buffer.since(0, ['x'])
+        np.testing.assert_array_equal(rows['x'], np.arange(5))
+        self.append(5, 11)
+        rows, cursor = self.buffer.since(cursor, ['x'])
+        np.testing.assert_array_equal(rows['x'], np.arange(5, 11))
+        self.append(11, 30)
+        rows, cursor = self.buffer.since(cursor, ['x'])
+        np.testing.assert_array_equal(rows['x'], np.arange(22, 30))
+        values, flags, first, next_cursor = self.buffer.since_arrays(25)
+        np.testing.assert_array_equal(values[1], np.arange(25, 30))
+        np.testing.assert_array_equal(flags[1], np.arange(25, 30) % 4)
+        self.assertEqual((first, next_cursor), (25, 30))
+        rows, cursor = self.buffer.since(cursor, ['x'])
+        self.assertEqual(len(rows['x']), 0)
+
+    def test_between(self):
+        """
+        Test that between() gives the rows strictly inside a time range, with
+        their flags
+        """
+        self.append(0, 13)
+        rows = self.buffer.between(1007, 1010, ['x'])
+        np.testing.assert_array_equal(rows['x'], [8, 9])
+        flags = self.buffer.flags_between(1007, 1010, ['x'])
+        np.testing.assert_array_equal(flags['x'], [0, 1])
+        rows = self.buffer.between(0, 1006, ['x'])
+        np.testing.assert_array_equal(rows['x'], [5])
+
+
+class BufferSnapshotTestCase(unittest.TestCase):
+    """
+    A collection of tests of the snapshot of the buffer published for the
+    GUI
+    """
+    def setUp(self):
+        self.buffer = ringBuffer.RingBuffer(['Timestamp', 'x'], 8)
+
+    def publish(self, version):
+        return bufferSnapshot.BufferSnapshot(version, *self.buffer.views())
+
+    def test_read_only(self):
+        """
+        Test that nothing in a snapshot can be changed
+        """
+        self.buffer.append([1000.0, 1.0], [0, qualityFlags.STALE])
+        snapshot = self.publish(1)
+        with self.assertRaises(ValueError):
+            snapshot['x'][0] = 5
+        with self.assertRaises(ValueError):
+            snapshot.flags['x'][0] = 0
+        with self.assertRaises(TypeError):
+            snapshot.columns['x'] = np.zeros(1)
+        with self.assertRaises(TypeError):
+            snapshot.latest['x'] = 5
+        self.assertEqual(snapshot.latest_flags['x'], qualityFlags.STALE)
+
+    def test_unchanged_by_appends(self):
+        """
+        Test that a snapshot keeps showing the rows it was published with,
+        while the buffer carries on filling and moving its storage
+        """
+        for i in range(6):
+            self.buffer.append([1000.0 + i, i])
+        snapshot = self.publish(1)
+        for i in range(6, 30):
+            self.buffer.append([1000.0 + i, i])
+        self.assertEqual(len(snapshot), 6)
+        np.testing.assert_array_equal(snapshot['x'], np.arange(6))
+        self.assertEqual(snapshot.latest['x'], 5)
+        self.assertEqual(self.publish(2).latest['x'], 29)
+
+    def test_empty(self):
+        """
+        Test that a snapshot of an empty buffer has NaN latest values
+        """
+        snapshot = self.publish(0)
+        self.assertEqual(len(snapshot), 0)
+        self.assertTrue(np.isnan(snapshot.latest['x']))
+        self.assertEqual(snapshot.latest_flags['x'], 0)
+
+
+class HampelFilterTestCase(unittest.TestCase):
+    """
+    A collection of tests of the streaming outlier filter
+    """
+    def test_spike(self):
+        """
+        Test that a spike is flagged in its own channel only, and that nothing
+        is flagged before the window is half full
+        """
+        hampel = outlierFilter.HampelFilter(2, window=7, min_deviation=1)
+        rng = np.random.default_rng(0)
+        flagged = []
+        for i in range(40):
+            values = 295 + 0.1*rng.standard_normal(2)
+            if i in (2, 20):
+                values[0] = 305
+            flagged.append(hampel.update(values))
+        flagged = np.array(flagged)
+        self.assertFalse(flagged[2].any())
+        np.testing.assert_array_equal(np.flatnonzero(flagged[:, 0]), [20])
+        self.assertFalse(flagged[:, 1].any())
+
+    def test_step(self):
+        """
+        Test that a real step is flagged for at most half a window
+        """
+        hampel = outlierFilter.HampelFilter(1, window=7, min_deviation=1)
+        values = np.concatenate([np.full(10, 100.0), np.full(10, 200.0)])
+        values += np.tile([0, 0.1], 10)
+        flagged = np.array([hampel.update([value])[0] for value in values])
+        self.assertTrue(flagged[10])
+        self.assertLessEqual(flagged.sum(), 7//2 + 1)
+        self.assertFalse(flagged[14:].any())
+
+    def test_nan(self):
+        """
+        Test that NaNs are never outliers and don't upset the window
+        """
+        hampel = outlierFilter.HampelFilter(1, window=5)
+        for value in [1.0, 1.1, np.nan, 0.9, 1.0, np.nan]:
+            self.assertFalse(hampel.update([value])[0])
+        self.assertTrue(hampel.update([50.0])[0])
+
+
+class BufferWriterTestCase(unittest.TestCase):
+    """
+    A collection of tests of saving the buffer to the archive
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.buffer = ringBuffer.RingBuffer(['Time', 'DateTime', 'Timestamp',
+                                             'x'], 50)
+        self.writer = bufferWriter.BufferWriter(self.buffer, self.directory,
+                                                interval=60, debug=False)
+
+    def append(self, timestamps):
+        for timestamp in timestamps:
+            self.buffer.append({'Timestamp':timestamp, 'x':timestamp % 7})
+
+    def read_archive(self):
+        return bufferWriter.read_between(self.directory, -np.inf, np.inf)
+
+    def test_incremental(self):
+        """
+        Test that each save appends only the rows which arrived since the
+        last one, so no row is saved twice or missed
+        """
+        self.append(np.arange(1000, 1020))
+        self.assertEqual(self.writer.flush(), 20)
+        self.assertEqual(self.writer.flush(), 0)
+        self.append(np.arange(1020, 1045))
+        self.assertEqual(self.writer.flush(), 25)
+        archived = self.read_archive()
+        np.testing.assert_array_equal(archived['Timestamp'],
+                                      np.arange(1000, 1045))
+        np.testing.assert_array_equal(archived['x'],
+                                      np.arange(1000, 1045) % 7)
+
+    def test_stop_saves_the_rest(self):
+        """
+        Test that stopping the background saves saves whatever is left
+        """
+        self.writer.start()
+        self.append(np.arange(1000, 1010))
+        self.writer.stop()
+        np.testing.assert_array_equal(self.read_archive()['Timestamp'],
+                                      np.arange(1000, 1010))
+
+    def test_line_endings(self):
+        """
+        Test that every line of a partition ends in "\\n", like its index
+        line, even where the platform's line ending is "\\r\\n"
+        """
+        with mock.patch.object(os, "linesep", "\r\n"):
+            self.append(np.arange(1000, 1010))
+            self.writer.flush()
+            self.append(np.arange(1010, 1020))
+            self.writer.flush()
+        path = bufferWriter.partitions_between(self.directory, 999, 1020)[0]
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")
+        # the index, the header, the rows, and nothing after the last "\n"
+        self.assertEqual(len(lines), 1 + 1 + 20 + 1)
+        self.assertEqual(lines[-1], b"")
+        self.assertFalse(any(line.endswith(b"\r") for line in lines))
+        self.assertEqual(len(self.read_archive()), 20)
+
+    def test_midnight_and_full_partitions(self):
+        """
+        Test that rows go into the partition of their local date, that a full
+        partition carries on in the next one, and that each index matches its
+        rows after being rewritten
+        """
+        self.writer.max_rows = 30
+        midnight = time.mktime((2024, 3, 2, 0, 0, 0, 0, 0, -1))
+        self.append(midnight + np.arange(-10, 0))
+        self.writer.flush()
+        self.append(midnight + np.arange(0, 45))
+        self.writer.flush()
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(names, ["2024-03-01.csv", "2024-03-02.csv",
+                                 "2024-03-02_1.csv"])
+        expected = {"2024-03-01.csv":midnight + np.arange(-10, 0),
+                    "2024-03-02.csv":midnight + np.arange(0, 30),
+                    "2024-03-02_1.csv":midnight + np.arange(30, 45)}
+        for name, timestamps in expected.items():
+            path = os.path.join(self.directory, name)
+            self.assertEqual(bufferWriter.read_index(path),
+                             (timestamps[0], timestamps[-1], len(timestamps)))
+            df = bufferWriter.pd.read_csv(path, skiprows=1)
+            np.testing.assert_array_equal(df['Timestamp'], timestamps)
+        # the index is rewritten in place as rows are added
+        self.append(midnight + np.arange(45, 50))
+        self.writer.flush()
+        path = os.path.join(self.directory, "2024-03-02_1.csv")
+        self.assertEqual(bufferWriter.read_index(path),
+                         (midnight + 30, midnight + 49, 20))
+        self.assertEqual(len(bufferWriter.pd.read_csv(path, skiprows=1)), 20)
+        np.testing.assert_array_equal(
+            bufferWriter.partitions_between(self.directory, midnight - 2,
+                                            midnight + 1),
+            [os.path.join(self.directory, "2024-03-01.csv"),
+             os.path.join(self.directory, "2024-03-02.csv")])
+
+
+def legacy_dat_lines(columns, col_width=15, float_decimals=5):
+    """
+    Formats columns of data a value at a time, the way save_data used to
+    write them, for checking datWriter against
+    """
+    lines = []
+    for row in zip(*columns):
+        line = ""
+        for value in row:
+            if isinstance(value, float):
+                value = f"{value:.{float_decimals}f}"
+            line += str(value).ljust(col_width)
+        lines.append(line.rstrip() + "\n")
+    return "".join(lines)
+
+
+class DatWriterTestCase(unittest.TestCase):
+    """
+    A collection of tests that the .dXX writer formats data exactly as
+    save_data always has
+    """
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        n = 2000
+        magnitudes = 10.0**rng.integers(-8, 12, n)
+        floats = rng.standard_normal(n)*magnitudes
+        # ties between two roundings, values too long for their field, and
+        # values which aren't numbers
+        floats[:12] = [0.000005, 0.000015, 2.5e-6, 1.234565, -1.234565,
+                       123456789.123456, -12345678.5, 1e16, -0.0, np.nan,
+                       np.inf, -np.inf]
+        whole = rng.integers(-10**6, 10**6, n)
+        times = np.array([f"{h:02d}:{m:02d}:{s:02d}" for h, m, s
+                          in rng.integers(0, 60, (n, 3))])
+        self.columns = [floats, whole, times, np.round(floats, 2)]
+
+    def test_format_matches_legacy(self):
+        """
+        Test that every line matches the legacy formatting character for
+        character
+        """
+        expected = legacy_dat_lines([column.tolist()
+                                     for column in self.columns])
+        self.assertEqual(datWriter.format_fixed_width(self.columns), expected)
+        expected = legacy_dat_lines([column.tolist()
+                                     for column in self.columns], 12, 3)
+        self.assertEqual(datWriter.format_fixed_width(self.columns, 12, 3),
+                         expected)
+
+    def test_file_matches_legacy(self):
+        """
+        Test that a whole .dXX file matches the legacy one byte for byte
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "Scan1.d01")
+        header_lines = [";Start wavelength (nm)         120",
+                        ";  Sample: test"]
+        names = ["Ch0/V", "n", "Time", "Ch1/V"]
+        datWriter.write_dat_file(path, header_lines, names, self.columns)
+        header_row = ";" + "".join(name.ljust(15) for name in names)
+        expected = ("".join(line + "\n" for line in header_lines)
+                    + header_row.rstrip() + "\n"
+                    + legacy_dat_lines([column.tolist()
+                                        for column in self.columns]))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), expected.encode())
+
+
+class PhotosensorTestCase(unittest.TestCase):
+    """
+    A collection of tests of the photosensor's background streaming reader,
+    against a simulated amplifier
+    """
+    def setUp(self):
+        self.addCleanup(simulate(PS))
+        self.photosensor = PS.Photosensor(debug=False)
+        self.addCleanup(self.photosensor.close)
+
+    def test_parse_line(self):
+        """
+        Test that measurements are read as signed 16 bit hex
+        """
+        parse = self.photosensor._parse_line
+        self.assertEqual(parse("+7FFF"), 5.0)
+        self.assertEqual(parse("-7FFF"), -5.0)
+        self.assertEqual(parse("0000"), 0.0)
+        self.assertAlmostEqual(parse("+1EB8"), 7864*5/32767)
+        self.assertTrue(np.isnan(parse("+XYZW")))
+        self.assertTrue(np.isnan(parse("?")))
+
+    def test_streaming(self):
+        """
+        Test that measurements arrive in the background, in order, and that
+        the latest one is given without waiting on the amplifier
+        """
+        time.sleep(0.5)
+        timestamps, volts = self.photosensor.get_samples(10)
+        self.assertGreater(len(volts), 10)
+        self.assertTrue((np.diff(timestamps) > 0).all())
+        self.assertTrue((np.abs(volts - 1.2) < 0.2).all())
+        # it only reads the buffer, which takes well under a millisecond, but
+        # the limit is loose so a busy machine doesn't fail it
+        start = time.monotonic()
+        values, flags = self.photosensor.read_channels([0])
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(values[0], self.photosensor.get_latest()[0])
+        self.assertEqual(flags[0], 0)
+        self.assertAlmostEqual(self.photosensor.get_window_average(10),
+                               volts.mean(), delta=0.05)
+
+    def test_clock(self):
+        """
+        Test that measurements are timestamped, and aged, on the clock the
+        photosensor is given
+        """
+        offset = [1e6]
+
+        def clock():
+            return time.time() + offset[0], time.monotonic()
+
+        photosensor = PS.Photosensor(debug=False, clock=clock)
+        self.addCleanup(photosensor.close)
+        time.sleep(0.2)
+        photosensor.stop()
+        timestamps, volts = photosensor.get_samples(10)
+        self.assertGreater(len(volts), 0)
+        self.assertGreater(timestamps[0], time.time() + 1e6 - 10)
+        self.assertFalse(np.isnan(photosensor.get_output()))
+        offset[0] += 2*photosensor.max_age
+        self.assertTrue(np.isnan(photosensor.get_output()))
+
+    def test_old_output(self):
+        """
+        Test that the output is NaN, and flagged, once the measurements have
+        stopped for longer than max_age
+        """
+        time.sleep(0.2)
+        self.photosensor.stop()
+        self.photosensor.max_age = 0.05
+        time.sleep(0.1)
+        values, flags = self.photosensor.read_channels([0])
+        self.assertTrue(np.isnan(values[0]))
+        self.assertEqual(flags[0], qualityFlags.NO_SIGNAL)
+
+
+class FakePort():
+    """
+    Stands in for a serial port, recording whether it was closed
+    """
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SerialConnectionTestCase(unittest.TestCase):
+    """
+    A collection of tests of the circuit breaker and reconnecting with
+    backoff
+    """
+    def open_port(self):
+        """
+        Opens a FakePort, or fails while self.failing is more than 0
+        """
+        self.attempts.append(time.monotonic())
+        if self.failing > 0:
+            self.failing -= 1
+            raise OSError("unplugged")
+        return FakePort()
+
+    def setUp(self):
+        self.attempts = []
+        self.failing = 0
+
+    def connect(self, **kwargs):
+        connection = serialConnection.SerialConnection(
+            "test", self.open_port, debug=False, **kwargs)
+        self.addCleanup(connection.close)
+        return connection
+
+    def wait_until_up(self, connection, timeout=2):
+        end = time.monotonic() + timeout
+        while not connection.is_up and time.monotonic() < end:
+            time.sleep(0.005)
+
+    def test_circuit_opens(self):
+        """
+        Test that the port is closed only after failure_threshold failures in
+        a row, and reopened in the background
+        """
+        connection = self.connect(failure_threshold=3, min_backoff=0.01)
+        port = connection.port
+        connection.report_failure()
+        connection.report_failure()
+        connection.report_success()
+        connection.report_failure()
+        connection.report_failure()
+        self.assertTrue(connection.is_up)
+        connection.report_failure(OSError("gone"))
+        self.assertFalse(connection.is_up)
+        self.assertTrue(port.closed)
+        self.assertIn("gone", connection.health()["last_error"])
+        self.wait_until_up(connection)
+        self.assertTrue(connection.is_up)
+        self.assertEqual(connection.health()["state"], "connected")
+        self.assertEqual(len(self.attempts), 2)
+
+    def test_backoff(self):
+        """
+        Test that the time between attempts to reconnect doubles up to
+        max_backoff, and only resets once the device answers
+        """
+        self.failing = 5
+        # record how long the reconnect thread is told to wait each time,
+        # rather than timing the gaps, which a busy machine stretches
+        waits = []
+        real_wait = serialConnection.threading.Event.wait
+
+        def wait(event, timeout=None):
+            waits.append((event, timeout))
+            return real_wait(event, timeout)
+
+        with mock.patch.object(serialConnection.threading.Event, "wait",
+                               wait):
+            connection = self.connect(min_backoff=0.02, max_backoff=0.08)
+            self.assertFalse(connection.is_up)
+            self.wait_until_up(connection)
+        self.assertTrue(connection.is_up)
+        waits = [timeout for event, timeout in waits
+                 if event is connection._stop_event]
+        self.assertEqual(waits, [0.02, 0.04, 0.08, 0.08, 0.08])
+        # the waits can only ever run long
+        gaps = np.diff(self.attempts)
+        self.assertEqual(len(gaps), len(waits))
+        for gap, timeout in zip(gaps, waits):
+            self.assertGreaterEqual(gap, timeout*0.5)
+        # reopening isn't enough to reset the backoff
+        self.assertEqual(connection._backoff, 0.08)
+        connection.report_success()
+        self.assertEqual(connection._backoff, 0.02)
+
+
+class DevicePollerTestCase(unittest.TestCase):
+    """
+    A collection of tests of when a device poller's values count as stale
+    """
+    def test_stale_by_deadline(self):
+        """
+        Test that a channel is stale when it hasn't been read in its interval
+        plus stale_after before the deadline it is judged at
+        """
+        clock = [1000.0]
+        poller = devicePoller.DevicePoller(
+            "test", lambda indices: (np.ones(len(indices)),
+                                     np.zeros(len(indices))),
+            ["fast", "slow"], interval=0.25, debug=False,
+            channel_intervals={"slow":(10, False)}, stale_after=0.5,
+            clock=lambda: (clock[0], clock[0]))
+        # nothing has been read yet
+        self.assertTrue(poller.get_stale(1000.0).all())
+        poller._channel_times = np.array([1000.0, 1000.0])
+        np.testing.assert_array_equal(poller.get_stale(1000.5),
+                                      [False, False])
+        np.testing.assert_array_equal(poller.get_stale(1000.6),
+                                      [True, False])
+        np.testing.assert_array_equal(poller.get_stale(1010.6), [True, True])
+        # judged now, on the poller's clock, without a deadline
+        clock[0] = 1000.6
+        np.testing.assert_array_equal(poller.get_stale(), [True, False])
+
+
+class SampleJournalTestCase(unittest.TestCase):
+    """
+    A collection of tests of recovering the rows journaled before a crash
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "journal.bin")
+        self.buffer = ringBuffer.RingBuffer(['Time', 'Timestamp', 'x'], 100)
+        self.journal = sampleJournal.SampleJournal(self.path, self.buffer,
+                                                   debug=False)
+        self.addCleanup(self.journal.close)
+
+    def append(self, first, last):
+        for i in range(first, last):
+            self.buffer.append([1000.0 + i, i], [0, i % 3])
+        self.journal.write_new()
+
+    def test_recover(self):
+        """
+        Test that every journaled row comes back, with its flags and derived
+        columns
+        """
+        self.append(0, 10)
+        self.append(10, 15)
+        recovered = sampleJournal.recover(self.path)
+        self.assertEqual(recovered.keys(), ['Time', 'Timestamp', 'x'])
+        np.testing.assert_array_equal(recovered['x'], np.arange(15))
+        np.testing.assert_array_equal(recovered.flags('x'),
+                                      np.arange(15) % 3)
+        self.assertEqual(len(recovered['Time']), 15)
+
+    def test_checkpoint(self):
+        """
+        Test that rows before the checkpoint aren't recovered, and that an
+        emptied journal recovers nothing
+        """
+        self.append(0, 10)
+        self.journal.checkpoint(6)
+        np.testing.assert_array_equal(
+            sampleJournal.recover(self.path)['x'], np.arange(6, 10))
+        self.journal.max_size = 0
+        self.journal.checkpoint(10)
+        self.assertEqual(os.path.getsize(self.path), sampleJournal.HEADER_SIZE)
+        self.assertIsNone(sampleJournal.recover(self.path))
+        self.append(10, 12)
+        np.testing.assert_array_equal(
+            sampleJournal.recover(self.path)['x'], [10, 11])
+
+    def test_compacted_while_rows_arrive(self):
+        """
+        Test that the journal is compacted even though rows are always
+        journaled between the buffer writer taking the rows to archive and
+        moving the checkpoint past them, and that those rows are kept
+        """
+        record_size = self.journal._dtype.itemsize
+        self.journal.max_size = sampleJournal.HEADER_SIZE + 40*record_size
+        archived = 0
+        for first in range(0, 600, 12):
+            self.append(first, first + 10)
+            _, cursor = self.buffer.since(archived)
+            self.append(first + 10, first + 12)
+            self.journal.checkpoint(cursor)
+            archived = cursor
+        self.assertLessEqual(os.path.getsize(self.path),
+                             self.journal.max_size + 12*record_size)
+        np.testing.assert_array_equal(
+            sampleJournal.recover(self.path)['x'], [598, 599])
+        # and it carries on journaling into the compacted file
+        self.append(600, 603)
+        np.testing.assert_array_equal(
+            sampleJournal.recover(self.path)['x'], [598, 599, 600, 601, 602])
+
+    def test_torn_tail(self):
+        """
+        Test that a record cut short by a crash is ignored, and the records
+        before it still recovered
+        """
+        self.append(0, 5)
+        self.journal.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(size - 3)
+        np.testing.assert_array_equal(
+            sampleJournal.recover(self.path)['x'], np.arange(4))
+
+    def test_not_a_journal(self):
+        """
+        Test that a missing or foreign file recovers nothing
+        """
+        self.assertIsNone(sampleJournal.recover(self.path + ".missing"))
+        with open(self.path + ".other", "wb") as f:
+            f.write(b"something else")
+        self.assertIsNone(sampleJournal.recover(self.path + ".other"))
+
+
+class DecimatedHistoryTestCase(unittest.TestCase):
+    """
+    A collection of tests of the min/max decimation of the buffer
+    """
+    def setUp(self):
+        self.buffer = ringBuffer.RingBuffer(['Timestamp', 'x'], 100)
+        self.history = decimatedHistory.DecimatedHistory(
+            self.buffer, ['x'], raw_interval=1, tiers=((10, 50), (60, 50)))
+
+    def append(self, timestamps, values, flags=None):
+        if flags is None:
+            flags = np.zeros(len(values))
+        for timestamp, value, flag in zip(timestamps, values, flags):
+            self.buffer.append([timestamp, value], [0, flag])
+        self.history.update()
+
+    def test_min_max(self):
+        """
+        Test that each bucket keeps the minimum and maximum of its rows,
+        including those folded in over several updates
+        """
+        timestamps = np.arange(1000, 1125)
+        values = np.sin(timestamps/7)
+        self.append(timestamps[:33], values[:33])
+        self.append(timestamps[33:], values[33:])
+        width, selected = self.history.select(1000, 1125, 40)
+        self.assertEqual(width, 10)
+        # the bucket still being filled is included
+        np.testing.assert_array_equal(selected['Timestamp'][::2],
+                                      np.arange(1000, 1130, 10))
+        for i, start in enumerate(np.arange(1000, 1130, 10)):
+            bucket = values[(timestamps >= start) & (timestamps < start + 10)]
+            self.assertEqual(selected['x'][2*i], bucket.min())
+            self.assertEqual(selected['x'][2*i + 1], bucket.max())
+
+    def test_outliers_left_out(self):
+        """
+        Test that values flagged as outliers don't stretch their bucket, which
+        still keeps the flag
+        """
+        flags = np.zeros(30)
+        flags[15] = qualityFlags.OUTLIER
+        values = np.ones(30)
+        values[15] = 1000
+        self.append(np.arange(1020, 1050), values, flags)
+        width, selected = self.history.select(1020, 1050, 2)
+        self.assertEqual(width, 60)
+        np.testing.assert_array_equal(selected['x'], [1, 1])
+        ring = self.history.tiers[0]
+        self.assertTrue(ring.flags('x min')[1] & qualityFlags.OUTLIER)
+
+    def test_buffer_when_fine_enough(self):
+        """
+        Test that a short enough range comes from the buffer itself
+        """
+        self.append(np.arange(1000, 1030), np.arange(30.0))
+        width, selected = self.history.select(999, 1030, 100)
+        self.assertEqual(width, 0)
+        np.testing.assert_array_equal(selected['x'], np.arange(30.0))
+
+
+class HistoryTilesTestCase(unittest.TestCase):
+    """
+    A collection of tests of browsing the buffer writer's archive
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.buffer = ringBuffer.RingBuffer(['Time', 'DateTime', 'Timestamp',
+                                             'x'], 1000)
+        self.writer = bufferWriter.BufferWriter(self.buffer, self.directory,
+                                                interval=60, debug=False)
+
+    def open_tiles(self):
+        tiles = historyTiles.HistoryTiles(self.directory, ['x'], 1, False,
+                                          widths=(10, 60), tile_buckets=10)
+        self.addCleanup(tiles.stop)
+        self.writer.write_functions.append(tiles.partition_written)
+        return tiles
+
+    def wait_for_background(self, tiles, timeout=5):
+        end = time.monotonic() + timeout
+        while tiles._queued and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def append(self, timestamps):
+        for timestamp in timestamps:
+            self.buffer.append({'Timestamp':timestamp, 'x':timestamp % 7})
+        self.writer.flush()
+
+    def test_written_rows_are_found(self):
+        """
+        Test that rows written after the archive was opened can be browsed,
+        raw and decimated
+        """
+        self.append(np.arange(1000, 1100))
+        tiles = self.open_tiles()
+        self.append(np.arange(1100, 1200))
+        selected = tiles.get(1050, 1150, 1000)
+        np.testing.assert_array_equal(selected['Timestamp'],
+                                      np.arange(1051, 1150))
+        selected = tiles.get(999, 1200, 50)
+        np.testing.assert_array_equal(selected['Timestamp'][::2],
+                                      np.arange(1000, 1200, 10))
+        np.testing.assert_array_equal(selected['x'][:2], [0, 6])
+
+    def test_written_rows_are_added(self):
+        """
+        Test that rows written to a partition already loaded are added to its
+        cached rows and summary, rather than it being parsed again
+        """
+        self.append(np.arange(1000, 1105))
+        tiles = self.open_tiles()
+        tiles.get(999, 1105, 1000)
+        tiles.get(999, 1105, 50)
+        with mock.patch.object(historyTiles.pd, "read_csv",
+                               side_effect=AssertionError("parsed again")):
+            self.append(np.arange(1105, 1150))
+            self.append(np.arange(1150, 1200))
+            selected = tiles.get(999, 1200, 1000)
+            np.testing.assert_array_equal(selected['Timestamp'],
+                                          np.arange(1000, 1200))
+            selected = tiles.get(999, 1200, 50)
+        np.testing.assert_array_equal(selected['Timestamp'][::2],
+                                      np.arange(1000, 1200, 10))
+        # the bucket split between two writes has the minimum and maximum
+        # of both
+        np.testing.assert_array_equal(selected['x'][20:22], [0, 6])
+
+    def test_legacy_dump(self):
+        """
+        Test that a dump without an index line is indexed, once, and can be
+        browsed
+        """
+        path = os.path.join(self.directory, "2020-01-01.csv")
+        with open(path, "w") as f:
+            f.write("Time,DateTime,Timestamp,x\n")
+            for timestamp in range(500, 600):
+                f.write(f"a,b,{timestamp},{timestamp % 7}\n")
+        # it is indexed in the background
+        tiles = self.open_tiles()
+        self.wait_for_background(tiles)
+        self.assertEqual(tiles._index(path), (500, 599, 100))
+        selected = tiles.get(549, 560, 1000)
+        np.testing.assert_array_equal(selected['x'],
+                                      np.arange(550, 560) % 7)
+        # the index is saved, and used straight away while the dump is
+        # unchanged
+        original = historyTiles._index_legacy
+        def fail(*args):
+            raise AssertionError("indexed again")
+        historyTiles._index_legacy = fail
+        try:
+            self.assertEqual(self.open_tiles()._index(path), (500, 599, 100))
+        finally:
+            historyTiles._index_legacy = original
+
+    def test_stop(self):
+        """
+        Test that the prefetch thread stops
+        """
+        tiles = self.open_tiles()
+        thread = tiles._thread
+        tiles.stop()
+        self.assertFalse(thread.is_alive())
+
+
+class ReadTimingTestCase(unittest.TestCase):
+    """
+    A benchmark of read_all() of each simulated device, with its default
+    latencies, as in "python Devices/simulatedHardware.py". The limits are
+    ten times what the reads take on an idle machine, so they only catch a
+    read getting an order of magnitude slower (such as the ITC502 going back
+    to a query at a time) and don't fail on a busy one. Run the benchmark in
+    simulatedHardware.py for the actual figures.
+    """
+    def time_reads(self, module, make_device, n_reads):
+        self.addCleanup(simulate(module))
+        device = make_device(debug=False)
+        self.addCleanup(device.close)
+        times = []
+        for i in range(n_reads):
+            start = time.perf_counter()
+            device.read_all()
+            times.append(time.perf_counter() - start)
+        return np.median(times)
+
+    def test_temperature_controller(self):
+        """
+        Test that the six ITC502 queries are sent together, in one write, and
+        take well under a second
+        """
+        self.addCleanup(simulate(TC, {"ITC502":{"drop_rate":0,
+                                                "timeout_rate":0}}))
+        controller = TC.TemperatureController(debug=False)
+        self.addCleanup(controller.close)
+        port = controller.connection.port
+        with mock.patch.object(port, "write", wraps=port.write) as write:
+            for i in range(5):
+                controller.read_all()
+        self.assertEqual(write.call_count, 5)
+        self.assertLess(self.time_reads(TC, TC.TemperatureController, 30), 1)
+
+    def test_photosensor(self):
+        """
+        Test that the photosensor output never waits on the amplifier
+        """
+        self.assertLess(self.time_reads(PS, PS.Photosensor, 100), 0.01)
+
+    def test_consys(self):
+        """
+        Test that the ConSys read takes well under the polling interval
+        """
+        self.assertLess(self.time_reads(CSI, CSI.ConSysInterface, 30), 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,11 +30,13 @@ class SpectrumDisplayTabTestCase(unittest.TestCase):
         # check
         self.assertEqual(len(self.SDT.all_spectra), 1)
         # remove the item from the speclist
-        item = self.SDT.speclist.item(0)
-        self.SDT.remove_spectra([item])
+        guiSpec = self.SDT.all_spectra[0]
+        self.assertIs(self.SDT.speclistModel.find(guiSpec.uniqueID), guiSpec)
+        self.SDT.remove_spectra([guiSpec])
         # check
         self.assertEqual(len(self.SDT.all_spectra), 0)
-        self.assertEqual(self.SDT.speclist.item(0), None)
+        self.assertEqual(self.SDT.speclistModel.rowCount(), 0)
+        self.assertEqual(self.SDT.speclistModel.find(guiSpec.uniqueID), None)
 
 
 class guiSpectrumTestCase(unittest.TestCase):
@@ -45,7 +47,6 @@ class guiSpectrumTestCase(unittest.TestCase):
         self.SDT = specGUI.spectrumDisplayTab(debug=False)
         self.guiSpec = specGUI.guiSpectrum(index=0, parentWindow=self.SDT,
                                            debug=False)
-        self.guiSpec.make_list_item()
 
     def test_color_change(self):
         """